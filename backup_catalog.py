@@ -0,0 +1,72 @@
+import os
+import threading
+
+from storage import read_json_file, write_json_file
+
+
+class BackupCatalog:
+    """
+    Local list of the backups uploaded to the backup channel, so restores
+    can fetch the right message by id instead of scanning channel history.
+    One entry per backup, oldest first:
+        {"message", "filename", "generation", "kind": "full"|"delta",
+         "size", "sha256", "created", "checkpoint", "seq"}
+    checkpoint/seq are only set for deltas. add() mutates on the event loop,
+    save() writes a copy from any thread.
+    """
+
+    def __init__(self, path, keep=500):
+        self.path = path
+        self.keep = keep
+        self.lock = threading.Lock()
+        self.entries = []
+        if os.path.exists(path):
+            try:
+                self.entries = read_json_file(path)["backups"]
+            except Exception as e:
+                print(f"[backup] catalog {path} unreadable, starting empty: {e!r}")
+
+    def add(self, entry):
+        self.entries.append(entry)
+        del self.entries[:-self.keep]
+
+    def save(self):
+        with self.lock:
+            write_json_file(self.path, {"backups": list(self.entries)}, indent=2)
+
+    def clear(self):
+        self.entries = []
+
+    # ---------------------- LOOKUPS ---------------------- #
+    def max_generation(self):
+        return max((e["generation"] for e in self.entries), default=0)
+
+    def recent(self, n=10):
+        """Newest first."""
+        return self.entries[::-1][:n]
+
+    def find(self, generation):
+        return next((e for e in reversed(self.entries) if e["generation"] == generation), None)
+
+    def chain(self, generation=None):
+        """
+        (checkpoint, [deltas]) needed to restore a generation (default: the
+        newest backup); (None, []) if the catalog doesn't know one.
+        """
+        target = self.entries[-1] if generation is None and self.entries else self.find(generation)
+        if target is None:
+            return None, []
+        if target["kind"] == "full":
+            return target, []
+        checkpoint = next(
+            (e for e in self.entries if e["kind"] == "full" and e["filename"] == target["checkpoint"]),
+            None
+        )
+        if checkpoint is None:
+            return None, []
+        deltas = [
+            e for e in self.entries
+            if e["kind"] == "delta" and e["checkpoint"] == checkpoint["filename"]
+            and e["seq"] <= target["seq"]
+        ]
+        return checkpoint, deltas
@@ -0,0 +1,138 @@
+import hashlib
+import json
+import lzma
+import zlib
+
+from serializers import CompactJSON, StreamDecoder
+
+MANIFEST_FORMAT = "casino-backup-manifest-1"
+MANIFEST_SUFFIX = ".manifest.json"
+CODECS = {"gzip": ".gz", "lzma": ".xz"}
+
+
+class BackupError(ValueError):
+    """A backup is incomplete, corrupted or not a backup at all."""
+
+
+def _compressor(codec):
+    if codec == "gzip":
+        return zlib.compressobj(6, zlib.DEFLATED, 31)
+    if codec == "lzma":
+        return lzma.LZMACompressor(preset=6)
+    raise BackupError(f"unknown codec: {codec!r}")
+
+
+def _decompressor(codec):
+    if codec == "gzip":
+        return zlib.decompressobj(31)
+    if codec == "lzma":
+        return lzma.LZMADecompressor()
+    raise BackupError(f"unknown codec: {codec!r}")
+
+
+def is_manifest_name(filename):
+    return filename.endswith(MANIFEST_SUFFIX)
+
+
+def pack_backup(doc, base, codec="gzip", part_size=8_000_000, serializer=None):
+    """
+    Stream `doc` through the compressor and cut the output into parts of at
+    most `part_size` bytes. Returns (manifest, [(filename, bytes)]); the
+    caller adds whatever it needs to find the parts again. The serializer
+    (compact JSON by default) hands the document over piece by piece, so
+    it is never encoded as a whole.
+    """
+    if part_size <= 0:
+        raise ValueError("part_size must be positive")
+    serializer = serializer or CompactJSON()
+    comp = _compressor(codec)
+    ext = CODECS[codec]
+    raw_hash = hashlib.sha256()
+    raw_size = 0
+    parts = []
+    out = bytearray()
+
+    def cut(final=False):
+        while len(out) >= part_size or (final and out):
+            data = bytes(out[:part_size])
+            del out[:part_size]
+            parts.append((f"{base}.part{len(parts) + 1:03d}{ext}", data))
+
+    for raw in serializer.iter_dumps(doc):
+        raw_hash.update(raw)
+        raw_size += len(raw)
+        out += comp.compress(raw)
+        cut()
+    out += comp.flush()
+    cut(final=True)
+
+    manifest = {
+        "format": MANIFEST_FORMAT,
+        "codec": codec,
+        "serializer": serializer.name,
+        "raw_size": raw_size,
+        "raw_sha256": raw_hash.hexdigest(),
+        "parts": [
+            {"name": name, "size": len(data), "sha256": hashlib.sha256(data).hexdigest()}
+            for name, data in parts
+        ],
+    }
+    return manifest, parts
+
+
+def read_manifest(raw):
+    try:
+        manifest = json.loads(raw.decode("utf-8"))
+    except ValueError as e:
+        raise BackupError(f"manifest is not valid JSON: {e}") from None
+    if not isinstance(manifest, dict) or manifest.get("format") != MANIFEST_FORMAT:
+        raise BackupError("not a backup manifest")
+    return manifest
+
+
+class Unpacker:
+    """
+    Rebuilds a packed backup part by part: every part is checked against
+    its manifest entry, decompressed and decoded as it arrives, so neither
+    the parts nor the decompressed stream are kept; the stream is checked
+    against raw_sha256 before finish() returns the document.
+    """
+
+    def __init__(self, manifest):
+        self.manifest = manifest
+        self.decomp = _decompressor(manifest["codec"])
+        self.decoder = StreamDecoder()
+        self.raw_size = 0
+        self.raw_hash = hashlib.sha256()
+        self.next_part = 0
+
+    def feed(self, name, data):
+        parts = self.manifest["parts"]
+        if self.next_part >= len(parts):
+            raise BackupError(f"unexpected extra part {name}")
+        entry = parts[self.next_part]
+        if name != entry["name"]:
+            raise BackupError(f"expected part {entry['name']}, got {name}")
+        if len(data) != entry["size"] or hashlib.sha256(data).hexdigest() != entry["sha256"]:
+            raise BackupError(f"checksum mismatch in {name}")
+        try:
+            raw = self.decomp.decompress(data)
+        except (zlib.error, lzma.LZMAError) as e:
+            raise BackupError(f"cannot decompress {name}: {e}") from None
+        self.raw_hash.update(raw)
+        self.raw_size += len(raw)
+        try:
+            self.decoder.feed(raw)
+        except ValueError as e:
+            raise BackupError(f"cannot decode {name}: {e}") from None
+        self.next_part += 1
+
+    def finish(self):
+        if self.next_part != len(self.manifest["parts"]):
+            raise BackupError(f"missing parts: got {self.next_part} of {len(self.manifest['parts'])}")
+        if self.raw_size != self.manifest["raw_size"] or self.raw_hash.hexdigest() != self.manifest["raw_sha256"]:
+            raise BackupError("decompressed data does not match the manifest")
+        try:
+            return self.decoder.finish()
+        except ValueError as e:
+            raise BackupError(f"cannot decode the backup: {e}") from None
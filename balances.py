@@ -0,0 +1,179 @@
+from array import array
+
+from rank_index import RankIndex
+
+try:
+    import numpy as np
+except ImportError:   # optional: the array('d') fallback does the same work in Python loops
+    np = None
+
+
+class BalanceColumn:
+    """
+    Every user's balance in one flat float64 column, indexed by a dense
+    slot per user. Economy-wide commands (tax, giveall, ...) run over the
+    column at once instead of loading records one by one.
+
+    Uses NumPy when it is installed, array('d') otherwise. The column is the
+    authority for balances: adjust_gems() writes through to it and records
+    read from storage take their balance from it. `ranks` follows every
+    change, so leaderboard queries never sort the column.
+    """
+
+    # a bulk update touching more than this share of users rebuilds `ranks` in one sort
+    RERANK_SHARE = 0.25
+
+    def __init__(self, balances=()):
+        self.reset(balances)
+
+    def reset(self, balances):
+        """Rebuild from [(uid, gems)] (startup, restores)."""
+        self.slots = {}       # int uid -> slot
+        self.uids = array("q")  # slot -> int uid
+        self.size = 0
+        self.values = np.zeros(1024) if np is not None else array("d")
+        self.ranks = RankIndex()
+        for uid, gems in balances:
+            self._store(uid, gems)
+        self.ranks.reset(zip(self.uids, self.values[:self.size].tolist()))
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, uid):
+        return int(uid) in self.slots
+
+    def get(self, uid, default=None):
+        slot = self.slots.get(int(uid))
+        return default if slot is None else float(self.values[slot])
+
+    def set(self, uid, gems):
+        self._store(uid, gems)
+        self.ranks.set(uid, gems)
+
+    def _store(self, uid, gems):
+        uid = int(uid)
+        slot = self.slots.get(uid)
+        if slot is None:
+            slot = self._add(uid)
+        self.values[slot] = gems
+
+    def _add(self, uid):
+        slot = self.size
+        self.slots[uid] = slot
+        self.uids.append(uid)
+        if np is not None:
+            if slot == len(self.values):
+                self.values = np.concatenate((self.values, np.zeros(len(self.values))))
+        else:
+            self.values.append(0.0)
+        self.size += 1
+        return slot
+
+    # ---------------------- MASKS ---------------------- #
+    def mask(self, user_ids):
+        """Boolean mask over the slots of the given users (unknown ids are ignored)."""
+        slots = self.slots
+        hits = [slots[uid] for uid in map(int, user_ids) if uid in slots]
+        if np is not None:
+            m = np.zeros(self.size, dtype=bool)
+            m[hits] = True
+            return m
+        m = bytearray(self.size)
+        for slot in hits:
+            m[slot] = 1
+        return m
+
+    def _changes(self, slots, deltas):
+        """[(uid, delta, new balance)] for the changed slots; brings `ranks` up to date."""
+        uids = self.uids
+        values = self.values
+        changes = [(uids[s], d, float(values[s])) for s, d in zip(slots, deltas)]
+        if len(changes) > self.size * self.RERANK_SHARE:
+            self.ranks.reset(zip(uids, values[:self.size].tolist()))
+        else:
+            for uid, _, gems in changes:
+                self.ranks.set(uid, gems)
+        return changes
+
+    # ---------------------- VECTORIZED UPDATES ---------------------- #
+    def credit(self, mask, amount):
+        """Add `amount` to every masked balance."""
+        if np is not None:
+            slots = np.flatnonzero(mask)
+            self.values[slots] += amount
+            return self._changes(slots.tolist(), [amount] * len(slots))
+        slots = [s for s, hit in enumerate(mask) if hit]
+        for s in slots:
+            self.values[s] += amount
+        return self._changes(slots, [amount] * len(slots))
+
+    def debit_floor(self, mask, amount):
+        """Take `amount` from every masked balance, never going below 0."""
+        if np is not None:
+            v = self.values[:self.size]
+            new = np.maximum(v - amount, 0)
+            slots = np.flatnonzero(mask & (new != v))
+            deltas = new[slots] - v[slots]
+            v[slots] = new[slots]
+            return self._changes(slots.tolist(), deltas.tolist())
+        slots, deltas = [], []
+        values = self.values
+        for s, hit in enumerate(mask):
+            if hit:
+                g = values[s]
+                new = max(0, g - amount)
+                if new != g:
+                    slots.append(s)
+                    deltas.append(new - g)
+                    values[s] = new
+        return self._changes(slots, deltas)
+
+    def tax(self, mask, percent):
+        """Take int(gems * percent / 100) from every masked positive balance."""
+        rate = percent / 100
+        if np is not None:
+            v = self.values[:self.size]
+            cut = np.floor(np.where(v > 0, v, 0) * rate)
+            slots = np.flatnonzero(mask & (cut > 0))
+            deltas = -cut[slots]
+            v[slots] += deltas
+            return self._changes(slots.tolist(), deltas.tolist())
+        slots, deltas = [], []
+        values = self.values
+        for s, hit in enumerate(mask):
+            if hit:
+                g = values[s]
+                cut = int(g * rate) if g > 0 else 0
+                if cut > 0:
+                    slots.append(s)
+                    deltas.append(-cut)
+                    values[s] = g - cut
+        return self._changes(slots, deltas)
+
+    def copy(self):
+        """(uids, values) as of now; cheap flat copies that are safe to hand to a thread."""
+        uids = self.uids[:self.size]
+        values = self.values[:self.size]
+        return uids, (values.copy() if np is not None else values)
+
+    # ---------------------- RANKS ---------------------- #
+    def top(self, limit, offset=0):
+        """[(uid, gems)] richest first, like Storage.top_by_gems()."""
+        return [(str(uid), float(gems)) for uid, gems in self.ranks.page(offset, limit)]
+
+    def rank(self, uid):
+        """1-based rank by balance, or None for someone without one."""
+        return self.ranks.rank(uid)
+
+    def around(self, uid, radius=2):
+        """(rank of the first row, [(uid, gems)]) for the players right above and below `uid`."""
+        first, rows = self.ranks.around(uid, radius)
+        return first, [(str(u), float(g)) for u, g in rows]
+
+    # ---------------------- SCANS ---------------------- #
+
+    def total(self):
+        if np is not None:
+            return float(self.values[:self.size].sum())
+        return sum(self.values)
@@ -0,0 +1,77 @@
+"""
+Memory benchmark: bytes per resident user, dict records vs UserRecord.
+
+    python bench_records.py [counts...]      (default: 10000 100000 1000000)
+
+Builds the same synthetic economy both ways — the dicts the way json.load
+produces them (string uid keys), the records the way UserCache holds them
+(integer uid keys) — and measures what is allocated with tracemalloc.
+"""
+import gc
+import random
+import sys
+import time
+import tracemalloc
+
+from records import HistoryEntry, UserRecord, encode_entry
+
+BASE_UID = 1_100_000_000_000_000_000
+
+
+def synthetic_users(n, seed=1):
+    rng = random.Random(seed)
+    now = time.time()
+    for i in range(n):
+        yield str(BASE_UID + i), {
+            "gems": round(rng.uniform(0, 50_000), 2),
+            "last_daily": now - rng.uniform(0, 86400 * 30),
+            "last_work": now - rng.uniform(0, 86400 * 30),
+            "bless_infinite": False,
+            "curse_infinite": False,
+            "bless_charges": rng.choice((0, 0, 0, 1, 3)),
+            "curse_charges": 0,
+        }
+
+
+def measure(build):
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    obj = build()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del obj
+    gc.collect()
+    return after - before
+
+
+def build_dicts(n):
+    return {uid: dict(u) for uid, u in synthetic_users(n)}
+
+
+def build_records(n):
+    return {int(uid): UserRecord.from_dict(uid, u) for uid, u in synthetic_users(n)}
+
+
+def history_sizes(n=10_000):
+    entry = {"game": "gift", "bet": 250, "result": f"gift_to_{BASE_UID}", "earned": -250, "timestamp": time.time()}
+    as_dicts = measure(lambda: [dict(entry, result=f"gift_to_{BASE_UID + i}") for i in range(n)])
+    as_entries = measure(lambda: [
+        encode_entry(dict(entry, result=f"gift_to_{BASE_UID + i}"), lambda text: 0) for i in range(n)
+    ])
+    return as_dicts / n, as_entries / n
+
+
+def main():
+    counts = [int(a) for a in sys.argv[1:]] or [10_000, 100_000, 1_000_000]
+    print(f"{'users':>10} {'dict B/user':>12} {'record B/user':>14} {'saved':>7}")
+    for n in counts:
+        d = measure(lambda: build_dicts(n)) / n
+        r = measure(lambda: build_records(n)) / n
+        print(f"{n:>10} {d:>12.1f} {r:>14.1f} {1 - r / d:>7.1%}")
+    hd, he = history_sizes()
+    print(f"history entry: dict {hd:.1f} B, {HistoryEntry.__name__} {he:.1f} B")
+
+
+if __name__ == "__main__":
+    main()
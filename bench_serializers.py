@@ -0,0 +1,51 @@
+"""
+Serializer benchmark: encode time, decode time and size per format.
+
+    python bench_serializers.py [users]      (default: 100000)
+
+Runs every serializer in serializers.SERIALIZERS over the same synthetic
+economy as bench_records.py. "compact" uses orjson when it is installed;
+the "compact (stdlib)" row shows the same format with the json module.
+"""
+import sys
+import time
+
+import serializers
+from bench_records import synthetic_users
+from serializers import SERIALIZERS, decode
+
+
+def best_of(fn, repeat=3):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def run(label, serializer, doc):
+    encode_s, raw = best_of(lambda: serializer.dumps(doc))
+    decode_s, back = best_of(lambda: decode(raw))
+    assert back == doc, f"{label} does not round-trip"
+    print(f"{label:<18} {encode_s * 1000:>10.1f} {decode_s * 1000:>10.1f} {len(raw) / 1e6:>9.2f}")
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    doc = dict(synthetic_users(n))
+    print(f"{n} users, orjson {'installed' if serializers.orjson is not None else 'not installed'}")
+    print(f"{'format':<18} {'encode ms':>10} {'decode ms':>10} {'size MB':>9}")
+    for name, cls in SERIALIZERS.items():
+        run(name, cls(), doc)
+    if serializers.orjson is not None:
+        fast, serializers.orjson = serializers.orjson, None
+        try:
+            run("compact (stdlib)", SERIALIZERS["compact"](), doc)
+        finally:
+            serializers.orjson = fast
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+import heapq
+import os
+import threading
+import time
+from collections import OrderedDict
+from operator import itemgetter
+
+from storage import read_json_file, write_json_file
+
+DAY = 86400
+# window -> how many UTC days it spans (today included)
+WINDOWS = {"day": 1, "week": 7}
+
+
+def utc_day(ts):
+    return int(ts // DAY)
+
+
+class RollingEarnings:
+    """
+    What every user earned over the last few UTC days, kept up to date as
+    history entries are recorded: one bucket per user per day, plus a
+    running total per window (WINDOWS) so a board never rescans history.
+    When the day changes the buckets that fell out are dropped and the
+    totals rebuilt from the rest (once a day, active users only).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.span = max(WINDOWS.values())
+        self.buckets = {}   # uid -> {day: earned}
+        self.totals = {window: {} for window in WINDOWS}   # window -> uid -> earned
+        self.today = utc_day(time.time())
+
+    def add(self, uid, earned, ts):
+        self.roll()
+        day = utc_day(ts)
+        age = self.today - day
+        if not earned or age >= self.span or age < 0:
+            return
+        uid = int(uid)
+        bucket = self.buckets.setdefault(uid, {})
+        bucket[day] = bucket.get(day, 0) + earned
+        for window, days in WINDOWS.items():
+            if age < days:
+                totals = self.totals[window]
+                totals[uid] = totals.get(uid, 0) + earned
+
+    def add_many(self, items):
+        """[(uid, earned, ts)] (bulk admin commands)."""
+        for uid, earned, ts in items:
+            self.add(uid, earned, ts)
+
+    def roll(self, now=None):
+        """Drop the days that left the windows (no-op until the UTC day changes)."""
+        today = utc_day(time.time() if now is None else now)
+        if today == self.today:
+            return
+        self.today = today
+        oldest = today - self.span + 1
+        for uid in list(self.buckets):
+            bucket = {day: v for day, v in self.buckets[uid].items() if day >= oldest}
+            if bucket:
+                self.buckets[uid] = bucket
+            else:
+                del self.buckets[uid]
+        self._rebuild_totals()
+
+    def _rebuild_totals(self):
+        for window, days in WINDOWS.items():
+            first = self.today - days + 1
+            totals = {}
+            for uid, bucket in self.buckets.items():
+                earned = sum(v for day, v in bucket.items() if day >= first)
+                if earned:
+                    totals[uid] = earned
+            self.totals[window] = totals
+
+    def ranked(self, window, members=None, limit=None):
+        """[(uid, earned)] best first; only `members` (ids) when given."""
+        self.roll()
+        totals = self.totals[window]
+        if members is None:
+            items = totals.items()
+        else:
+            items = [(uid, totals[uid]) for uid in members if uid in totals]
+        if limit is not None:
+            return heapq.nlargest(limit, items, key=itemgetter(1))
+        return sorted(items, key=itemgetter(1), reverse=True)
+
+    # ---------------------- DISK ---------------------- #
+    def load(self):
+        """Read the saved buckets; False if there is no file yet."""
+        if not os.path.exists(self.path):
+            return False
+        doc = read_json_file(self.path)
+        self.buckets = {
+            int(uid): {int(day): v for day, v in bucket.items()}
+            for uid, bucket in doc["buckets"].items()
+        }
+        self.today = None
+        self.roll()
+        return True
+
+    def to_doc(self):
+        """A copy of the buckets, taken on the event loop and safe to write from a thread."""
+        return {"buckets": {uid: dict(bucket) for uid, bucket in self.buckets.items()}}
+
+    def write(self, doc):
+        with self.lock:
+            write_json_file(self.path, doc, indent=None)
+
+
+class BoardCache:
+    """
+    Finished boards keyed by (guild, window, ...): an entry is reused for
+    `ttl` seconds as long as its version (e.g. the guild's membership)
+    hasn't moved. Balances and earnings change on every bet, so they only
+    refresh with the ttl. Least recently used boards are dropped past
+    `capacity`.
+    """
+
+    def __init__(self, capacity=256, ttl=30):
+        self.capacity = capacity
+        self.ttl = ttl
+        self.boards = OrderedDict()   # key -> (version, expires, rows)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, version, build):
+        now = time.monotonic()
+        entry = self.boards.get(key)
+        if entry is not None and entry[0] == version and entry[1] > now:
+            self.hits += 1
+            self.boards.move_to_end(key)
+            return entry[2]
+        self.misses += 1
+        rows = build()
+        self.boards[key] = (version, now + self.ttl, rows)
+        self.boards.move_to_end(key)
+        while len(self.boards) > self.capacity:
+            self.boards.popitem(last=False)
+        return rows
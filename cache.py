@@ -0,0 +1,109 @@
+from collections import OrderedDict
+
+
+class UserCache:
+    """
+    Bounded LRU of live user records in front of a Storage backend.
+
+    Behaves like the old `data` dict for single-user access
+    (data[uid], uid in data, data.get(uid)): a miss loads the record
+    from storage, and the least recently used records are dropped once
+    more than `capacity` are resident.
+    - records with unwritten changes are never evicted (is_clean(uid) says
+      when a record may go); they are retried after the next flush
+    - on_load(uid, record) runs once for every record read from storage
+    - wrap(uid, dict) turns a stored dict into the resident record type;
+      resident records are keyed by integer user id
+    """
+
+    def __init__(self, storage, capacity, is_clean, on_load=None, wrap=None):
+        self.storage = storage
+        self.capacity = capacity
+        self.is_clean = is_clean
+        self.on_load = on_load
+        self.wrap = wrap
+        self.users = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, uid, default=None):
+        key = int(uid)
+        u = self.users.get(key)
+        if u is not None:
+            self.users.move_to_end(key)
+            self.hits += 1
+            return u
+        self.misses += 1
+        u = self.storage.load_user(str(key))
+        if u is None:
+            return default
+        if self.wrap is not None:
+            u = self.wrap(key, u)
+        self.users[key] = u
+        if self.on_load is not None:
+            self.on_load(str(key), u)
+        self.evict()
+        return u
+
+    def peek(self, uid):
+        """Resident record or None, without loading or touching LRU order."""
+        return self.users.get(int(uid))
+
+    def __getitem__(self, uid):
+        u = self.get(uid)
+        if u is None:
+            raise KeyError(uid)
+        return u
+
+    def __setitem__(self, uid, u):
+        key = int(uid)
+        self.users[key] = u
+        self.users.move_to_end(key)
+        self.evict()
+
+    def __contains__(self, uid):
+        return self.get(uid) is not None
+
+    def setdefault(self, uid, default):
+        u = self.get(uid)
+        if u is None:
+            self[uid] = u = default
+        return u
+
+    def update(self, d):
+        for uid, u in d.items():
+            self[uid] = u
+
+    def __len__(self):
+        return len(self.users)
+
+    def clear(self):
+        self.users.clear()
+
+    def evict(self):
+        """Drop least recently used clean records until within capacity."""
+        excess = len(self.users) - self.capacity
+        if excess <= 0:
+            return
+        newest = next(reversed(self.users))   # the record the caller is about to use
+        victims = []
+        for key in self.users:
+            if key != newest and self.is_clean(str(key)):
+                victims.append(key)
+                if len(victims) >= excess:
+                    break
+        for key in victims:
+            del self.users[key]
+        self.evictions += len(victims)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "resident": len(self.users),
+            "capacity": self.capacity,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": (self.hits / lookups) if lookups else 0.0,
+        }
@@ -0,0 +1,379 @@
+import json
+import sqlite3
+import threading
+
+from records import DYNAMIC_CODE_START, GAME_CODES, HistoryEntry, decode_entry, encode_entry, game_name
+
+# game/result are enum codes (records.Game / records.Result); the rare
+# strings the enums don't cover are interned in `strings`
+HISTORY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    id     INTEGER PRIMARY KEY AUTOINCREMENT,
+    uid    INTEGER NOT NULL,
+    game   INTEGER NOT NULL,
+    result INTEGER NOT NULL,
+    arg    INTEGER NOT NULL,
+    bet    REAL    NOT NULL,
+    earned REAL    NOT NULL,
+    ts     REAL    NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_entries_uid ON entries(uid, id);
+CREATE TABLE IF NOT EXISTS strings (
+    code INTEGER PRIMARY KEY,
+    text TEXT    NOT NULL UNIQUE
+);
+"""
+
+# lifetime totals per user and game, updated with every batch of entries
+# (entries themselves are trimmed to the newest `limit` per user)
+TOTALS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS totals (
+    uid      INTEGER NOT NULL,
+    game     INTEGER NOT NULL,
+    games    INTEGER NOT NULL,
+    wins     INTEGER NOT NULL,
+    losses   INTEGER NOT NULL,
+    bet      REAL    NOT NULL,
+    net      REAL    NOT NULL,
+    max_win  REAL    NOT NULL,
+    max_loss REAL    NOT NULL,
+    PRIMARY KEY (uid, game)
+) WITHOUT ROWID;
+"""
+TOTALS_FIELDS = ("games", "wins", "losses", "bet", "net", "max_win", "max_loss")
+
+INSERT_ENTRY = "INSERT INTO entries (uid, game, result, arg, bet, earned, ts) VALUES (?, ?, ?, ?, ?, ?, ?)"
+UPSERT_TOTALS = """
+INSERT INTO totals (uid, game, games, wins, losses, bet, net, max_win, max_loss)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (uid, game) DO UPDATE SET
+    games = games + excluded.games,
+    wins = wins + excluded.wins,
+    losses = losses + excluded.losses,
+    bet = bet + excluded.bet,
+    net = net + excluded.net,
+    max_win = MAX(max_win, excluded.max_win),
+    max_loss = MIN(max_loss, excluded.max_loss)
+"""
+
+
+def entry_to_row(uid, e):
+    return (int(uid), e.game, e.result, e.arg, e.bet, e.earned, e.ts)
+
+
+def row_to_entry(row):
+    return HistoryEntry(*row)
+
+
+def add_to_totals(totals, key, bet, earned):
+    """Fold one entry into totals[key] = [games, wins, losses, bet, net, max_win, max_loss]."""
+    t = totals.get(key)
+    if t is None:
+        totals[key] = [1, int(earned > 0), int(earned < 0), bet, earned, earned, earned]
+        return
+    t[0] += 1
+    t[1] += earned > 0
+    t[2] += earned < 0
+    t[3] += bet
+    t[4] += earned
+    t[5] = max(t[5], earned)
+    t[6] = min(t[6], earned)
+
+
+def batch_totals(items):
+    """[(uid, HistoryEntry)] -> {(uid, game code): totals list}."""
+    totals = {}
+    for uid, e in items:
+        add_to_totals(totals, (int(uid), e.game), e.bet, e.earned)
+    return totals
+
+
+class HistoryStore:
+    """
+    Per-user game history, kept apart from the balance records.
+
+    Works as a ring buffer: only the newest `limit` entries per user are kept.
+    append() only queues the entry (event loop); write_pending() inserts the
+    queued entries in one transaction (worker thread). Reads see queued
+    entries too, so nothing disappears while a write is in flight.
+    Entries are held as fixed-width HistoryEntry rows and only turned back
+    into the usual dicts by recent(). The `totals` table keeps lifetime
+    aggregates per user and game that survive the trimming.
+    """
+
+    def __init__(self, path, limit=50):
+        self.path = path
+        self.limit = limit
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.db_lock = threading.Lock()
+        self.queue_lock = threading.Lock()
+        self.pending = []    # [(uid, HistoryEntry)] not yet handed to a writer
+        self.inflight = []   # [(uid, HistoryEntry)] being written right now
+        self.codes = {}      # interned text -> code
+        self.texts = {}      # code -> interned text
+        self.saved_code = DYNAMIC_CODE_START - 1   # highest code already in `strings`
+        with self.db_lock:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.executescript(HISTORY_SCHEMA)
+            for code, text in self.conn.execute("SELECT code, text FROM strings"):
+                self.codes[text] = code
+                self.texts[code] = text
+                self.saved_code = max(self.saved_code, code)
+            self._migrate_text_table()
+            self._create_totals()
+
+    # ---------------------- STRING CODES ---------------------- #
+    def intern(self, text):
+        with self.queue_lock:
+            code = self.codes.get(text)
+            if code is None:
+                code = max(self.texts, default=DYNAMIC_CODE_START - 1) + 1
+                self.codes[text] = code
+                self.texts[code] = text
+            return code
+
+    def lookup(self, code):
+        return self.texts.get(code, f"unknown_{code}")
+
+    def _save_strings(self):
+        """Insert codes interned since the last commit (caller holds db_lock, inside BEGIN)."""
+        with self.queue_lock:
+            new = [(c, t) for c, t in self.texts.items() if c > self.saved_code]
+        if new:
+            self.conn.executemany("INSERT OR IGNORE INTO strings (code, text) VALUES (?, ?)", new)
+        return max((c for c, _ in new), default=self.saved_code)
+
+    def _migrate_text_table(self):
+        """One-time conversion of the old `history` table with string columns."""
+        old = self.conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'history'"
+        ).fetchone()
+        if old is None:
+            return
+        rows = self.conn.execute(
+            "SELECT uid, game, bet, result, earned, ts FROM history ORDER BY id"
+        ).fetchall()
+        self.conn.execute("BEGIN")
+        try:
+            self.conn.executemany(INSERT_ENTRY, [
+                entry_to_row(uid, encode_entry(
+                    {"game": game, "bet": bet, "result": result, "earned": earned, "timestamp": ts},
+                    self.intern
+                ))
+                for uid, game, bet, result, earned, ts in rows
+            ])
+            saved = self._save_strings()
+            self.conn.execute("DROP TABLE history")
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+        self.saved_code = saved
+
+    def _create_totals(self):
+        """Create `totals`; the first time, backfill it from the entries still stored."""
+        exists = self.conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'totals'"
+        ).fetchone()
+        if exists is not None:
+            return
+        self.conn.execute("BEGIN")
+        try:
+            self.conn.execute(TOTALS_SCHEMA)
+            self.conn.execute(
+                "INSERT INTO totals (uid, game, games, wins, losses, bet, net, max_win, max_loss) "
+                "SELECT uid, game, COUNT(*), SUM(earned > 0), SUM(earned < 0), SUM(bet), SUM(earned), "
+                "MAX(earned), MIN(earned) FROM entries GROUP BY uid, game"
+            )
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+
+    # ---------------------- WRITING ---------------------- #
+    def append(self, uid, entry):
+        e = encode_entry(entry, self.intern)
+        with self.queue_lock:
+            self.pending.append((str(uid), e))
+
+    def append_many(self, items):
+        """Queue [(uid, entry)] in one go (bulk admin commands; thread-safe)."""
+        codes = {}   # bulk entries mostly share game/result, encode those once
+        encoded = []
+        for uid, entry in items:
+            key = (entry.get("game"), entry.get("result"))
+            code = codes.get(key)
+            if code is None:
+                e = encode_entry(entry, self.intern)
+                codes[key] = (e.game, e.result, e.arg)
+            else:
+                e = HistoryEntry(*code, entry.get("bet", 0), entry.get("earned", 0), entry.get("timestamp", 0.0))
+            encoded.append((str(uid), e))
+        with self.queue_lock:
+            self.pending.extend(encoded)
+
+    def take_pending(self, keys=None):
+        """Move queued entries to the in-flight batch (WriteBehind snapshot hook)."""
+        with self.queue_lock:
+            self.inflight.extend(self.pending)
+            self.pending = []
+            return list(self.inflight)
+
+    def write_pending(self, batch):
+        """Insert a batch and trim the touched users back to `limit` entries."""
+        if not batch:
+            return
+        touched = {int(uid) for uid, _ in batch}
+        with self.db_lock:
+            self.conn.execute("BEGIN")
+            try:
+                saved = self._save_strings()
+                self.conn.executemany(INSERT_ENTRY, [entry_to_row(uid, e) for uid, e in batch])
+                self.conn.executemany(UPSERT_TOTALS, [key + tuple(t) for key, t in batch_totals(batch).items()])
+                self._trim(touched)
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+            self.saved_code = saved
+            # still under db_lock, so readers never see a batch twice or not at all
+            with self.queue_lock:
+                del self.inflight[:len(batch)]
+
+    def _trim(self, uids):
+        self.conn.executemany(
+            "DELETE FROM entries WHERE uid = ? AND id <= "
+            "(SELECT id FROM entries WHERE uid = ? ORDER BY id DESC LIMIT 1 OFFSET ?)",
+            [(uid, uid, self.limit) for uid in uids]
+        )
+
+    def replace_users(self, histories, totals=None):
+        """
+        Overwrite the history of the given users: {uid: [entry, ...]} (imports).
+        Lifetime totals are replaced for the users in `totals` ({uid: {game
+        name: totals list}}, what export() gives) and otherwise left alone,
+        except for users without any yet (legacy histories moved out of
+        records), who get them from `histories`.
+        """
+        encoded = {
+            uid: [encode_entry(e, self.intern) for e in entries]
+            for uid, entries in histories.items()
+        }
+        totals = {
+            uid: [(int(uid), self._game_code(game)) + tuple(t) for game, t in by_game.items()]
+            for uid, by_game in (totals or {}).items()
+        }
+        with self.db_lock:
+            self.conn.execute("BEGIN")
+            try:
+                saved = self._save_strings()
+                for uid, entries in encoded.items():
+                    self.conn.execute("DELETE FROM entries WHERE uid = ?", (int(uid),))
+                    self.conn.executemany(INSERT_ENTRY, [entry_to_row(uid, e) for e in entries[-self.limit:]])
+                    if uid in totals:
+                        continue
+                    if self.conn.execute("SELECT 1 FROM totals WHERE uid = ? LIMIT 1", (int(uid),)).fetchone() is None:
+                        seeded = batch_totals((uid, e) for e in entries)
+                        self.conn.executemany(UPSERT_TOTALS, [key + tuple(t) for key, t in seeded.items()])
+                for uid, rows in totals.items():
+                    self.conn.execute("DELETE FROM totals WHERE uid = ?", (int(uid),))
+                    self.conn.executemany(UPSERT_TOTALS, rows)
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+            self.saved_code = saved
+
+    def _game_code(self, game):
+        return int(GAME_CODES[game]) if game in GAME_CODES else self.intern(game)
+
+    # ---------------------- BACKUPS ---------------------- #
+    def export(self, uids=None):
+        """
+        (histories, totals) of the stored users, or only of `uids`, for
+        backups (worker thread; flush the writer first so nothing is queued):
+        - histories: {uid: the entry list as compact JSON bytes}
+        - totals: {uid: {game name: [games, wins, losses, bet, net, max_win, max_loss]}}
+        Codes are written as names, so another database can read them back.
+        """
+        if uids is None:
+            chunks = [None]
+        else:
+            ids = sorted({int(uid) for uid in uids})
+            chunks = [ids[i:i + 500] for i in range(0, len(ids), 500)]
+        histories = {}
+        totals = {}
+
+        def finish(uid, entries):
+            if entries:
+                histories[str(uid)] = json.dumps(entries, separators=(",", ":")).encode("utf-8")
+
+        with self.db_lock:
+            for chunk in chunks:
+                where = "" if chunk is None else f" WHERE uid IN ({','.join('?' * len(chunk))})"
+                params = () if chunk is None else chunk
+                current, entries = None, []
+                rows = self.conn.execute(
+                    f"SELECT uid, game, result, arg, bet, earned, ts FROM entries{where} ORDER BY uid, id", params
+                )
+                for uid, *row in rows:
+                    if uid != current:
+                        finish(current, entries)
+                        current, entries = uid, []
+                    entries.append(decode_entry(row_to_entry(row), self.lookup))
+                finish(current, entries)
+                rows = self.conn.execute(
+                    f"SELECT uid, game, games, wins, losses, bet, net, max_win, max_loss FROM totals{where}", params
+                )
+                for uid, game, *t in rows:
+                    totals.setdefault(str(uid), {})[game_name(game, self.lookup)] = t
+        return histories, totals
+
+    # ---------------------- READING ---------------------- #
+    def recent(self, uid, n=None):
+        """Newest-last list of up to n (default: limit) entries for a user."""
+        n = self.limit if n is None else n
+        uid = str(uid)
+        with self.db_lock:
+            rows = self.conn.execute(
+                "SELECT game, result, arg, bet, earned, ts FROM entries "
+                "WHERE uid = ? ORDER BY id DESC LIMIT ?",
+                (int(uid), n)
+            ).fetchall()
+            with self.queue_lock:
+                queued = [e for u, e in self.inflight + self.pending if u == uid]
+        stored = [row_to_entry(r) for r in reversed(rows)]
+        return [decode_entry(e, self.lookup) for e in (stored + queued)[-n:]]
+
+    def totals(self, uid):
+        """
+        {game name: {games, wins, losses, bet, net, max_win, max_loss}} over
+        a user's whole life, queued entries included.
+        """
+        with self.db_lock:
+            rows = self.conn.execute(
+                "SELECT game, games, wins, losses, bet, net, max_win, max_loss FROM totals WHERE uid = ?",
+                (int(uid),)
+            ).fetchall()
+            with self.queue_lock:
+                queued = [(u, e) for u, e in self.inflight + self.pending if u == str(uid)]
+        merged = {game: list(t) for game, *t in rows}
+        for _, e in queued:
+            add_to_totals(merged, e.game, e.bet, e.earned)
+        return {
+            game_name(code, self.lookup): dict(zip(TOTALS_FIELDS, t))
+            for code, t in merged.items()
+        }
+
+    def earned_since(self, ts):
+        """[(uid, earned, ts)] of every stored or queued entry from `ts` on (one-off backfills)."""
+        with self.db_lock:
+            rows = self.conn.execute("SELECT uid, earned, ts FROM entries WHERE ts >= ?", (ts,)).fetchall()
+            with self.queue_lock:
+                queued = [(int(u), e.earned, e.ts) for u, e in self.inflight + self.pending if e.ts >= ts]
+        return rows + queued
+
+    def close(self):
+        with self.db_lock:
+            self.conn.close()
@@ -0,0 +1,125 @@
+import math
+import os
+import threading
+from bisect import bisect_right
+
+from storage import read_json_file, write_json_file
+
+# games the house tracks; every chest tier counts as its own game
+HOUSE_GAMES = ("coinflip", "slots", "mines", "tower", "blackjack")
+CHEST_PREFIX = "chest_"
+
+# payout multiple (gems back / gems bet) histogram: [0, 0.5), [0.5, 1), ... [100, inf)
+PAYOUT_EDGES = (0.5, 1, 1.5, 2, 3, 5, 10, 25, 100)
+
+SUMS = ("rounds", "wins", "losses", "pushes", "bet", "bet_sq", "net", "net_sq", "payout", "payout_sq")
+
+
+def is_house_game(game):
+    return game in HOUSE_GAMES or game.startswith(CHEST_PREFIX)
+
+
+def bucket_label(i):
+    low = 0 if i == 0 else PAYOUT_EDGES[i - 1]
+    return f"x{low}+" if i == len(PAYOUT_EDGES) else f"x{low}-{PAYOUT_EDGES[i]}"
+
+
+def new_game():
+    g = dict.fromkeys(SUMS, 0)
+    g["max_payout"] = 0
+    g["histogram"] = [0] * (len(PAYOUT_EDGES) + 1)
+    return g
+
+
+class HouseStats:
+    """
+    Streaming aggregates per game for tuning odds: counts, sums and sums of
+    squares of bet, net and payout multiple, plus a fixed-bucket payout
+    histogram. record() is O(1) per game result and nothing is rescanned;
+    summary() derives house edge, hit rate and spread from the sums.
+    Chest entries cover a whole batch of chests, so their payout multiple
+    is the batch's.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.games = {}   # game -> sums (see new_game)
+        self.since = None
+
+    def record(self, entry, now):
+        game = str(entry.get("game", ""))
+        bet = entry.get("bet", 0)
+        if not is_house_game(game) or bet <= 0 or entry.get("result") == "refund":
+            return
+        net = entry.get("earned", 0)
+        payout = (bet + net) / bet
+        g = self.games.get(game)
+        if g is None:
+            g = self.games[game] = new_game()
+        if self.since is None:
+            self.since = now
+        g["rounds"] += 1
+        if net > 0:
+            g["wins"] += 1
+        elif net < 0:
+            g["losses"] += 1
+        else:
+            g["pushes"] += 1
+        g["bet"] += bet
+        g["bet_sq"] += bet * bet
+        g["net"] += net
+        g["net_sq"] += net * net
+        g["payout"] += payout
+        g["payout_sq"] += payout * payout
+        g["max_payout"] = max(g["max_payout"], payout)
+        g["histogram"][bisect_right(PAYOUT_EDGES, payout)] += 1
+
+    def reset(self, now):
+        self.games = {}
+        self.since = now
+
+    def summary(self):
+        """{game: derived figures} busiest first (what !housestats shows and dumps)."""
+        out = {}
+        for game, g in sorted(self.games.items(), key=lambda kv: kv[1]["rounds"], reverse=True):
+            n = g["rounds"]
+            mean_payout = g["payout"] / n
+            mean_net = g["net"] / n
+            out[game] = {
+                "rounds": n,
+                "volume": g["bet"],
+                "house_net": -g["net"],
+                "house_edge": -g["net"] / g["bet"],
+                "rtp": 1 + g["net"] / g["bet"],
+                "hit_rate": g["wins"] / n,
+                "push_rate": g["pushes"] / n,
+                "mean_bet": g["bet"] / n,
+                "mean_payout": mean_payout,
+                "stdev_payout": math.sqrt(max(0.0, g["payout_sq"] / n - mean_payout ** 2)),
+                "stdev_net": math.sqrt(max(0.0, g["net_sq"] / n - mean_net ** 2)),
+                "max_payout": g["max_payout"],
+                "histogram": {bucket_label(i): c for i, c in enumerate(g["histogram"])},
+            }
+        return out
+
+    # ---------------------- DISK ---------------------- #
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        doc = read_json_file(self.path)
+        self.games = doc["games"]
+        self.since = doc.get("since")
+        if doc.get("payout_edges") != list(PAYOUT_EDGES):
+            # buckets were redefined: the old counts don't fit them
+            for g in self.games.values():
+                g["histogram"] = [0] * (len(PAYOUT_EDGES) + 1)
+
+    def to_doc(self):
+        """A copy of the sums, taken on the event loop and safe to write from a thread."""
+        games = {game: dict(g, histogram=list(g["histogram"])) for game, g in self.games.items()}
+        return {"since": self.since, "payout_edges": list(PAYOUT_EDGES), "games": games}
+
+    def write(self, doc):
+        with self.lock:
+            write_json_file(self.path, doc, indent=None)
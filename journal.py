@@ -0,0 +1,216 @@
+import glob
+import gzip
+import json
+import shutil
+import os
+import threading
+import time
+
+LIVE_FILE = "journal.log"
+SNAPSHOT_FILE = "snapshot.json"
+ARCHIVE_DIR = "archive"
+
+
+def format_event(seq, ts, uid, kind, delta, balance):
+    # "<seq> <time> <uid> <kind> <delta> <balance>" — a few dozen bytes per change
+    return f"{seq} {ts:.3f} {uid} {kind} {delta!r} {balance!r}\n"
+
+
+def parse_event(line):
+    """Returns (seq, ts, uid, kind, delta, balance) or None for a torn/garbage line."""
+    parts = line.split()
+    if len(parts) != 6:
+        return None
+    try:
+        return int(parts[0]), float(parts[1]), parts[2], parts[3], float(parts[4]), float(parts[5])
+    except ValueError:
+        return None
+
+
+class Journal:
+    """
+    Append-only journal of balance changes.
+
+    Every change is one line carrying the delta *and* the resulting balance,
+    so replaying a line twice is harmless. compact() folds the journal into
+    a full-state snapshot:
+    - rotate() (on the event loop) seals the live file as segment-<seq>.log
+      at the same instant the caller copies the state
+    - compact() (in a worker thread) writes that copy as snapshot.json and
+      moves the sealed segments it covers to archive/ (gzipped), where
+      they stay for `archive_days` so replay() can rebuild any moment
+    """
+
+    def __init__(self, directory, fsync=False, archive_days=30):
+        self.dir = directory
+        self.fsync = fsync
+        self.archive_dir = os.path.join(directory, ARCHIVE_DIR)
+        self.archive_days = archive_days
+        os.makedirs(self.archive_dir, exist_ok=True)
+        self.live_path = os.path.join(directory, LIVE_FILE)
+        self.snapshot_path = os.path.join(directory, SNAPSHOT_FILE)
+        self.lock = threading.Lock()
+        self.seq = self._last_seq()
+        self.appended = 0   # events since the last rotate
+        self.fp = open(self.live_path, "a", encoding="utf-8")
+
+    # ---------------------- WRITING ---------------------- #
+    def append(self, uid, kind, delta, balance):
+        with self.lock:
+            self.seq += 1
+            self.fp.write(format_event(self.seq, time.time(), uid, kind, delta, balance))
+            self.fp.flush()
+            if self.fsync:
+                os.fsync(self.fp.fileno())
+            self.appended += 1
+            return self.seq
+
+    def append_many(self, events):
+        """Journal [(uid, kind, delta, balance)] with a single write (thread-safe)."""
+        ts = time.time()
+        with self.lock:
+            lines = []
+            for uid, kind, delta, balance in events:
+                self.seq += 1
+                lines.append(format_event(self.seq, ts, uid, kind, delta, balance))
+            if lines:
+                self.fp.write("".join(lines))
+                self.fp.flush()
+                if self.fsync:
+                    os.fsync(self.fp.fileno())
+            self.appended += len(lines)
+            return self.seq
+
+    def rotate(self):
+        """
+        Seal the live file; returns the last seq it contains. An empty live
+        file is left as it is: its segment name would repeat the previous one.
+        """
+        with self.lock:
+            self.fp.flush()
+            if os.path.getsize(self.live_path) == 0:
+                self.appended = 0
+                return self.seq
+            self.fp.close()
+            sealed = os.path.join(self.dir, f"segment-{self.seq:012d}.log")
+            os.replace(self.live_path, sealed)
+            self.fp = open(self.live_path, "a", encoding="utf-8")
+        self.appended = 0
+        return self.seq
+
+    def compact(self, state, seq):
+        """Write `state` (as of `seq`) as the snapshot and archive covered segments."""
+        tmp = self.snapshot_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"seq": seq, "ts": time.time(), "data": state}, f, separators=(",", ":"))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.snapshot_path)
+        for path in self._segments():
+            if self._segment_seq(path) <= seq:
+                self._archive(path)
+        self._prune_archive()
+
+    def _archive(self, path):
+        if os.path.getsize(path) == 0:
+            os.remove(path)
+            return
+        # never overwrite an archived segment: another one with the same name goes next to it
+        name = os.path.basename(path)[:-len(".log")]
+        target = os.path.join(self.archive_dir, name + ".log.gz")
+        n = 0
+        while os.path.exists(target):
+            n += 1
+            target = os.path.join(self.archive_dir, f"{name}.{n}.log.gz")
+        with open(path, "rb") as src, gzip.open(target + ".tmp", "wb", compresslevel=6) as dst:
+            shutil.copyfileobj(src, dst)
+        os.replace(target + ".tmp", target)
+        os.remove(path)
+
+    def _prune_archive(self):
+        cutoff = time.time() - self.archive_days * 24 * 3600
+        for path in self._archived():
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+
+    def close(self):
+        with self.lock:
+            self.fp.close()
+
+    # ---------------------- READING ---------------------- #
+    def _segments(self):
+        return sorted(glob.glob(os.path.join(self.dir, "segment-*.log")))
+
+    @staticmethod
+    def _segment_seq(path):
+        return int(os.path.basename(path)[len("segment-"):-len(".log")])
+
+    def _archived(self):
+        return sorted(glob.glob(os.path.join(self.archive_dir, "segment-*.log.gz")))
+
+    def _files(self):
+        return self._segments() + [self.live_path]
+
+    def replay(self, since_seq, until_ts):
+        """
+        Yield archived and current events with seq > since_seq, oldest first,
+        up to the first one recorded after `until_ts`. Files that end at or
+        before since_seq are skipped without being opened.
+        """
+        sources = [(p, gzip.open) for p in self._archived()] + [(p, open) for p in self._files()]
+        for path, opener in sources:
+            name = os.path.basename(path)
+            if name.startswith("segment-") and int(name[len("segment-"):].split(".")[0]) <= since_seq:
+                continue
+            if not os.path.exists(path):
+                continue
+            with opener(path, "rt", encoding="utf-8") as f:
+                for line in f:
+                    ev = parse_event(line)
+                    if ev is None or ev[0] <= since_seq:
+                        continue
+                    if ev[1] > until_ts:
+                        return
+                    yield ev
+
+    def events(self, since_seq=0):
+        """Yield parsed events with seq > since_seq, oldest first."""
+        for path in self._files():
+            if not os.path.exists(path):
+                continue
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    ev = parse_event(line)
+                    if ev is not None and ev[0] > since_seq:
+                        yield ev
+
+    def _last_seq(self):
+        seq = self.load_snapshot()[0]
+        for ev in self.events(seq):
+            seq = max(seq, ev[0])
+        return seq
+
+    def load_snapshot(self):
+        """(seq, state) of the last compaction, or (0, None)."""
+        if not os.path.exists(self.snapshot_path):
+            return 0, None
+        with open(self.snapshot_path, "r", encoding="utf-8") as f:
+            snap = json.load(f)
+        return snap["seq"], snap["data"]
+
+    def recover(self, load_base=None):
+        """
+        Work out what the store may have missed before a crash.
+        - load_base(state) is called with the snapshot when the caller's store
+          is gone and must be rebuilt from it
+        - returns {uid: balance}: the last balance journaled for each user after
+          the snapshot; applying it is idempotent
+        """
+        snap_seq, snap = self.load_snapshot()
+        if snap and load_base is not None:
+            load_base(snap)
+
+        balances = {}
+        for seq, ts, uid, kind, delta, balance in self.events(snap_seq):
+            balances[uid] = balance
+        return balances
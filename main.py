@@ -1,23 +1,164 @@
+import time
+STARTED = time.perf_counter()   # startup phase timings count from here
+
 import discord
 from discord.ext import commands, tasks
 import json
 import os
 import random
 from discord.ui import Button, View
-import time
 import io
 import asyncio
-from datetime import datetime
+import signal
+from datetime import datetime, timezone
+
+from backup_catalog import BackupCatalog
+from backup_parts import MANIFEST_SUFFIX, BackupError, Unpacker, is_manifest_name, pack_backup, read_manifest
+from balances import BalanceColumn
+from boards import DAY, BoardCache, RollingEarnings
+from cache import UserCache
+from history_store import HistoryStore
+from house_stats import HouseStats
+from journal import Journal
+from names import NameResolver
+from persistence import WriteBehind
+from records import UserRecord
+from serializers import get_serializer
+from sessions import SessionRegistry, load_saved_sessions, save_pending
+from snapshot_store import LocalSnapshots
+from snapshots import BackupChain, Snapshotter, apply_deltas, decode_backup, delta_doc, is_delta
+from storage import LazyHistory, open_storage, read_json_file, write_json_file
+from wallet import Wallet
 
 TOKEN = os.getenv("TOKEN")
 DATA_FILE = "casino_data.json"
-
-# Channel used for JSON backups
+DB_FILE = "casino_data.db"
+HISTORY_DB_FILE = "casino_history.db"
+HISTORY_LIMIT = 50  # entries kept per user
+
+# "json" keeps everything in DATA_FILE, "sqlite" stores one row per user in DB_FILE,
+# "sharded" splits the JSON over SHARD_COUNT files in SHARD_DIR by user-id hash
+# (DATA_FILE is imported automatically the first time the store is empty)
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "json")
+SHARD_DIR = "casino_shards"
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", "16"))
+
+# File format of DATA_FILE / the shards and of backups: "pretty" (indented
+# JSON), "compact" (JSON, orjson when installed) or "binary" (packed records).
+# Files are read whatever format wrote them; see serializers.py
+DATA_FORMAT = os.getenv("DATA_FORMAT", "pretty")
+BACKUP_FORMAT = os.getenv("BACKUP_FORMAT", "compact")
+
+# "lazy" reads the json/sharded files without parsing the legacy per-user
+# history lists (they are parsed when a user is first loaded), "eager" parses all
+STARTUP_MODE = os.getenv("STARTUP_MODE", "lazy")
+
+# How many user records stay in memory; colder ones are reloaded from the store
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "5000"))
+
+# Names shown on leaderboards: fetched users are remembered for
+# NAME_CACHE_TTL seconds, and at most NAME_FETCH_CONCURRENCY fetched at once
+NAME_CACHE_SIZE = int(os.getenv("NAME_CACHE_SIZE", "5000"))
+NAME_CACHE_TTL = int(os.getenv("NAME_CACHE_TTL", "3600"))
+NAME_FETCH_CONCURRENCY = 5
+
+# Server and week/day boards are rebuilt at most every BOARD_CACHE_TTL
+# seconds, or when someone joins or leaves the server
+BOARD_CACHE_TTL = int(os.getenv("BOARD_CACHE_TTL", "30"))
+
+# Channel used for JSON backups: a full checkpoint, then up to
+# BACKUP_FULL_EVERY deltas holding only the users changed in between
 BACKUP_CHANNEL_ID = 1431610647921295451
+BACKUP_FULL_EVERY = int(os.getenv("BACKUP_FULL_EVERY", "6"))
+# Backups are compressed ("gzip" or "lzma") and split into parts that stay
+# under the attachment limit, listed with checksums in a manifest file
+BACKUP_CODEC = os.getenv("BACKUP_CODEC", "gzip")
+BACKUP_PART_BYTES = int(os.getenv("BACKUP_PART_BYTES", str(8_000_000)))
+BACKUP_FILES_PER_MESSAGE = 10
+# Local record of every uploaded backup (message ids, generations, checksums)
+BACKUP_CATALOG_FILE = "casino_backups.json"
+# Backup records carry their user's history under "history" and lifetime totals under this key
+HISTORY_TOTALS_KEY = "history_totals"
+
+# Games and lotteries still running at shutdown; refunded / resumed on boot
+SESSIONS_FILE = "casino_sessions.json"
+
+# Per-user earnings of the last 7 UTC days for the week/day leaderboards
+EARNINGS_FILE = "casino_earnings.json"
+# Per-game payout aggregates behind !housestats
+HOUSE_STATS_FILE = "casino_house_stats.json"
+
+# Append-only journal of every balance change, folded into a snapshot
+# every JOURNAL_COMPACT_MINUTES and replayed on startup after a crash;
+# compacted segments are archived for JOURNAL_ARCHIVE_DAYS for !restoreto
+JOURNAL_DIR = "casino_journal"
+JOURNAL_ARCHIVE_DAYS = 30
+JOURNAL_COMPACT_MINUTES = 10
+
+# Compressed full-state snapshots on local disk, written on every journal
+# compaction and full backup and thinned out by snapshot_store.RETENTION_TIERS
+LOCAL_SNAPSHOT_DIR = "casino_snapshots"
+
+# Write-behind: flush at most every SAVE_INTERVAL seconds,
+# or sooner once SAVE_MAX_PENDING mutations are queued
+SAVE_INTERVAL = 2.0
+SAVE_MAX_PENDING = 50
+
+
+# ---------------------- BOT ---------------------- #
+class CasinoBot(commands.Bot):
+    async def setup_hook(self):
+        startup_phase("login")   # discord.py calls this right after logging in
+        writer.start()
+        history_writer.start()
+        # `docker stop` sends SIGTERM: shut down through close() instead of dying mid-game
+        try:
+            asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, lambda: asyncio.ensure_future(self.close()))
+        except NotImplementedError:   # no signal handlers on Windows event loops
+            pass
+
+    shutdown = None   # the task running _shut_down(), once close() was called
+
+    async def start(self, *args, **kwargs):
+        try:
+            await super().start(*args, **kwargs)
+        finally:
+            # the gateway closes first: don't let run() return mid-flush
+            if self.shutdown is not None:
+                await asyncio.shield(self.shutdown)
+
+    async def close(self):
+        if self.shutdown is None:
+            self.shutdown = asyncio.ensure_future(self._shut_down())
+        await asyncio.shield(self.shutdown)
+
+    async def _shut_down(self):
+        started = time.perf_counter()
+        # stop taking commands and clicks first, so none arrives to closed files
+        await super().close()
+        # let the balance changes in flight finish and keep out any later ones
+        await wallet.close()
+        # make sure nothing queued in the write-behind buffer is lost
+        for w in (writer, history_writer):
+            try:
+                await w.stop()
+            except Exception as e:
+                print(f"[persistence] final flush failed: {e!r}")
+        try:
+            saved = sessions.save(SESSIONS_FILE)
+        except Exception as e:
+            saved = 0
+            print(f"[shutdown] saving sessions failed: {e!r}")
+        await save_aggregates()
+        print(f"[shutdown] flushed state and saved {saved} session(s) in {time.perf_counter() - started:.2f}s")
+        storage.close()
+        history_store.close()
+        journal.close()
+
 
 # ---------------------- INTENTS ---------------------- #
 intents = discord.Intents.all()   # <--- this enables EVERYTHING
-bot = commands.Bot(command_prefix="!", intents=intents, help_command=None)
+bot = CasinoBot(command_prefix="!", intents=intents, help_command=None)
 
 # ---------------------- CONSTANTS ---------------------- #
 MAX_BET = 200_000_000  # 200m
@@ -96,22 +237,291 @@ CHEST_CONFIG = {
 CHEST_ORDER = ["common", "rare", "epic", "legendary", "mythic", "galaxy"]
 
 # ---------------------- DATA MANAGEMENT ---------------------- #
-if not os.path.exists(DATA_FILE):
-    with open(DATA_FILE, "w") as f:
-        json.dump({}, f)
-
-
 def load_data():
-    with open(DATA_FILE, "r") as f:
-        return json.load(f)
+    """Read the export at DATA_FILE (migration / manual backups)."""
+    return read_json_file(DATA_FILE, data_serializer)
 
 
 def save_data(d):
-    with open(DATA_FILE, "w") as f:
-        json.dump(d, f, indent=4)
+    """Write `d` as an export to DATA_FILE in DATA_FORMAT."""
+    write_json_file(DATA_FILE, d, serializer=data_serializer)
+
+
+def snapshot_data(keys):
+    """
+    Copy the dirty records on the event loop so the storage backend can
+    write them from a worker thread. Dirty records are never evicted,
+    so they are all resident.
+    """
+    snap = {}
+    for uid in keys or ():
+        u = data.peek(uid)
+        if u is not None:
+            snap[uid] = u.to_dict()
+    return snap
+
+
+def split_history(d):
+    """
+    Pop the per-record "history" lists out of `d` (old data files, legacy
+    and current backups) and return them as {uid: [entry, ...]}.
+    """
+    histories = {}
+    for uid, u in d.items():
+        if isinstance(u, dict) and "history" in u:
+            hist = u.pop("history")
+            if hist:
+                histories[uid] = hist
+    return histories
+
+
+def split_history_totals(d):
+    """Pop the lifetime totals backups carry per record: {uid: {game: totals list}}."""
+    return {
+        uid: u.pop(HISTORY_TOTALS_KEY)
+        for uid, u in d.items() if isinstance(u, dict) and HISTORY_TOTALS_KEY in u
+    }
+
+
+def attach_history(users, full):
+    """
+    Add the stored history and lifetime totals of `users` (every user
+    for a full backup) to their backup records, in the layout restores
+    read back with split_history/split_history_totals (worker thread).
+    Returns how many users got a history.
+    """
+    histories, totals = history_store.export(None if full else list(users))
+    attached = 0
+    for uid, u in users.items():
+        if not isinstance(u, dict):
+            continue
+        if uid in histories:
+            u["history"] = LazyHistory(histories[uid])   # written out verbatim
+            attached += 1
+        if uid in totals:
+            u[HISTORY_TOTALS_KEY] = totals[uid]
+    return attached
+
+
+def migrate_loaded_record(uid, u):
+    """Move a legacy history list out of a record as it is loaded."""
+    hist = u.pop("history", None)
+    if hist is not None:
+        if hist:
+            history_store.replace_users({uid: hist})
+            earn_from_history({uid: hist})
+        mark_dirty(uid)
+
+
+def load_record(uid, d):
+    """Stored dict -> UserRecord; the balance column has the current balance."""
+    u = UserRecord.from_dict(uid, d)
+    u.gems = balances.get(u.uid, u.gems)
+    return u
+
+
+# ---------------------- STARTUP TIMINGS ---------------------- #
+startup_phases = {}   # phase -> seconds, in the order they finished
+_phase_started = STARTED
+
+
+def startup_phase(name):
+    """Close a startup phase (import, data load, ...) that ran since the previous one."""
+    global _phase_started
+    now = time.perf_counter()
+    startup_phases[name] = now - _phase_started
+    _phase_started = now
+
+
+def startup_summary():
+    parts = [f"{name} {seconds:.2f}s" for name, seconds in startup_phases.items()]
+    return " · ".join(parts) + f" · total {sum(startup_phases.values()):.2f}s"
+
+
+startup_phase("import")
+
+data_serializer = get_serializer(DATA_FORMAT)
+backup_serializer = get_serializer(BACKUP_FORMAT)
+storage = open_storage(
+    STORAGE_BACKEND, DATA_FILE, DB_FILE, SHARD_DIR, SHARD_COUNT, data_serializer,
+    lazy_history=STARTUP_MODE == "lazy"
+)
+writer = WriteBehind(snapshot_data, storage.save_users, interval=SAVE_INTERVAL, max_pending=SAVE_MAX_PENDING)
+data = UserCache(
+    storage, USER_CACHE_SIZE, writer.is_clean,
+    on_load=migrate_loaded_record, wrap=load_record
+)
+writer.after_write = data.evict   # records written just now may be evicted
+journal = Journal(JOURNAL_DIR, archive_days=JOURNAL_ARCHIVE_DAYS)
+
+history_store = HistoryStore(HISTORY_DB_FILE, limit=HISTORY_LIMIT)
+history_writer = WriteBehind(
+    history_store.take_pending, history_store.write_pending,
+    interval=SAVE_INTERVAL, max_pending=SAVE_MAX_PENDING
+)
+
+
+
+async def migrate_legacy_histories(batch=500):
+    """
+    Move the history lists still inside user records into the history
+    store, a batch at a time in the background after login, so !history
+    and !stats (which only read the store) see them without waiting for
+    the user's record to be loaded. A record loaded meanwhile was already
+    moved by migrate_loaded_record; the others go through `data` and the
+    writer like any change, and nothing is written while a batch is read.
+    Returns how many records were moved.
+    """
+    uids = await run_storage(storage.users_with_history)
+    moved = 0
+    for i in range(0, len(uids), batch):
+        async with writer.paused():
+            loaded = await run_storage(lambda ids: {uid: storage.load_user(uid) for uid in ids}, uids[i:i + batch])
+            pending = {uid: u for uid, u in loaded.items() if u is not None and data.peek(uid) is None}
+            histories = split_history(pending)
+            await run_storage(history_store.replace_users, histories)
+            for uid, u in pending.items():
+                if data.peek(uid) is not None:   # loaded (and moved) while the histories were written
+                    continue
+                data[uid] = load_record(uid, u)
+                writer.mark_dirty(uid)
+                moved += 1
+        earn_from_history(histories)
+    return moved
+
+
+def earn_from_history(histories):
+    """Count moved legacy entries into the week/day boards; the earnings seed only saw the store."""
+    earnings.add_many(
+        (uid, e.get("earned", 0), e.get("timestamp", 0))
+        for uid, hist in histories.items() for e in hist if isinstance(e, dict)
+    )
+
+
+earnings = RollingEarnings(EARNINGS_FILE)
+if not earnings.load():
+    # first start with week/day boards: seed them from the stored history once
+    earnings.add_many(history_store.earned_since(time.time() - earnings.span * DAY))
+    earnings.write(earnings.to_doc())
+boards = BoardCache(ttl=BOARD_CACHE_TTL)
+member_versions = {}   # guild id -> joins + leaves seen, so boards notice a changed member list
+house_stats = HouseStats(HOUSE_STATS_FILE)
+house_stats.load()
+
+
+def mark_dirty(user_id):
+    """Queue a user's record for the next write-behind flush."""
+    writer.mark_dirty(str(user_id))
+    snapshotter.touch(user_id)
+
+
+def adjust_gems(user_id, delta, kind):
+    """
+    Apply a balance change: journal it and queue the record for saving.
+    `kind` is a short tag without spaces (game / command name).
+    Handlers go through `wallet`, which calls this under the user's lock.
+    """
+    uid = str(user_id)
+    u = data[uid]
+    u["gems"] += delta
+    balances.set(uid, u["gems"])
+    journal.append(uid, kind, delta, u["gems"])
+    mark_dirty(uid)
+    return u["gems"]
+
+
+async def run_storage(fn, *args):
+    """Run a blocking storage call in the default executor."""
+    return await asyncio.get_running_loop().run_in_executor(None, fn, *args)
+
+
+# writer.generation the newest local snapshot was taken at (None: none yet this run)
+_snapshot_generation = None
+
+
+async def compact_journal():
+    """Fold the journal into a full snapshot once the store is up to date."""
+    global _snapshot_generation
+    generation = writer.generation
+    # seal the journal as the flush copies the state: every event up to `seq`
+    # is in that copy, so it is in the store once the flush returns (events
+    # journaled while it writes stay in the live file)
+    seq = await writer.flush(at_snapshot=journal.rotate)
+    state = await run_storage(storage.load_all)
+    await run_storage(journal.compact, state, seq)
+    if await save_local_snapshot(state, seq):
+        _snapshot_generation = generation
+
+
+async def save_local_snapshot(state=None, seq=None):
+    """Write `state` to the local snapshot directory (None: nothing changed, link the last one); False if it failed."""
+    def work():
+        if state is None:
+            if local_snapshots.repeat(seq) is None:   # first one ever
+                local_snapshots.write(storage.load_all(), seq)
+        else:
+            local_snapshots.write(state, seq)
+        local_snapshots.prune()
+    try:
+        await run_storage(work)
+    except Exception as e:
+        print(f"[persistence] local snapshot failed: {e!r}")
+        return False
+    return True
+
+
+async def replace_data(new_data):
+    """
+    Swap in a restored state and persist all of it. Histories and totals
+    the records carry replace those users' stored ones; returns how many
+    users got a history back (others keep what the store has).
+    """
+    histories = split_history(new_data)
+    totals = split_history_totals(new_data)
+    async with wallet.hold_all():
+        await writer.flush()
+        await history_writer.flush()
+        if histories or totals:
+            await run_storage(history_store.replace_users, histories, totals)
+        await run_storage(storage.replace_all, new_data)
+        data.clear()
+        balances.reset(await run_storage(storage.balances))
+    backup_chain.reset()
+    await compact_journal()
+    return len(histories)
+
+
+# replay balance changes that never reached the store (crash recovery)
+_recovered = journal.recover(storage.replace_all if storage.count_users() == 0 else None)
+balances = BalanceColumn(storage.balances())
+
+# point-in-time views of everything (or of what changed) for backups
+snapshotter = Snapshotter(
+    storage, writer, lambda: snapshot_data(set(writer.dirty_keys)), balances, lambda: journal.seq
+)
+local_snapshots = LocalSnapshots(LOCAL_SNAPSHOT_DIR)
+backup_chain = BackupChain(BACKUP_FULL_EVERY)
+backup_catalog = BackupCatalog(BACKUP_CATALOG_FILE)
+sessions = SessionRegistry()
+
+
+def cached_user(user_id, guild):
+    """A user discord.py already has in memory (no API call), or None."""
+    member = guild.get_member(user_id) if guild is not None else None
+    return member or bot.get_user(user_id)
 
 
-data = load_data()
+names = NameResolver(cached_user, bot.fetch_user, NAME_CACHE_SIZE, NAME_CACHE_TTL, NAME_FETCH_CONCURRENCY)
+# generations keep counting across restarts, so they name one backup each
+snapshotter.generation = backup_catalog.max_generation()
+
+for _uid, _gems in _recovered.items():
+    balances.set(_uid, _gems)
+    data.setdefault(_uid, UserRecord(int(_uid))).gems = _gems
+    mark_dirty(_uid)
+
+startup_phase("data load")
+
 
 # ---------------------- HELPERS ---------------------- #
 
@@ -159,31 +569,84 @@ def galaxy_color():
 
 
 def ensure_user(user_id):
+    """Materialize a user's record (only call this right before a mutation)."""
     uid = str(user_id)
-    if uid not in data:
-        data[uid] = {}
-    u = data[uid]
-    u.setdefault("gems", 25.0)
-    u.setdefault("last_daily", 0.0)
-    u.setdefault("last_work", 0.0)
-    u.setdefault("history", [])
-    # bless/curse system
-    u.setdefault("bless_infinite", False)
-    u.setdefault("curse_infinite", False)
-    u.setdefault("bless_charges", 0)
-    u.setdefault("curse_charges", 0)
-    save_data(data)
+    u = data.get(uid)
+    if u is None:
+        data[uid] = u = UserRecord(int(uid))
+        balances.set(uid, u.gems)
+        mark_dirty(uid)
+    return u
+
+
+def peek_user(user_id):
+    """
+    Read-only view of a user: the stored record, or the defaults for
+    someone who never played. Never creates or saves anything,
+    so don't mutate what it returns.
+    """
+    u = data.get(str(user_id))
+    if u is None:
+        return UserRecord(int(user_id))
+    return u
+
+
+# every gem change made by a command goes through the wallet (per-user locks)
+wallet = Wallet(peek_user, ensure_user, adjust_gems)
 
 
 def add_history(user_id, entry):
-    ensure_user(user_id)
+    """Queue a game/transaction entry for the user's history (ring buffer)."""
     uid = str(user_id)
-    hist = data[uid].get("history", [])
-    hist.append(entry)
-    if len(hist) > 50:
-        hist = hist[-50:]
-    data[uid]["history"] = hist
-    save_data(data)
+    history_store.append(uid, entry)
+    history_writer.mark_dirty(uid)
+    now = time.time()
+    earnings.add(uid, entry.get("earned", 0), entry.get("timestamp", now))
+    house_stats.record(entry, now)
+
+
+async def bulk_adjust(user_ids, update, kind, history=None, create=True):
+    """
+    Apply a balance change to many users in one pass (server-wide commands).
+    - update(mask) runs one of the BalanceColumn operations over the users'
+      slots and returns [(uid, delta, balance)] for those that changed
+    - history(delta, now) -> history entry, if the change should be recorded
+    - create=False leaves users without a record alone
+    Runs with the whole wallet held; journal lines, balances and history
+    entries go out as one batch each (built and written off the loop), and
+    the records still resident are flushed once.
+    """
+    user_ids = [int(uid) for uid in user_ids]
+    now = time.time()
+    async with wallet.hold_all():
+        if create:
+            for uid in user_ids:
+                if uid not in balances:
+                    ensure_user(uid)
+        changes = update(balances.mask(user_ids))
+        if not changes:
+            return changes
+        resident = []
+        for uid, delta, gems in changes:
+            u = data.peek(uid)
+            if u is not None:
+                u.gems = gems
+                resident.append(str(uid))
+        # no flush (which seals the journal) between the journal lines and the store update
+        async with writer.paused():
+            await run_storage(lambda: journal.append_many([(str(uid), kind, d, g) for uid, d, g in changes]))
+            await run_storage(lambda: storage.update_gems({str(uid): g for uid, _, g in changes}))
+            writer.mark_dirty_many(resident)
+        snapshotter.touch_many(uid for uid, _, _ in changes)
+        if history is not None:
+            def record():
+                entries = [(uid, history(d, now)) for uid, d, _ in changes]
+                history_store.append_many(entries)
+                return [(uid, e.get("earned", 0), e.get("timestamp", now)) for uid, e in entries]
+            earnings.add_many(await run_storage(record))
+            history_writer.mark_dirty_many(str(uid) for uid, _, _ in changes)
+    await writer.flush()
+    return changes
 
 
 def parse_amount(text, user_gems=None, allow_all=False):
@@ -321,7 +784,7 @@ def roll_chest_reward(chest_key: str) -> int:
 # ---------------------- BLESS / CURSE SYSTEM ---------------------- #
 
 
-def consume_rig(u):
+def consume_rig(user_id):
     """
     Returns 'curse', 'bless' or None.
     - If curse_infinite or curse_charges > 0 → 'curse'
@@ -330,6 +793,7 @@ def consume_rig(u):
     Infinite flags stay until turned off.
     Curse has priority over bless.
     """
+    u = data[str(user_id)]
     mode = None
     # curse first
     if u.get("curse_infinite") or u.get("curse_charges", 0) > 0:
@@ -341,36 +805,146 @@ def consume_rig(u):
         if u.get("bless_charges", 0) > 0:
             u["bless_charges"] -= 1
 
-    save_data(data)
+    if mode is not None:
+        mark_dirty(user_id)
     return mode
 
 
 # ---------------------- BACKUP SYSTEM ---------------------- #
 
-async def backup_to_channel(reason: str = "auto"):
-    """Sends current data as JSON file to the backup channel."""
+async def backup_to_channel(reason: str = "auto", full: bool = False):
+    """
+    Upload a backup to the backup channel: a full checkpoint when `full` is
+    set or the chain needs one, otherwise a delta of the users changed since
+    the last backup. Nothing is uploaded when nothing changed.
+    Returns the uploaded filename, or None.
+    """
+    if not snapshotter.changed and not full:
+        return None
     channel = bot.get_channel(BACKUP_CHANNEL_ID)
     if channel is None:
         try:
             channel = await bot.fetch_channel(BACKUP_CHANNEL_ID)
         except Exception:
-            return  # can't backup, invalid channel or no access
+            return None  # can't backup, invalid channel or no access
 
+    snap = None
     try:
         stamp = datetime.utcnow().strftime("%Y-%m-%d_%H-%M-%S")
-        payload = json.dumps(data, indent=2)
-        fp = io.BytesIO(payload.encode("utf-8"))
-        filename = f"casino_backup_{stamp}.json"
+        full = full or backup_chain.next_is_full()
+        snap = await snapshotter.capture(full=full)
+        if full:
+            doc = snap.users
+            base = f"casino_backup_{stamp}_g{snap.generation}"
+            kind = "full checkpoint"
+        else:
+            seq = backup_chain.deltas + 1
+            doc = delta_doc(snap, backup_chain.checkpoint, seq)
+            base = f"casino_delta_{stamp}_{seq:03d}"
+            kind = f"delta {seq}/{backup_chain.full_every}"
+        if full:
+            await save_local_snapshot(snap.users, snap.seq)
+        # local snapshots hold balances only; the history db sits next to them
+        await history_writer.flush()
+        await run_storage(attach_history, snap.users, full)
+        manifest, parts = await run_storage(
+            pack_backup, doc, base, BACKUP_CODEC, BACKUP_PART_BYTES, backup_serializer
+        )
+
+        # parts first, then the manifest that says where they are
+        for i in range(0, len(parts), BACKUP_FILES_PER_MESSAGE):
+            batch = parts[i:i + BACKUP_FILES_PER_MESSAGE]
+            msg = await channel.send(files=[discord.File(io.BytesIO(d), filename=n) for n, d in batch])
+            for entry in manifest["parts"][i:i + BACKUP_FILES_PER_MESSAGE]:
+                entry["message"] = msg.id
+        manifest.update(kind="full" if full else "delta", generation=snap.generation, created=stamp)
+        if not full:
+            manifest.update(checkpoint=backup_chain.checkpoint, seq=seq)
+        filename = base + MANIFEST_SUFFIX
+        size = sum(entry["size"] for entry in manifest["parts"])
 
         embed = discord.Embed(
             title="💾 Galaxy Casino Backup",
-            description=f"Reason: **{reason}**\nTimestamp (UTC): `{stamp}`",
+            description=(
+                f"Reason: **{reason}** · {kind}\nTimestamp (UTC): `{stamp}`\n"
+                f"Generation: `{snap.generation}` · Users: **{len(snap.users)}**\n"
+                f"Size: **{size / 1024:.1f} KiB** in {len(parts)} part(s), {manifest['codec']}"
+            ),
             color=galaxy_color()
         )
-        await channel.send(embed=embed, file=discord.File(fp, filename=filename))
-    except Exception:
-        # don't crash the bot if backup fails
-        pass
+        manifest_file = io.BytesIO(json.dumps(manifest, indent=2).encode("utf-8"))
+        msg = await channel.send(embed=embed, file=discord.File(manifest_file, filename=filename))
+    except Exception as e:
+        # don't crash the bot if backup fails; the next one includes these users again
+        print(f"[backup] {reason} backup failed: {e!r}")
+        if snap is not None:
+            snapshotter.rollback(snap)
+        return None
+
+    if full:
+        backup_chain.record_full(filename)
+    else:
+        backup_chain.record_delta()
+
+    backup_catalog.add({
+        "message": msg.id,
+        "filename": filename,
+        "generation": snap.generation,
+        "kind": manifest["kind"],
+        "size": size,
+        "sha256": manifest["raw_sha256"],
+        "created": stamp,
+        "checkpoint": manifest.get("checkpoint"),
+        "seq": manifest.get("seq"),
+    })
+    try:
+        await run_storage(backup_catalog.save)
+    except Exception as e:
+        # the backup itself is uploaded; restorelatest falls back to scanning the channel
+        print(f"[backup] saving catalog failed: {e!r}")
+    return filename
+
+
+async def read_packed_backup(channel, manifest, attached=None):
+    """
+    Download the parts of a manifest (from `attached` {filename: attachment}
+    when given, else from their messages in `channel`), verify and unpack them.
+    """
+    unpacker = Unpacker(manifest)
+    messages = {}
+    for entry in manifest["parts"]:
+        att = (attached or {}).get(entry["name"])
+        if att is None:
+            msg_id = entry.get("message")
+            if msg_id is None:
+                raise BackupError(f"part {entry['name']} is missing")
+            if msg_id not in messages:
+                messages[msg_id] = await channel.fetch_message(msg_id)
+            att = next((a for a in messages[msg_id].attachments if a.filename == entry["name"]), None)
+            if att is None:
+                raise BackupError(f"part {entry['name']} is missing")
+        await run_storage(unpacker.feed, entry["name"], await att.read())
+    return await run_storage(unpacker.finish)
+
+
+async def read_cataloged(channel, entry):
+    """Download a backup listed in the catalog: fetch its manifest message by id, then its parts."""
+    msg = await channel.fetch_message(entry["message"])
+    att = next((a for a in msg.attachments if a.filename == entry["filename"]), None)
+    if att is None:
+        raise BackupError(f"{entry['filename']} is no longer in the backup channel")
+    doc = await read_backup(channel, att)
+    if entry["kind"] == "delta" and not is_delta(doc):
+        raise BackupError(f"{entry['filename']} is not a delta backup")
+    return doc
+
+
+async def read_backup(channel, att, attached=None):
+    """Backup document behind an attachment: a manifest or an old single-file backup."""
+    raw = await att.read()
+    if is_manifest_name(att.filename):
+        return await read_packed_backup(channel, read_manifest(raw), attached)
+    return await run_storage(decode_backup, raw)
 
 
 @tasks.loop(minutes=10)
@@ -383,11 +957,121 @@ async def before_auto_backup():
     await bot.wait_until_ready()
 
 
+async def save_aggregates():
+    """Write the in-memory aggregates (week/day earnings, house stats) to their files."""
+    for store in (earnings, house_stats):
+        try:
+            await run_storage(store.write, store.to_doc())
+        except Exception as e:
+            print(f"[persistence] saving {store.path} failed: {e!r}")
+
+
+@tasks.loop(minutes=JOURNAL_COMPACT_MINUTES)
+async def journal_compact_task():
+    await save_aggregates()
+    # not journal.appended: charges, cooldowns and other fields change without a journal event
+    if writer.generation != _snapshot_generation:
+        await compact_journal()
+    else:
+        await save_local_snapshot(seq=journal.seq)
+
+
+# ---------------------- RESUME AFTER RESTART ---------------------- #
+async def fetch_session_message(session):
+    channel = bot.get_channel(session["channel"]) or await bot.fetch_channel(session["channel"])
+    return await channel.fetch_message(session["message"])
+
+
+async def refund_session(session):
+    """An interrupted game: give the stake back and say so on its message."""
+    owner, bet = session["owner"], session["bet"]
+    await wallet.credit(owner, bet, "restart_refund")
+    add_history(owner, {
+        "game": session["kind"],
+        "bet": bet,
+        "result": "refund",
+        "earned": 0,
+        "timestamp": time.time()
+    })
+    if session["message"] is None:
+        return
+    try:
+        msg = await fetch_session_message(session)
+        embed = msg.embeds[0] if msg.embeds else discord.Embed(color=galaxy_color())
+        embed.set_footer(text=f"♻️ The bot restarted — your {fmt(bet)} gem bet was refunded.")
+        await msg.edit(embed=embed, view=None)
+    except Exception as e:
+        print(f"[resume] could not update the {session['kind']} message: {e!r}")
+
+
+async def resume_lottery(session):
+    """A lottery that was running: rebuild its view on the same message and restart its timer."""
+    tickets = {int(uid): count for uid, count in session["tickets"].items()}
+    session["tickets"] = tickets
+    sessions.restore(session)
+    view = LotteryView(session["id"], session["bet"], session["end_ts"], session["channel"], tickets)
+    if session["message"] is not None:
+        bot.add_view(view, message_id=session["message"])
+        try:
+            view.message = await fetch_session_message(session)
+        except Exception as e:
+            print(f"[resume] lottery message is gone, drawing without it: {e!r}")
+    if view.message is None:
+        # finish() needs the message; without it every ticket is refunded
+        for uid, count in tickets.items():
+            await wallet.credit(uid, session["bet"] * count, "restart_refund")
+        sessions.close(session["id"])
+        return
+    bot.loop.create_task(run_lottery(view))
+
+
+async def resume_sessions():
+    """Refund the games and resume the lotteries the previous run saved at shutdown."""
+    started = time.perf_counter()
+    pending = await run_storage(load_saved_sessions, SESSIONS_FILE)
+    if not pending:
+        return
+    refunded = resumed = 0
+    while pending:
+        session = pending.pop(0)
+        # drop it from the file first: a crash now can lose a refund but never pay one twice
+        await run_storage(save_pending, SESSIONS_FILE, pending)
+        try:
+            if session["kind"] == "lottery":
+                await resume_lottery(session)
+                resumed += 1
+            else:
+                await refund_session(session)
+                refunded += 1
+        except Exception as e:
+            print(f"[resume] {session['kind']} session {session['id']} failed: {e!r}")
+    print(
+        f"[resume] refunded {refunded} game(s), resumed {resumed} lottery(ies) "
+        f"in {time.perf_counter() - started:.2f}s"
+    )
+
+
 @bot.event
 async def on_ready():
     if not auto_backup_task.is_running():
         auto_backup_task.start()
+    if not journal_compact_task.is_running():
+        journal_compact_task.start()
+    first_ready = "first on_ready" not in startup_phases
+    if first_ready:
+        startup_phase("first on_ready")
+        print(f"[startup] {STARTUP_MODE}: {startup_summary()}")
+        await resume_sessions()
     print(f"Logged in as {bot.user} (ID: {bot.user.id})")
+    if first_ready:
+        # after login, so commands are answered while old histories move over
+        try:
+            moved = await migrate_legacy_histories()
+        except Exception as e:
+            print(f"[startup] moving legacy histories failed: {e!r}")
+        else:
+            if moved:
+                print(f"[startup] moved the history of {moved} user(s) into {HISTORY_DB_FILE}")
 
 
 # --------------------------------------------------------------
@@ -400,9 +1084,7 @@ async def balance(ctx, member: discord.Member = None):
     !balance @user / !bal @user -> other's balance
     """
     target = member or ctx.author
-    ensure_user(target.id)
-    u = data[str(target.id)]
-    gems = u["gems"]
+    gems = peek_user(target.id)["gems"]
 
     if target.id == ctx.author.id:
         desc = f"✨ {target.mention}\nYou currently hold **{fmt(gems)}** gems."
@@ -423,11 +1105,17 @@ async def balance(ctx, member: discord.Member = None):
 # --------------------------------------------------------------
 @bot.command()
 async def daily(ctx):
-    ensure_user(ctx.author.id)
-    u = data[str(ctx.author.id)]
     now = time.time()
     cooldown = 24 * 3600
-    last = u.get("last_daily", 0)
+    reward = 25_000_000  # 25m
+    # check and claim under the user's lock, so a double command can't claim twice
+    async with wallet.hold(ctx.author.id):
+        last = peek_user(ctx.author.id)["last_daily"]
+        if now - last >= cooldown:
+            u = ensure_user(ctx.author.id)
+            wallet.credit_locked(ctx.author.id, reward, "daily")
+            u["last_daily"] = now
+            mark_dirty(ctx.author.id)
 
     if now - last < cooldown:
         remaining = cooldown - (now - last)
@@ -441,11 +1129,6 @@ async def daily(ctx):
         await ctx.send(embed=embed)
         return
 
-    reward = 25_000_000  # 25m
-    u["gems"] += reward
-    u["last_daily"] = now
-    save_data(data)
-
     add_history(ctx.author.id, {
         "game": "daily",
         "bet": 0,
@@ -521,9 +1204,7 @@ async def guessthecolor(ctx, prize: str):
 
         # CORRECT GUESS
         winner = msg.author
-        ensure_user(winner.id)
-        data[str(winner.id)]["gems"] += parsed_prize
-        save_data(data)
+        await wallet.credit(winner.id, parsed_prize, "guess_color")
 
         add_history(winner.id, {
             "game": "guess_color",
@@ -550,11 +1231,16 @@ async def guessthecolor(ctx, prize: str):
 # --------------------------------------------------------------
 @bot.command()
 async def work(ctx):
-    ensure_user(ctx.author.id)
-    u = data[str(ctx.author.id)]
     now = time.time()
     cooldown = 3600  # 1 hour
-    last = u.get("last_work", 0)
+    reward = random.randint(10_000_000, 15_000_000)
+    async with wallet.hold(ctx.author.id):
+        last = peek_user(ctx.author.id)["last_work"]
+        if now - last >= cooldown:
+            u = ensure_user(ctx.author.id)
+            wallet.credit_locked(ctx.author.id, reward, "work")
+            u["last_work"] = now
+            mark_dirty(ctx.author.id)
 
     if now - last < cooldown:
         remaining = cooldown - (now - last)
@@ -568,11 +1254,6 @@ async def work(ctx):
         await ctx.send(embed=embed)
         return
 
-    reward = random.randint(10_000_000, 15_000_000)
-    u["gems"] += reward
-    u["last_work"] = now
-    save_data(data)
-
     add_history(ctx.author.id, {
         "game": "work",
         "bet": 0,
@@ -595,21 +1276,14 @@ async def work(ctx):
 # --------------------------------------------------------------
 @bot.command()
 async def gift(ctx, member: discord.Member, amount: str):
-    ensure_user(ctx.author.id)
-    ensure_user(member.id)
-    sender = data[str(ctx.author.id)]
-    receiver = data[str(member.id)]
+    sender = peek_user(ctx.author.id)
 
     val = parse_amount(amount, sender["gems"], allow_all=False)
     if val is None or val <= 0:
         return await ctx.send("❌ Invalid amount.")
-    if val > sender["gems"]:
+    if not await wallet.transfer(ctx.author.id, member.id, val, "gift", "gift_received"):
         return await ctx.send("❌ You don't have enough gems.")
 
-    sender["gems"] -= val
-    receiver["gems"] += val
-    save_data(data)
-
     now = time.time()
     add_history(ctx.author.id, {
         "game": "gift",
@@ -639,8 +1313,7 @@ async def gift(ctx, member: discord.Member, amount: str):
 # --------------------------------------------------------------
 @bot.command()
 async def coinflip(ctx, bet: str, choice: str):
-    ensure_user(ctx.author.id)
-    u = data[str(ctx.author.id)]
+    u = peek_user(ctx.author.id)
     amount = parse_amount(bet, u["gems"], allow_all=True)
     if amount is None or amount <= 0:
         return await ctx.send("❌ Invalid bet.")
@@ -653,10 +1326,10 @@ async def coinflip(ctx, bet: str, choice: str):
     if choice not in ["heads", "tails"]:
         return await ctx.send("❌ Choose `heads` or `tails`.")
 
-    u["gems"] -= amount
-    save_data(data)
+    if await wallet.debit_if_sufficient(ctx.author.id, amount, "coinflip") is None:
+        return await ctx.send("❌ You don't have enough gems.")
 
-    rig = consume_rig(u)
+    rig = consume_rig(ctx.author.id)
 
     if rig == "curse":
         result = "tails" if choice == "heads" else "heads"
@@ -666,7 +1339,7 @@ async def coinflip(ctx, bet: str, choice: str):
         result = random.choice(["heads", "tails"])
 
     if result == choice:
-        u["gems"] += amount * 2
+        await wallet.credit(ctx.author.id, amount * 2, "coinflip")
         profit = amount
         res = "win"
         title = "🪙 Coinflip — You Won!"
@@ -677,8 +1350,6 @@ async def coinflip(ctx, bet: str, choice: str):
         title = "🪙 Coinflip — You Lost"
         color = discord.Color.red()
 
-    save_data(data)
-
     embed = discord.Embed(
         title=title,
         description=(
@@ -705,8 +1376,7 @@ async def coinflip(ctx, bet: str, choice: str):
 # --------------------------------------------------------------
 @bot.command()
 async def slots(ctx, bet: str):
-    ensure_user(ctx.author.id)
-    u = data[str(ctx.author.id)]
+    u = peek_user(ctx.author.id)
 
     amount = parse_amount(bet, u["gems"], allow_all=True)
     if amount is None or amount <= 0:
@@ -716,10 +1386,10 @@ async def slots(ctx, bet: str):
     if amount > u["gems"]:
         return await ctx.send("❌ You don't have enough gems.")
 
-    u["gems"] -= amount
-    save_data(data)
+    if await wallet.debit_if_sufficient(ctx.author.id, amount, "slots") is None:
+        return await ctx.send("❌ You don't have enough gems.")
 
-    rig = consume_rig(u)
+    rig = consume_rig(ctx.author.id)
 
     symbols = ["🍒", "🍋", "⭐", "💎"]
 
@@ -772,7 +1442,7 @@ async def slots(ctx, bet: str):
         multiplier = 2.0
         reward = amount * multiplier
         profit = reward - amount
-        u["gems"] += reward
+        await wallet.credit(ctx.author.id, reward, "slots")
         result_text = f"3x {best_symbol}! You win."
         res = "win"
     else:
@@ -782,8 +1452,6 @@ async def slots(ctx, bet: str):
         result_text = "No match."
         res = "lose"
 
-    save_data(data)
-
     grid = (
         f"{row1[0]} {row1[1]} {row1[2]} {row1[3]}\n"
         f"➡ {row2[0]} {row2[1]} {row2[2]} {row2[3]} ⬅\n"
@@ -818,8 +1486,7 @@ async def slots(ctx, bet: str):
 # --------------------------------------------------------------
 @bot.command()
 async def mines(ctx, bet: str, mines: int = 3):
-    ensure_user(ctx.author.id)
-    u = data[str(ctx.author.id)]
+    u = peek_user(ctx.author.id)
 
     amount = parse_amount(bet, u["gems"], allow_all=True)
     if amount is None or amount <= 0:
@@ -831,10 +1498,11 @@ async def mines(ctx, bet: str, mines: int = 3):
     if not 1 <= mines <= 15:
         return await ctx.send("❌ Mines must be between **1 and 15**.")
 
-    u["gems"] -= amount
-    save_data(data)
+    if await wallet.debit_if_sufficient(ctx.author.id, amount, "mines") is None:
+        return await ctx.send("❌ You don't have enough gems.")
+    sid = sessions.open("mines", ctx.author.id, amount, ctx.channel.id)
 
-    rig = consume_rig(u)  # 'bless', 'curse', or None
+    rig = consume_rig(ctx.author.id)  # 'bless', 'curse', or None
 
     owner = ctx.author.id
     game_over = False
@@ -893,6 +1561,7 @@ async def mines(ctx, bet: str, mines: int = 3):
                 exploded_index = self.index
                 revealed[self.index] = False
                 game_over = True
+                sessions.close(sid)
 
                 for i, btn in enumerate(view.children):
                     if isinstance(btn, Tile):
@@ -935,6 +1604,7 @@ async def mines(ctx, bet: str, mines: int = 3):
                 exploded_index = self.index
                 revealed[self.index] = False
                 game_over = True
+                sessions.close(sid)
                 for i, btn in enumerate(view.children):
                     if isinstance(btn, Tile):
                         btn.disabled = True
@@ -987,6 +1657,7 @@ async def mines(ctx, bet: str, mines: int = 3):
             # CURSE: cashout still loses full amount
             if rig == "curse":
                 game_over = True
+                sessions.close(sid)
                 exploded_index = 0  # mark as exploded so reward shows 0
                 for i, btn in enumerate(view.children):
                     if isinstance(btn, Tile):
@@ -1017,8 +1688,8 @@ async def mines(ctx, bet: str, mines: int = 3):
 
             game_over = True
             reward = calc_reward()
-            u["gems"] += reward
-            save_data(data)
+            await wallet.credit(owner, reward, "mines")
+            sessions.close(sid)
 
             for i, btn in enumerate(view.children):
                 if isinstance(btn, Tile):
@@ -1043,7 +1714,8 @@ async def mines(ctx, bet: str, mines: int = 3):
             await ctx.send(f"💰 You cashed out **{fmt(reward - amount)}** gems!")
 
     view.add_item(Cashout())
-    await ctx.send(embed=embed_update(), view=view)
+    msg = await ctx.send(embed=embed_update(), view=view)
+    sessions.bind(sid, msg.id)
 
 
 # --------------------------------------------------------------
@@ -1051,8 +1723,7 @@ async def mines(ctx, bet: str, mines: int = 3):
 # --------------------------------------------------------------
 @bot.command()
 async def tower(ctx, bet: str):
-    ensure_user(ctx.author.id)
-    u = data[str(ctx.author.id)]
+    u = peek_user(ctx.author.id)
 
     amount = parse_amount(bet, u["gems"], allow_all=True)
     if amount is None or amount <= 0:
@@ -1062,10 +1733,11 @@ async def tower(ctx, bet: str):
     if amount > u["gems"]:
         return await ctx.send("❌ You don't have enough gems.")
 
-    u["gems"] -= amount
-    save_data(data)
+    if await wallet.debit_if_sufficient(ctx.author.id, amount, "tower") is None:
+        return await ctx.send("❌ You don't have enough gems.")
+    sid = sessions.open("tower", ctx.author.id, amount, ctx.channel.id)
 
-    rig = consume_rig(u)
+    rig = consume_rig(ctx.author.id)
 
     TOTAL_ROWS = 10
     current_row = 0
@@ -1159,6 +1831,7 @@ async def tower(ctx, bet: str):
                 grid[current_row][self.pos] = False
                 exploded_cell = (current_row, self.pos)
                 game_over = True
+                sessions.close(sid)
                 earned_on_end = 0
 
                 for r in range(TOTAL_ROWS):
@@ -1186,8 +1859,8 @@ async def tower(ctx, bet: str):
                 game_over = True
                 reward = calc_reward()
                 earned_on_end = reward
-                u["gems"] += reward
-                save_data(data)
+                await wallet.credit(owner, reward, "tower")
+                sessions.close(sid)
 
                 for r in range(TOTAL_ROWS):
                     bc = bomb_positions[r]
@@ -1224,6 +1897,7 @@ async def tower(ctx, bet: str):
             # CURSE: even cashout is a loss
             if rig == "curse":
                 game_over = True
+                sessions.close(sid)
                 earned_on_end = 0
 
                 for r in range(TOTAL_ROWS):
@@ -1251,8 +1925,8 @@ async def tower(ctx, bet: str):
             game_over = True
             reward = calc_reward()
             earned_on_end = reward
-            u["gems"] += reward
-            save_data(data)
+            await wallet.credit(owner, reward, "tower")
+            sessions.close(sid)
 
             for r in range(TOTAL_ROWS):
                 for c in range(3):
@@ -1277,7 +1951,8 @@ async def tower(ctx, bet: str):
     view.add_item(Choice(2))
     view.add_item(Cashout())
 
-    await ctx.send(embed=embed_update(False), view=view)
+    msg = await ctx.send(embed=embed_update(False), view=view)
+    sessions.bind(sid, msg.id)
 
 
 # --------------------------------------------------------------
@@ -1306,8 +1981,7 @@ def hand_value(hand):
 
 @bot.command()
 async def blackjack(ctx, bet: str):
-    ensure_user(ctx.author.id)
-    u = data[str(ctx.author.id)]
+    u = peek_user(ctx.author.id)
 
     amount = parse_amount(bet, u["gems"], allow_all=True)
     if amount is None or amount <= 0:
@@ -1317,9 +1991,9 @@ async def blackjack(ctx, bet: str):
     if amount > u["gems"]:
         return await ctx.send("❌ You don't have enough gems.")
 
-    rig = consume_rig(u)
-    u["gems"] -= amount
-    save_data(data)
+    if await wallet.debit_if_sufficient(ctx.author.id, amount, "blackjack") is None:
+        return await ctx.send("❌ You don't have enough gems.")
+    rig = consume_rig(ctx.author.id)
 
     # Rigged: instant-looking game
     if rig in ("bless", "curse"):
@@ -1346,8 +2020,7 @@ async def blackjack(ctx, bet: str):
             while hand_value(dealer) >= hand_value(player):
                 dealer = random_hand(15, 19)
             profit = int(amount * 1.7)
-            u["gems"] += amount + profit
-            save_data(data)
+            await wallet.credit(ctx.author.id, amount + profit, "blackjack")
             result_text = "Your hand is higher. You win."
             res = "win"
 
@@ -1379,6 +2052,7 @@ async def blackjack(ctx, bet: str):
     # Normal interactive blackjack
     player = [draw_card(), draw_card()]
     dealer = [draw_card(), draw_card()]
+    sid = sessions.open("blackjack", ctx.author.id, amount, ctx.channel.id)
 
     def make_embed(show_dealer=False, final=False, extra_msg=""):
         pv = hand_value(player)
@@ -1401,8 +2075,21 @@ async def blackjack(ctx, bet: str):
         return e
 
     view = View(timeout=40)
+    game_over = False
+
+    async def on_timeout():
+        # a hand left idle forfeits the bet, so there is nothing to refund on restart
+        sessions.close(sid)
+
+    view.on_timeout = on_timeout
 
     async def finish_game(interaction=None):
+        nonlocal game_over
+        # settle once: set before the first await so a second click can't pay again
+        game_over = True
+        for b in view.children:
+            b.disabled = True
+        view.stop()
         pv = hand_value(player)
         dv = hand_value(dealer)
         while dv < 17:
@@ -1445,10 +2132,10 @@ async def blackjack(ctx, bet: str):
             text = "It's a push. No one wins."
 
         if profit > 0:
-            u["gems"] += amount + profit
+            await wallet.credit(ctx.author.id, amount + profit, "blackjack")
         elif profit == 0:
-            u["gems"] += amount
-        save_data(data)
+            await wallet.credit(ctx.author.id, amount, "blackjack")
+        sessions.close(sid)
 
         add_history(ctx.author.id, {
             "game": "blackjack",
@@ -1471,10 +2158,10 @@ async def blackjack(ctx, bet: str):
         async def callback(self, interaction):
             if interaction.user.id != ctx.author.id:
                 return await interaction.response.send_message("❌ Not your game!", ephemeral=True)
+            if game_over:
+                return await interaction.response.send_message("❌ Game already ended!", ephemeral=True)
             player.append(draw_card())
             if hand_value(player) > 21:
-                for b in view.children:
-                    b.disabled = True
                 await finish_game(interaction)
                 return
             await interaction.response.edit_message(embed=make_embed(), view=view)
@@ -1486,14 +2173,15 @@ async def blackjack(ctx, bet: str):
         async def callback(self, interaction):
             if interaction.user.id != ctx.author.id:
                 return await interaction.response.send_message("❌ Not your game!", ephemeral=True)
-            for b in view.children:
-                b.disabled = True
+            if game_over:
+                return await interaction.response.send_message("❌ Game already ended!", ephemeral=True)
             await finish_game(interaction)
 
     view.add_item(Hit())
     view.add_item(Stand())
 
-    await ctx.send(embed=make_embed(), view=view)
+    msg = await ctx.send(embed=make_embed(), view=view)
+    sessions.bind(sid, msg.id)
 
 
 # --------------------------------------------------------------
@@ -1572,13 +2260,11 @@ async def chests(ctx):
 
         async def handle_buy(interaction: discord.Interaction, count: int):
             user = interaction.user
-            ensure_user(user.id)
-            u = data[str(user.id)]
             cfg = CHEST_CONFIG[chest_key]
             price = cfg["price"]
             total_cost = price * count
 
-            if u["gems"] < total_cost:
+            if await wallet.debit_if_sufficient(user.id, total_cost, f"chest_{chest_key}") is None:
                 return await interaction.response.send_message(
                     f"❌ You don't have enough gems for **{count}x {cfg['name']}** "
                     f"(need **{fmt(total_cost)}**).",
@@ -1586,15 +2272,13 @@ async def chests(ctx):
                 )
 
             # perform rolls
-            u["gems"] -= total_cost
             total_reward = 0
             rewards_list = []
             for _ in range(count):
                 reward = roll_chest_reward(chest_key)
                 total_reward += reward
                 rewards_list.append(reward)
-            u["gems"] += total_reward
-            save_data(data)
+            await wallet.credit(user.id, total_reward, f"chest_{chest_key}")
 
             net = total_reward - total_cost
 
@@ -1674,208 +2358,279 @@ async def chests(ctx):
 # --------------------------------------------------------------
 #                      LOTTERY (ticket system)
 # --------------------------------------------------------------
-@bot.command()
-@commands.has_guild_permissions(manage_guild=True)
-async def lottery(ctx, ticket_price: str, duration: str):
-    """
-    Start a lottery.
-    Usage: !lottery 50m 10m
-    - ticket_price: 50m, 10m, 1b, etc.
-    - duration: 30s, 10m, 2h, 1d
-    Users buy tickets via button, pot +10% goes to winner.
-    """
-    price = parse_amount(ticket_price, None, allow_all=False)
-    if price is None or price <= 0:
-        return await ctx.send("❌ Invalid ticket price.")
+def make_lottery_embed(price_value, view_obj, end_timestamp):
+    total_tickets = sum(view_obj.tickets.values())
+    pot = int(price_value * total_tickets)
+    prize = int(pot * (1 + LOTTERY_BONUS)) if pot > 0 else 0
+    desc = (
+        f"🎟 Ticket price: **{fmt(price_value)}** gems\n"
+        f"💰 Current pot: **{fmt(pot)}** gems\n"
+        f"🏆 Winner prize (+10%): **{fmt(prize)}** gems\n"
+        f"🎫 Total tickets: **{total_tickets}**\n"
+        f"⏳ Ends: <t:{int(end_timestamp)}:R>\n\n"
+        "Press **Buy** to get a ticket.\n"
+        "More tickets = higher win chance!"
+    )
+    e = discord.Embed(
+        title="🎟 Galaxy Lottery",
+        description=desc,
+        color=galaxy_color()
+    )
+    return e
 
-    seconds = parse_duration(duration)
-    if seconds is None:
-        return await ctx.send("❌ Invalid duration. Use like `30s`, `10m`, `2h`, `1d`.")
-    if seconds > 7 * 24 * 3600:
-        return await ctx.send("❌ Maximum duration is 7 days.")
 
-    end_ts = int(time.time()) + seconds
+class LotteryView(View):
+    """
+    A running lottery. Its state lives in a session (sessions.py) and its
+    buttons have fixed custom_ids, so after a restart the same view can be
+    rebuilt from the saved session and attached to the old message.
+    """
 
-    def make_lottery_embed(price_value, view_obj, end_timestamp):
-        total_tickets = sum(view_obj.tickets.values())
-        pot = int(price_value * total_tickets)
-        prize = int(pot * (1 + LOTTERY_BONUS)) if pot > 0 else 0
-        desc = (
-            f"🎟 Ticket price: **{fmt(price_value)}** gems\n"
-            f"💰 Current pot: **{fmt(pot)}** gems\n"
-            f"🏆 Winner prize (+10%): **{fmt(prize)}** gems\n"
-            f"🎫 Total tickets: **{total_tickets}**\n"
-            f"⏳ Ends: <t:{int(end_timestamp)}:R>\n\n"
-            "Press **Buy** to get a ticket.\n"
-            "More tickets = higher win chance!"
-        )
-        e = discord.Embed(
-            title="🎟 Galaxy Lottery",
-            description=desc,
-            color=galaxy_color()
-        )
-        return e
+    def __init__(self, sid, price_value, end_timestamp, channel_id, tickets=None):
+        # no View timeout: run_lottery() ends it, and persistent views can't have one
+        super().__init__(timeout=None)
+        self.sid = sid
+        self.ticket_price = price_value
+        self.end_ts = end_timestamp
+        self.channel_id = channel_id
+        self.tickets: dict[int, int] = tickets if tickets is not None else {}  # user_id -> count
+        self.message: discord.Message | None = None
+        self.finished: bool = False       # prevent double-finish
+        self.add_item(BuyTicket(sid))
+        self.add_item(ShowParticipants(sid))
+
+    async def finish(self):
+        if self.finished:
+            return
+        self.finished = True
+
+        if self.message is None:
+            return
+
+        channel = self.message.channel
+        total_tickets = sum(self.tickets.values())
+
+        # Disable all buttons
+        for child in self.children:
+            child.disabled = True
+
+        if total_tickets == 0:
+            sessions.close(self.sid)
+            embed = make_lottery_embed(self.ticket_price, self, self.end_ts)
+            embed.title = "🎟 Lottery Ended"
+            embed.description += "\n\n❌ No tickets were bought."
+            embed.color = discord.Color.red()
+            try:
+                await self.message.edit(embed=embed, view=self)
+            except Exception:
+                pass
+            await channel.send("❌ Lottery ended — nobody bought a ticket.")
+            return
 
-    class LotteryView(View):
-        def __init__(self, price_value, end_timestamp, ctx_obj, timeout_value):
-            # Discord max timeout is 1 day (86400s), so clamp to that
-            super().__init__(timeout=min(timeout_value, 86400))
-            self.ticket_price = price_value
-            self.end_ts = end_timestamp
-            self.ctx = ctx_obj
-            self.tickets: dict[int, int] = {}  # user_id -> count
-            self.message: discord.Message | None = None
-            self.finished: bool = False       # prevent double-finish
-
-        async def on_timeout(self):
-            # View timeout (max 1 day). We still call finish,
-            # but finish() checks self.finished to avoid double calls.
-            await self.finish()
-
-        async def finish(self):
-            if self.finished:
-                return
-            self.finished = True
+        # Build weighted list of entries
+        entries: list[int] = []
+        for uid, count in self.tickets.items():
+            entries.extend([uid] * count)
+        winner_id = random.choice(entries)
+        prize = int(self.ticket_price * total_tickets * (1 + LOTTERY_BONUS))
 
-            if self.message is None:
-                return
+        await wallet.credit(winner_id, prize, "lottery")
+        sessions.close(self.sid)
 
-            channel = self.ctx.channel
-            total_tickets = sum(self.tickets.values())
+        add_history(winner_id, {
+            "game": "lottery",
+            "bet": 0,
+            "result": "win",
+            "earned": prize,
+            "timestamp": time.time()
+        })
 
-            # Disable all buttons
-            for child in self.children:
-                child.disabled = True
+        embed = discord.Embed(
+            title="🎟 Lottery Ended",
+            description=(
+                f"🎉 Winner: <@{winner_id}>\n"
+                f"💰 Prize: **{fmt(prize)}** gems\n"
+                f"🎫 Total tickets: **{total_tickets}**"
+            ),
+            color=discord.Color.green()
+        )
+        try:
+            await self.message.edit(embed=embed, view=self)
+        except Exception:
+            pass
 
-            if total_tickets == 0:
-                embed = make_lottery_embed(self.ticket_price, self, self.end_ts)
-                embed.title = "🎟 Lottery Ended"
-                embed.description += "\n\n❌ No tickets were bought."
-                embed.color = discord.Color.red()
-                try:
-                    await self.message.edit(embed=embed, view=self)
-                except Exception:
-                    pass
-                await channel.send("❌ Lottery ended — nobody bought a ticket.")
-                return
+        await channel.send(
+            f"🎉 Congrats <@{winner_id}>! You won **{fmt(prize)}** gems in the lottery!"
+        )
 
-            # Build weighted list of entries
-            entries: list[int] = []
-            for uid, count in self.tickets.items():
-                entries.extend([uid] * count)
-            winner_id = random.choice(entries)
-            prize = int(self.ticket_price * total_tickets * (1 + LOTTERY_BONUS))
 
-            ensure_user(winner_id)
-            data[str(winner_id)]["gems"] += prize
-            save_data(data)
+class BuyTicket(Button):
+    def __init__(self, sid):
+        super().__init__(label="Buy 🎟", style=discord.ButtonStyle.success, custom_id=f"lottery:{sid}:buy")
 
-            add_history(winner_id, {
-                "game": "lottery",
-                "bet": 0,
-                "result": "win",
-                "earned": prize,
-                "timestamp": time.time()
-            })
+    async def callback(self, interaction: discord.Interaction):
+        view = self.view
+        user = interaction.user
+        if view.finished:
+            return await interaction.response.send_message("❌ This lottery has ended.", ephemeral=True)
 
-            embed = discord.Embed(
-                title="🎟 Lottery Ended",
-                description=(
-                    f"🎉 Winner: <@{winner_id}>\n"
-                    f"💰 Prize: **{fmt(prize)}** gems\n"
-                    f"🎫 Total tickets: **{total_tickets}**"
-                ),
-                color=discord.Color.green()
+        if await wallet.debit_if_sufficient(user.id, view.ticket_price, "lottery_ticket") is None:
+            return await interaction.response.send_message(
+                "❌ You don't have enough gems for a ticket.",
+                ephemeral=True
             )
-            try:
-                await self.message.edit(embed=embed, view=self)
-            except Exception:
-                pass
 
-            await channel.send(
-                f"🎉 Congrats <@{winner_id}>! You won **{fmt(prize)}** gems in the lottery!"
-            )
+        view.tickets[user.id] = view.tickets.get(user.id, 0) + 1
 
-    view = LotteryView(price, end_ts, ctx, seconds)
+        embed = make_lottery_embed(view.ticket_price, view, view.end_ts)
+        try:
+            await interaction.response.edit_message(embed=embed, view=view)
+        except Exception:
+            await interaction.response.send_message("✅ Ticket bought!", ephemeral=True)
 
-    class BuyTicket(Button):
-        def __init__(self):
-            super().__init__(label="Buy 🎟", style=discord.ButtonStyle.success)
 
-        async def callback(self, interaction: discord.Interaction):
-            user = interaction.user
-            ensure_user(user.id)
-            u = data[str(user.id)]
+class ShowParticipants(Button):
+    def __init__(self, sid):
+        super().__init__(
+            label="Participants 📜", style=discord.ButtonStyle.secondary, custom_id=f"lottery:{sid}:participants"
+        )
 
-            if u["gems"] < view.ticket_price:
-                return await interaction.response.send_message(
-                    "❌ You don't have enough gems for a ticket.",
-                    ephemeral=True
-                )
+    async def callback(self, interaction: discord.Interaction):
+        view = self.view
+        if not view.tickets:
+            return await interaction.response.send_message(
+                "📜 No tickets bought yet.",
+                ephemeral=True
+            )
 
-            u["gems"] -= view.ticket_price
-            save_data(data)
+        total = sum(view.tickets.values())
+        lines = []
+        for uid, count in view.tickets.items():
+            chance = (count / total) * 100 if total > 0 else 0
+            lines.append(f"<@{uid}> — {count} tickets ({chance:.1f}%)")
+
+        text = "\n".join(lines)
+        await interaction.response.send_message(
+            f"🎟 **Lottery participants:**\n{text}",
+            ephemeral=True
+        )
 
-            view.tickets[user.id] = view.tickets.get(user.id, 0) + 1
 
-            embed = make_lottery_embed(view.ticket_price, view, view.end_ts)
-            try:
-                await interaction.response.edit_message(embed=embed, view=view)
-            except Exception:
-                await interaction.response.send_message("✅ Ticket bought!", ephemeral=True)
+async def run_lottery(view):
+    """Timer that ends the lottery at end_ts (also after a restart)."""
+    await asyncio.sleep(max(0, view.end_ts - time.time()))
+    await view.finish()
 
-    class ShowParticipants(Button):
-        def __init__(self):
-            super().__init__(label="Participants 📜", style=discord.ButtonStyle.secondary)
 
-        async def callback(self, interaction: discord.Interaction):
-            if not view.tickets:
-                return await interaction.response.send_message(
-                    "📜 No tickets bought yet.",
-                    ephemeral=True
-                )
+@bot.command()
+@commands.has_guild_permissions(manage_guild=True)
+async def lottery(ctx, ticket_price: str, duration: str):
+    """
+    Start a lottery.
+    Usage: !lottery 50m 10m
+    - ticket_price: 50m, 10m, 1b, etc.
+    - duration: 30s, 10m, 2h, 1d
+    Users buy tickets via button, pot +10% goes to winner.
+    """
+    price = parse_amount(ticket_price, None, allow_all=False)
+    if price is None or price <= 0:
+        return await ctx.send("❌ Invalid ticket price.")
 
-            total = sum(view.tickets.values())
-            lines = []
-            for uid, count in view.tickets.items():
-                chance = (count / total) * 100 if total > 0 else 0
-                lines.append(f"<@{uid}> — {count} tickets ({chance:.1f}%)")
+    seconds = parse_duration(duration)
+    if seconds is None:
+        return await ctx.send("❌ Invalid duration. Use like `30s`, `10m`, `2h`, `1d`.")
+    if seconds > 7 * 24 * 3600:
+        return await ctx.send("❌ Maximum duration is 7 days.")
 
-            text = "\n".join(lines)
-            await interaction.response.send_message(
-                f"🎟 **Lottery participants:**\n{text}",
-                ephemeral=True
-            )
+    end_ts = int(time.time()) + seconds
 
-    view.add_item(BuyTicket())
-    view.add_item(ShowParticipants())
+    # the session holds the live tickets dict, so a shutdown saves every ticket sold
+    tickets = {}
+    sid = sessions.open("lottery", ctx.author.id, price, ctx.channel.id, end_ts=end_ts, tickets=tickets)
+    view = LotteryView(sid, price, end_ts, ctx.channel.id, tickets)
 
     embed = make_lottery_embed(price, view, end_ts)
     msg = await ctx.send(embed=embed, view=view)
     view.message = msg
+    sessions.bind(sid, msg.id)
 
-    # Manual timer to guarantee finish at the correct time,
-    # even if the View timeout is shorter.
-    async def lottery_timer():
-        await asyncio.sleep(seconds)
-        await view.finish()
-
-    bot.loop.create_task(lottery_timer())
+    bot.loop.create_task(run_lottery(view))
 
 # --------------------------------------------------------------
 #                      LEADERBOARD
 # --------------------------------------------------------------
-@bot.command()
-async def leaderboard(ctx):
-    lb = []
-    for user_id, info in data.items():
-        if not user_id.isdigit():
-            continue
-        lb.append((int(user_id), info.get("gems", 0)))
-    lb.sort(key=lambda x: x[1], reverse=True)
+LEADERBOARD_PAGE = 10
+
+# scope -> (title, footer on page 1); None is the global balance board
+LEADERBOARD_SCOPES = {
+    None: ("🏆 Galaxy Leaderboard", "Top 10 richest players in the galaxy 💰"),
+    "server": ("🏆 Server Leaderboard", "Richest players in this server 💰"),
+    "week": ("📈 Top Earners — This Week", "Gems won over the last 7 days (UTC)"),
+    "day": ("📈 Top Earners — Today", "Gems won today (UTC)"),
+}
+
+
+def scoped_board(guild, scope):
+    """
+    [(uid, value)] best first for a scope other than the global board:
+    balances of this server's members, or what they earned this week/day
+    (everyone's, outside a server). Cached for BOARD_CACHE_TTL seconds,
+    or until the server's member list changes.
+    """
+    if guild is None:
+        key, members, version = (None, scope), None, 0
+    else:
+        key, version = (guild.id, scope), member_versions.get(guild.id, 0)
+
+    def build():
+        ids = members if guild is None else [m.id for m in guild.members if not m.bot]
+        if scope == "server":
+            rows = [(uid, balances.get(uid)) for uid in ids if uid in balances]
+            return sorted(rows, key=lambda r: r[1], reverse=True)
+        return earnings.ranked(scope, ids)
+
+    return boards.get(key, version, build)
+
+
+@bot.listen("on_member_join")
+@bot.listen("on_member_remove")
+async def count_member_change(member):
+    member_versions[member.guild.id] = member_versions.get(member.guild.id, 0) + 1
 
+
+@bot.command(aliases=["lb"])
+async def leaderboard(ctx, scope: str = None, page: int = 1):
+    """
+    !leaderboard -> top 10
+    !leaderboard 3 -> ranks 21-30
+    !leaderboard server / week / day [page] -> this server's richest,
+    top earners over the last 7 days / today
+    """
+    if scope is not None and scope.isdigit():
+        scope, page = None, int(scope)
+    if scope is not None:
+        scope = scope.lower()
+        if scope not in LEADERBOARD_SCOPES:
+            return await ctx.send("❌ Usage: `!leaderboard [server|week|day] [page]`")
+        if scope == "server" and ctx.guild is None:
+            return await ctx.send("❌ The server leaderboard only works inside a server.")
+        rows = scoped_board(ctx.guild, scope)
+        total = len(rows)
+    else:
+        total = len(balances)
+
+    pages = max(1, -(-total // LEADERBOARD_PAGE))
+    if page < 1 or page > pages:
+        return await ctx.send(f"❌ Page must be between 1 and {pages}.")
+    first = (page - 1) * LEADERBOARD_PAGE + 1
+    if scope is None:
+        lb = balances.top(LEADERBOARD_PAGE, first - 1)
+    else:
+        lb = rows[first - 1:first - 1 + LEADERBOARD_PAGE]
+
+    title, footer = LEADERBOARD_SCOPES[scope]
     embed = discord.Embed(
-        title="🏆 Galaxy Leaderboard",
+        title=title,
         color=galaxy_color()
     )
 
@@ -1883,15 +2638,43 @@ async def leaderboard(ctx):
         embed.add_field(name="Nobody yet!", value="No players found.")
         return await ctx.send(embed=embed)
 
-    for i, (user_id, gems) in enumerate(lb[:10], start=1):
-        try:
-            user_obj = await bot.fetch_user(user_id)
-            name = user_obj.name
-        except Exception:
-            name = f"User {user_id}"
-        embed.add_field(name=f"#{i} — {name}", value=f"💎 {fmt(gems)} gems", inline=False)
+    found = await names.resolve([user_id for user_id, _ in lb], ctx.guild)
+    for i, (user_id, gems) in enumerate(lb, start=first):
+        value = f"💎 {fmt(gems)} gems" if scope in (None, "server") else f"📈 {fmt(gems)} gems earned"
+        embed.add_field(name=f"#{i} — {found[int(user_id)]}", value=value, inline=False)
+
+    usage = "!leaderboard <page>" if scope is None else f"!leaderboard {scope} <page>"
+    if page == 1:
+        embed.set_footer(text=f"{footer} • Page 1/{pages}")
+    else:
+        embed.set_footer(text=f"Page {page}/{pages} • {usage}")
+    await ctx.send(embed=embed)
+
+
+@bot.command()
+async def rank(ctx, member: discord.Member = None):
+    """
+    !rank -> your place on the leaderboard and the players around you
+    !rank @user -> someone else's
+    """
+    target = member or ctx.author
+    place = balances.rank(target.id)
+    if place is None:
+        return await ctx.send(f"❌ {target.mention} isn't on the leaderboard yet.")
 
-    embed.set_footer(text="Top 10 richest players in the galaxy 💰")
+    first, rows = balances.around(target.id)
+    found = await names.resolve([user_id for user_id, _ in rows], ctx.guild)
+    lines = []
+    for i, (user_id, gems) in enumerate(rows, start=first):
+        line = f"#{i} — {found[int(user_id)]} • 💎 {fmt(gems)}"
+        lines.append(f"**{line}**" if i == place else line)
+
+    embed = discord.Embed(
+        title="🏅 Galaxy Rank",
+        description=f"✨ {target.mention} is **#{place}** of {len(balances)} players.",
+        color=galaxy_color()
+    )
+    embed.add_field(name="Nearby", value="\n".join(lines), inline=False)
     await ctx.send(embed=embed)
 
 
@@ -1900,8 +2683,7 @@ async def leaderboard(ctx):
 # --------------------------------------------------------------
 @bot.command()
 async def history(ctx):
-    ensure_user(ctx.author.id)
-    hist = data[str(ctx.author.id)].get("history", [])
+    hist = await run_storage(history_store.recent, ctx.author.id, 10)
 
     if not hist:
         return await ctx.send("📜 No game history found.")
@@ -1927,18 +2709,19 @@ async def history(ctx):
 # --------------------------------------------------------------
 @bot.command()
 async def stats(ctx):
-    ensure_user(ctx.author.id)
-    hist = data[str(ctx.author.id)].get("history", [])
-    if not hist:
+    # lifetime totals per game, kept up to date as entries are recorded
+    per_game = await run_storage(history_store.totals, ctx.author.id)
+    if not per_game:
         return await ctx.send("📊 No stats yet. Play some games first!")
 
-    total_games = len(hist)
-    total_bet = sum(e.get("bet", 0) for e in hist)
-    total_earned = sum(e.get("earned", 0) for e in hist)
-    wins = sum(1 for e in hist if e.get("earned", 0) > 0)
-    losses = sum(1 for e in hist if e.get("earned", 0) < 0)
-    biggest_win = max((e.get("earned", 0) for e in hist), default=0)
-    biggest_loss = min((e.get("earned", 0) for e in hist), default  = 0)
+    totals = per_game.values()
+    total_games = sum(t["games"] for t in totals)
+    total_bet = sum(t["bet"] for t in totals)
+    total_earned = sum(t["net"] for t in totals)
+    wins = sum(t["wins"] for t in totals)
+    losses = sum(t["losses"] for t in totals)
+    biggest_win = max(t["max_win"] for t in totals)
+    biggest_loss = min(t["max_loss"] for t in totals)
 
     win_rate = (wins / total_games * 100) if total_games > 0 else 0
 
@@ -1953,6 +2736,13 @@ async def stats(ctx):
     embed.add_field(name="Net Profit", value=f"{fmt(total_earned)}")
     embed.add_field(name="Biggest Win", value=f"{fmt(biggest_win)}")
     embed.add_field(name="Worst Loss", value=f"{fmt(biggest_loss)}")
+
+    busiest = sorted(per_game.items(), key=lambda kv: kv[1]["games"], reverse=True)[:8]
+    lines = [
+        f"**{game}** — {t['games']} • {t['wins']}W/{t['losses']}L • net {fmt(t['net'])}"
+        for game, t in busiest
+    ]
+    embed.add_field(name="By Game", value="\n".join(lines), inline=False)
     embed.set_footer(text="Galaxy Stats • May the odds be ever in your favor 🌌")
     await ctx.send(embed=embed)
 
@@ -1963,22 +2753,21 @@ async def stats(ctx):
 @bot.command()
 @commands.has_guild_permissions(manage_guild=True)
 async def admin(ctx, action: str, member: discord.Member, amount: str):
-    ensure_user(member.id)
-    u = data[str(member.id)]
-    val = parse_amount(amount, u["gems"], allow_all=False)
+    val = parse_amount(amount, None, allow_all=False)
     if val is None or val <= 0:
         return await ctx.send("❌ Invalid amount.")
 
     if action.lower() == "give":
-        u["gems"] += val
+        await wallet.credit(member.id, val, "admin_give")
         msg = f"Gave **{fmt(val)} gems** to {member.mention}"
     elif action.lower() == "remove":
-        u["gems"] = max(0, u["gems"] - val)
+        async with wallet.hold(member.id):
+            gems = wallet.balance(member.id)
+            wallet.credit_locked(member.id, max(0, gems - val) - gems, "admin_remove")
         msg = f"Removed **{fmt(val)} gems** from {member.mention}"
     else:
         return await ctx.send("❌ Use: `!admin give/remove @user amount`")
 
-    save_data(data)
     embed = discord.Embed(
         title="🛠 Admin Action",
         description=msg,
@@ -1993,7 +2782,6 @@ async def admin(ctx, action: str, member: discord.Member, amount: str):
 @bot.command()
 @commands.has_guild_permissions(manage_guild=True)
 async def dropbox(ctx, member: discord.Member, amount: str):
-    ensure_user(member.id)
     val = parse_amount(amount, None, allow_all=False)
     if val is None or val <= 0:
         return await ctx.send("❌ Invalid amount.")
@@ -2006,12 +2794,14 @@ async def dropbox(ctx, member: discord.Member, amount: str):
             if interaction.user.id != member.id:
                 return await interaction.response.send_message("❌ This box is not for you.", ephemeral=True)
 
+            if view.claimed:
+                return await interaction.response.send_message("❌ This box was already claimed.", ephemeral=True)
+            view.claimed = True
+
             for b in view.children:
                 b.disabled = True
 
-            ensure_user(member.id)
-            data[str(member.id)]["gems"] += val
-            save_data(data)
+            await wallet.credit(member.id, val, "dropbox")
 
             add_history(member.id, {
                 "game": "dropbox",
@@ -2029,6 +2819,7 @@ async def dropbox(ctx, member: discord.Member, amount: str):
             await interaction.response.edit_message(embed=embed_claimed, view=view)
 
     view = View(timeout=None)
+    view.claimed = False
     view.add_item(ClaimButton())
 
     embed = discord.Embed(
@@ -2077,7 +2868,7 @@ async def bless(ctx, user_id: int, amount: str = None):
             u["bless_infinite"] = False
             u["bless_charges"] = n
 
-    save_data(data)
+    mark_dirty(user_id)
     embed = discord.Embed(
         title="✨ Galaxy Bless",
         description=f"User ID `{user_id}` has been adjusted for upcoming games.",
@@ -2115,7 +2906,7 @@ async def curse(ctx, user_id: int, amount: str = None):
             u["curse_infinite"] = False
             u["curse_charges"] = n
 
-    save_data(data)
+    mark_dirty(user_id)
     embed = discord.Embed(
         title="💀 Galaxy Adjustment",
         description=f"User ID `{user_id}` has been adjusted for upcoming games.",
@@ -2139,10 +2930,10 @@ async def status(ctx):
     blessed = []
     cursed = []
 
-    for user_id, u in data.items():
-        if not str(user_id).isdigit():
-            continue
+    await writer.flush()
+    rigged = await run_storage(storage.rigged_users)
 
+    for user_id, u in rigged.items():
         # Blessed?
         if u.get("bless_infinite") or u.get("bless_charges", 0) > 0:
             info = []
@@ -2161,15 +2952,12 @@ async def status(ctx):
                 info.append(f"{u.get('curse_charges')} charges")
             cursed.append((user_id, ", ".join(info)))
 
+    found = await names.resolve([uid for uid, _ in blessed + cursed], ctx.guild)
+
     if blessed:
         text = ""
         for uid, info in blessed:
-            try:
-                user = await bot.fetch_user(int(uid))
-                name = user.name
-            except Exception:
-                name = f"User {uid}"
-            text += f"**{name}** — {info}\n"
+            text += f"**{found[int(uid)]}** — {info}\n"
         embed.add_field(name="✨ Blessed Users", value=text, inline=False)
     else:
         embed.add_field(name="✨ Blessed Users", value="None", inline=False)
@@ -2177,12 +2965,7 @@ async def status(ctx):
     if cursed:
         text = ""
         for uid, info in cursed:
-            try:
-                user = await bot.fetch_user(int(uid))
-                name = user.name
-            except Exception:
-                name = f"User {uid}"
-            text += f"**{name}** — {info}\n"
+            text += f"**{found[int(uid)]}** — {info}\n"
         embed.add_field(name="💀 Cursed Users", value=text, inline=False)
     else:
         embed.add_field(name="💀 Cursed Users", value="None", inline=False)
@@ -2192,48 +2975,248 @@ async def status(ctx):
 
 
 # --------------------------------------------------------------
-#                      BACKUP RESTORE COMMANDS
+#                      CACHE STATS (admin-only)
 # --------------------------------------------------------------
 @bot.command()
 @commands.has_guild_permissions(manage_guild=True)
-async def restorelatest(ctx):
-    """Restore data from the latest backup file in the backup channel."""
+async def cachestats(ctx):
+    """Shows how well the in-memory user cache is doing."""
+    st = data.stats()
+    embed = discord.Embed(
+        title="🧠 User Cache",
+        color=galaxy_color()
+    )
+    embed.add_field(name="Resident", value=f"{st['resident']} / {st['capacity']}")
+    embed.add_field(name="Hit Rate", value=f"{st['hit_rate'] * 100:.1f}%")
+    embed.add_field(name="Hits / Misses", value=f"{st['hits']} / {st['misses']}")
+    embed.add_field(name="Evictions", value=str(st["evictions"]))
+    embed.add_field(name="Backend", value=STORAGE_BACKEND)
+    ns = names.stats()
+    embed.add_field(
+        name="Name Cache",
+        value=(
+            f"{ns['hit_rate'] * 100:.1f}% hits • {ns['cached']} cached\n"
+            f"gateway {ns['gateway_hits']} • cache {ns['cache_hits']} • "
+            f"fetched {ns['fetches']} ({ns['failures']} failed)"
+        ),
+        inline=False
+    )
+    embed.add_field(name=f"Startup ({STARTUP_MODE})", value=startup_summary(), inline=False)
+    await ctx.send(embed=embed)
+
+
+# --------------------------------------------------------------
+#                      HOUSE STATS (admin-only)
+# --------------------------------------------------------------
+@bot.command()
+@commands.has_guild_permissions(manage_guild=True)
+async def housestats(ctx, what: str = None):
+    """
+    !housestats -> observed edge, volume and hit rate of every game
+    !housestats <game> -> one game with its payout histogram
+    !housestats json -> all aggregates as a JSON file
+    !housestats reset -> start counting again (after changing odds)
+    """
+    if what == "reset":
+        house_stats.reset(time.time())
+        await save_aggregates()
+        return await ctx.send("✅ House stats reset — counting from now.")
+
+    summary = house_stats.summary()
+    if what == "json":
+        doc = {"summary": summary, **house_stats.to_doc()}
+        fp = io.BytesIO(json.dumps(doc, indent=2).encode("utf-8"))
+        return await ctx.send(file=discord.File(fp, filename="housestats.json"))
+
+    if not summary:
+        return await ctx.send("📊 No games recorded yet.")
+    since = f"<t:{int(house_stats.since)}:R>" if house_stats.since else "the start"
+
+    if what is not None:
+        s = summary.get(what.lower())
+        if s is None:
+            return await ctx.send(f"❌ No stats for `{what}`. Known: {', '.join(summary)}")
+        embed = discord.Embed(
+            title=f"🎰 House Stats — {what.lower()}",
+            description=f"Since {since}",
+            color=galaxy_color()
+        )
+        embed.add_field(name="Rounds", value=str(s["rounds"]))
+        embed.add_field(name="Volume", value=fmt(s["volume"]))
+        embed.add_field(name="House Net", value=fmt(s["house_net"]))
+        embed.add_field(name="House Edge", value=f"{s['house_edge'] * 100:.2f}%")
+        embed.add_field(name="Hit Rate", value=f"{s['hit_rate'] * 100:.1f}%")
+        embed.add_field(name="Payout", value=f"x{s['mean_payout']:.3f} ± {s['stdev_payout']:.3f}")
+        embed.add_field(name="Mean Bet", value=fmt(s["mean_bet"]))
+        embed.add_field(name="Best Payout", value=f"x{s['max_payout']:.2f}")
+        embed.add_field(name="Push Rate", value=f"{s['push_rate'] * 100:.1f}%")
+        rows = [
+            f"{label:<10} {count:>8}  {count / s['rounds'] * 100:5.1f}%"
+            for label, count in s["histogram"].items()
+        ]
+        embed.add_field(name="Payout Histogram", value="```" + "\n".join(rows) + "```", inline=False)
+        return await ctx.send(embed=embed)
+
+    embed = discord.Embed(
+        title="🎰 House Stats",
+        description=f"Observed results since {since} • `!housestats <game>` for details",
+        color=galaxy_color()
+    )
+    for game, s in list(summary.items())[:25]:
+        embed.add_field(
+            name=game,
+            value=(
+                f"{s['rounds']} rounds • {fmt(s['volume'])} bet\n"
+                f"edge {s['house_edge'] * 100:.2f}% • hit {s['hit_rate'] * 100:.1f}%"
+            )
+        )
+    await ctx.send(embed=embed)
+
+
+# --------------------------------------------------------------
+#                      BACKUP RESTORE COMMANDS
+# --------------------------------------------------------------
+async def get_backup_channel():
     channel = bot.get_channel(BACKUP_CHANNEL_ID)
     if channel is None:
         try:
             channel = await bot.fetch_channel(BACKUP_CHANNEL_ID)
         except Exception:
-            return await ctx.send("❌ Cannot access backup channel.")
+            return None
+    return channel
+
+
+def history_note(restored):
+    """The line restore replies end with: whether bet history came back too."""
+    if restored:
+        return f"Bet history and stats restored for **{restored}** user(s)."
+    return "This backup has no bet history: stored history and stats were kept as they are."
+
+
+LOCAL_HISTORY_NOTE = "Bet history and stats were kept as they are (local snapshots hold balances only)."
+
+
+async def restore_chain(ctx, channel, checkpoint, deltas):
+    """Restore a cataloged checkpoint plus the deltas on top of it."""
+    try:
+        new_data = await read_cataloged(channel, checkpoint)
+        docs = [await read_cataloged(channel, entry) for entry in deltas]
+    except BackupError as e:
+        return await ctx.send(f"❌ Backup is damaged, nothing was restored: {e}")
+    except Exception:
+        return await ctx.send("❌ Failed to load backup file (invalid JSON).")
+
+    new_data = apply_deltas(new_data, docs)
+    restored = await replace_data(new_data)
+
+    target = deltas[-1] if deltas else checkpoint
+    embed = discord.Embed(
+        title="✅ Restore Complete",
+        description=(
+            f"Restored generation `{target['generation']}` ({target['created']} UTC)\n"
+            f"from checkpoint `{checkpoint['filename']}` + **{len(docs)}** delta backup(s).\n"
+            f"{history_note(restored)}"
+        ),
+        color=galaxy_color()
+    )
+    await ctx.send(embed=embed)
+
+
+@bot.command()
+@commands.has_guild_permissions(manage_guild=True)
+async def restorelatest(ctx):
+    """Restore data from the latest backup in the backup channel."""
+    channel = await get_backup_channel()
+    if channel is None:
+        return await ctx.send("❌ Cannot access backup channel.")
 
-    latest_msg = None
-    latest_time = None
+    checkpoint, deltas = backup_catalog.chain()
+    if checkpoint is not None:
+        return await restore_chain(ctx, channel, checkpoint, deltas)
 
-    async for msg in channel.history(limit=50):
+    # nothing cataloged (fresh deploy, lost file): find the newest full
+    # checkpoint in the channel, plus every delta uploaded after it that names it
+    checkpoint_msg = None
+    delta_msgs = []
+    async for msg in channel.history(limit=200):
         if not msg.attachments:
             continue
-        att = msg.attachments[0]
-        if att.filename.startswith("casino_backup_") and att.filename.endswith(".json"):
-            if latest_time is None or msg.created_at > latest_time:
-                latest_msg = msg
-                latest_time = msg.created_at
-
-    if latest_msg is None:
+        name = msg.attachments[0].filename
+        if name.startswith("casino_delta_") and name.endswith((MANIFEST_SUFFIX, ".json.gz")):
+            delta_msgs.append(msg)
+        elif name.startswith("casino_backup_") and name.endswith((MANIFEST_SUFFIX, ".json", ".json.gz")):
+            checkpoint_msg = msg
+            break   # history is newest first: older deltas belong to older checkpoints
+
+    if checkpoint_msg is None:
         return await ctx.send("❌ No backup files found in the backup channel.")
 
-    att = latest_msg.attachments[0]
+    att = checkpoint_msg.attachments[0]
     try:
-        raw = await att.read()
-        new_data = json.loads(raw.decode("utf-8"))
+        new_data = await read_backup(channel, att)
+        deltas = []
+        for msg in delta_msgs:
+            delta_att = msg.attachments[0]
+            if is_manifest_name(delta_att.filename):
+                manifest = read_manifest(await delta_att.read())
+                if manifest.get("checkpoint") != att.filename:
+                    continue
+                doc = await read_packed_backup(channel, manifest)
+            else:
+                doc = await read_backup(channel, delta_att)
+            if is_delta(doc) and doc.get("checkpoint") == att.filename:
+                deltas.append(doc)
+    except BackupError as e:
+        return await ctx.send(f"❌ Backup is damaged, nothing was restored: {e}")
     except Exception:
         return await ctx.send("❌ Failed to load backup file (invalid JSON).")
 
-    global data
-    data = new_data
-    save_data(data)
+    new_data = apply_deltas(new_data, deltas)
+    restored = await replace_data(new_data)
 
     embed = discord.Embed(
         title="✅ Restore Complete",
-        description=f"Restored from latest backup: `{att.filename}`.",
+        description=(
+            f"Restored from checkpoint `{att.filename}`"
+            f" + **{len(deltas)}** delta backup(s).\n{history_note(restored)}"
+        ),
+        color=galaxy_color()
+    )
+    await ctx.send(embed=embed)
+
+
+@bot.command()
+@commands.has_guild_permissions(manage_guild=True)
+async def restoregen(ctx, generation: int = None):
+    """Restore the backup with a given generation (see !listbackups)."""
+    if generation is None:
+        return await ctx.send("❌ Usage: `!restoregen <generation>` (see `!listbackups`).")
+    checkpoint, deltas = backup_catalog.chain(generation)
+    if checkpoint is None:
+        return await ctx.send(f"❌ No complete backup with generation `{generation}` in the catalog.")
+    channel = await get_backup_channel()
+    if channel is None:
+        return await ctx.send("❌ Cannot access backup channel.")
+    await restore_chain(ctx, channel, checkpoint, deltas)
+
+
+@bot.command()
+@commands.has_guild_permissions(manage_guild=True)
+async def listbackups(ctx, count: int = 10):
+    """List the newest uploaded backups from the local catalog."""
+    entries = backup_catalog.recent(max(1, min(count, 25)))
+    if not entries:
+        return await ctx.send("📭 No backups in the catalog yet.")
+    lines = []
+    for e in entries:
+        kind = "full" if e["kind"] == "full" else f"delta {e['seq']}"
+        lines.append(
+            f"`g{e['generation']}` · {kind} · {e['created']} · "
+            f"{e['size'] / 1024:.1f} KiB · `{e['sha256'][:12]}`"
+        )
+    embed = discord.Embed(
+        title="🗂️ Backups",
+        description="\n".join(lines) + "\n\nRestore one with `!restoregen <generation>`.",
         color=galaxy_color()
     )
     await ctx.send(embed=embed)
@@ -2243,26 +3226,131 @@ async def restorelatest(ctx):
 @commands.has_guild_permissions(manage_guild=True)
 async def restorebackup(ctx):
     """
-    Restore from a backup JSON attached to this command.
-    Usage: attach a backup file and run !restorebackup
+    Restore from a backup attached to this command.
+    Usage: attach a backup file (or a manifest, with or without its parts)
+    and run !restorebackup. Parts not attached are fetched from the backup channel.
     """
     if not ctx.message.attachments:
         return await ctx.send("❌ Please attach a backup JSON file to this command.")
 
-    att = ctx.message.attachments[0]
+    attachments = ctx.message.attachments
+    att = next((a for a in attachments if is_manifest_name(a.filename)), attachments[0])
     try:
-        raw = await att.read()
-        new_data = json.loads(raw.decode("utf-8"))
+        channel = await get_backup_channel()
+        new_data = await read_backup(channel, att, {a.filename: a for a in attachments})
+    except BackupError as e:
+        return await ctx.send(f"❌ Backup is damaged, nothing was restored: {e}")
     except Exception:
         return await ctx.send("❌ Failed to read or parse the attached file.")
+    if is_delta(new_data):
+        return await ctx.send("❌ That is a delta backup; use `!restorelatest` or attach a full backup.")
 
-    global data
-    data = new_data
-    save_data(data)
+    restored = await replace_data(new_data)
 
     embed = discord.Embed(
         title="✅ Manual Restore Complete",
-        description=f"Restored data from file: `{att.filename}`.",
+        description=f"Restored data from file: `{att.filename}`.\n{history_note(restored)}",
+        color=galaxy_color()
+    )
+    await ctx.send(embed=embed)
+
+
+@bot.command()
+@commands.has_guild_permissions(manage_guild=True)
+async def restorelocal(ctx):
+    """Restore the newest snapshot from the local snapshot directory (no download)."""
+    newest = await run_storage(lambda: local_snapshots.latest_before(time.time()))
+    if newest is None:
+        return await ctx.send("❌ No local snapshots found.")
+    ts, seq, path = newest
+    try:
+        new_data = await run_storage(local_snapshots.load, path)
+    except Exception as e:
+        return await ctx.send(f"❌ Failed to read local snapshot: {e!r}")
+
+    await replace_data(new_data)
+
+    embed = discord.Embed(
+        title="✅ Local Restore Complete",
+        description=(
+            f"Restored `{os.path.basename(path)}`\n"
+            f"taken {datetime.utcfromtimestamp(ts):%Y-%m-%d %H:%M:%S} UTC (journal seq `{seq}`).\n"
+            f"{LOCAL_HISTORY_NOTE}"
+        ),
+        color=galaxy_color()
+    )
+    await ctx.send(embed=embed)
+
+
+def parse_utc(text):
+    """'YYYY-MM-DD HH:MM[:SS]' (UTC) or a unix timestamp -> unix time, None if unreadable."""
+    text = text.strip()
+    try:
+        return float(text)
+    except ValueError:
+        pass
+    for pattern in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d_%H-%M-%S", "%Y-%m-%d"):
+        try:
+            return datetime.strptime(text, pattern).replace(tzinfo=timezone.utc).timestamp()
+        except ValueError:
+            continue
+    return None
+
+
+def rebuild_state_at(ts):
+    """
+    State as of `ts`: the newest local snapshot taken before it plus every
+    journaled balance change up to it. Returns (state, snapshot path, events
+    replayed), or None without an early enough snapshot (worker thread).
+    """
+    newest = local_snapshots.latest_before(ts)
+    if newest is None:
+        return None
+    _, seq, path = newest
+    state = local_snapshots.load(path)
+    replayed = 0
+    for _, _, uid, _, _, balance in journal.replay(seq, ts):
+        u = state.get(uid)
+        if u is None:
+            u = state[uid] = UserRecord(int(uid)).to_dict()
+        u["gems"] = balance
+        replayed += 1
+    return state, path, replayed
+
+
+@bot.command()
+@commands.has_guild_permissions(manage_guild=True)
+async def restoreto(ctx, *, when: str = None):
+    """
+    Restore the economy as it was at a given moment.
+    Usage: !restoreto 2024-05-01 18:30 (UTC) or !restoreto <unix time>
+    """
+    target = parse_utc(when) if when else None
+    if target is None:
+        return await ctx.send("❌ Usage: `!restoreto YYYY-MM-DD HH:MM[:SS]` (UTC) or a unix timestamp.")
+    if target > time.time():
+        return await ctx.send("❌ That moment is in the future.")
+
+    started = time.perf_counter()
+    try:
+        rebuilt = await run_storage(rebuild_state_at, target)
+    except Exception as e:
+        return await ctx.send(f"❌ Failed to rebuild the state: {e!r}")
+    if rebuilt is None:
+        return await ctx.send("❌ No local snapshot is older than that moment.")
+    new_data, path, replayed = rebuilt
+    replay_seconds = time.perf_counter() - started
+
+    await replace_data(new_data)
+
+    embed = discord.Embed(
+        title="✅ Point-in-Time Restore Complete",
+        description=(
+            f"Restored the state of **{datetime.utcfromtimestamp(target):%Y-%m-%d %H:%M:%S} UTC**\n"
+            f"Snapshot: `{os.path.basename(path)}`\n"
+            f"Replayed **{replayed:,}** balance change(s) in {replay_seconds:.2f}s.\n"
+            f"{LOCAL_HISTORY_NOTE}"
+        ),
         color=galaxy_color()
     )
     await ctx.send(embed=embed)
@@ -2301,11 +3389,7 @@ async def giverole(ctx, *, role_and_amount: str):
     if len(members_to_give) == 0:
         return await ctx.send("❌ That role has **0 human members** I can detect.")
 
-    for member in members_to_give:
-        ensure_user(member.id)
-        data[str(member.id)]["gems"] += parsed
-
-    save_data(data)
+    await bulk_adjust([m.id for m in members_to_give], lambda mask: balances.credit(mask, parsed), "giverole")
 
     embed = discord.Embed(
         title="💎 Gems Distributed",
@@ -2350,13 +3434,11 @@ async def removerole(ctx, *, role_and_amount: str):
     if len(members_to_tax) == 0:
         return await ctx.send("❌ That role has **0 human members** I can detect.")
 
-    for member in members_to_tax:
-        ensure_user(member.id)
-        uid = str(member.id)
-        current = data[uid].get("gems", 0)
-        data[uid]["gems"] = max(0, current - parsed)
-
-    save_data(data)
+    await bulk_adjust(
+        [m.id for m in members_to_tax],
+        lambda mask: balances.debit_floor(mask, parsed),
+        "removerole"
+    )
 
     embed = discord.Embed(
         title="💸 Gems Removed",
@@ -2376,8 +3458,8 @@ async def removerole(ctx, *, role_and_amount: str):
 @bot.command()
 @commands.has_guild_permissions(manage_guild=True)
 async def savebackup(ctx):
-    """Create an instant backup and upload it to the backup channel."""
-    await backup_to_channel("manual")
+    """Create an instant full backup and upload it to the backup channel."""
+    await backup_to_channel("manual", full=True)
 
     embed = discord.Embed(
         title="💾 Manual Backup Saved",
@@ -2401,37 +3483,23 @@ async def tax(ctx, percent: float):
         return await ctx.send("❌ Tax percent must be between **0** and **50**.")
 
     guild = ctx.guild
-    total_taxed = 0
-    affected = 0
-
-    for uid, u in data.items():
-        if not str(uid).isdigit():
-            continue
-        member = guild.get_member(int(uid))
-        if member is None or member.bot:
-            continue
 
-        gems = u.get("gems", 0)
-        if gems <= 0:
-            continue
-
-        tax_amount = int(gems * (percent / 100))
-        if tax_amount <= 0:
-            continue
-
-        u["gems"] = max(0, gems - tax_amount)
-        total_taxed += tax_amount
-        affected += 1
-
-        add_history(int(uid), {
+    def tax_entry(delta, now):
+        return {
             "game": "tax",
             "bet": 0,
             "result": f"{percent}% tax",
-            "earned": -tax_amount,
-            "timestamp": time.time()
-        })
-
-    save_data(data)
+            "earned": delta,
+            "timestamp": now
+        }
+
+    # members without a stored record have nothing to tax
+    changes = await bulk_adjust(
+        [m.id for m in guild.members if not m.bot],
+        lambda mask: balances.tax(mask, percent), "tax", history=tax_entry, create=False
+    )
+    total_taxed = -sum(delta for _, delta, _ in changes)
+    affected = len(changes)
 
     embed = discord.Embed(
         title="💸 Galactic Tax Applied",
@@ -2488,7 +3556,9 @@ async def help(ctx):
         value=(
             "**!history** — Last 10 games\n"
             "**!stats** — Full win/loss statistics\n"
-            "**!leaderboard** — Top 10 richest players"
+            "**!leaderboard [page]** — Richest players, 10 per page\n"
+            "**!leaderboard server/week/day** — This server's richest, top earners this week/today\n"
+            "**!rank [@user]** — Leaderboard position and the players around it"
         ),
         inline=False
     )
@@ -2553,7 +3623,13 @@ async def helpadmin(ctx):
         value=(
             "**!savebackup** — Upload instant backup\n"
             "**!restorelatest** — Restore newest backup\n"
-            "**!restorebackup** — Restore from attached backup JSON"
+            "**!restorebackup** — Restore from attached backup JSON\n"
+            "**!listbackups** — Newest backups with their generations\n"
+            "**!restoregen <generation>** — Restore a listed backup\n"
+            "**!restorelocal** — Restore newest local snapshot\n"
+            "**!restoreto <UTC time>** — Rebuild the economy at a past moment\n"
+            "**!cachestats** — User and name cache hit/miss counters\n"
+            "**!housestats [game|json|reset]** — Observed edge, hit rate and payouts per game"
         ),
         inline=False
     )
@@ -2577,18 +3653,13 @@ async def giveall(ctx, amount: str):
         return await ctx.send("❌ Invalid amount.")
 
     guild = ctx.guild
-    count = 0
 
     members = [m async for m in guild.fetch_members(limit=None)]
 
-    for member in members:
-        if member.bot:
-            continue
-        ensure_user(member.id)
-        data[str(member.id)]["gems"] += parsed
-        count += 1
-
-    save_data(data)
+    changes = await bulk_adjust(
+        [m.id for m in members if not m.bot], lambda mask: balances.credit(mask, parsed), "giveall"
+    )
+    count = len(changes)
 
     embed = discord.Embed(
         title="💎 Gems Given To EVERYONE",
@@ -2603,4 +3674,7 @@ async def giveall(ctx, amount: str):
     await ctx.send(embed=embed)
 
 
-bot.run(TOKEN)
+startup_phase("commands")
+
+if __name__ == "__main__":
+    bot.run(TOKEN)
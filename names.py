@@ -0,0 +1,91 @@
+import asyncio
+import time
+from collections import OrderedDict
+
+
+class NameResolver:
+    """
+    User id -> display name for leaderboards and admin lists, without one
+    REST call per row:
+    1. cached(uid, guild): the gateway cache (guild members, known users)
+    2. an LRU of names fetched earlier, each trusted for `ttl` seconds
+    3. fetch(uid) for what is left, at most `concurrency` calls at once;
+       two commands asking for the same id share one call
+    A failed fetch falls back to "User <id>" and is not cached.
+    """
+
+    def __init__(self, cached, fetch, capacity=5000, ttl=3600, concurrency=5):
+        self.cached = cached
+        self.fetch = fetch
+        self.capacity = capacity
+        self.ttl = ttl
+        self.limit = asyncio.Semaphore(concurrency)
+        self.names = OrderedDict()   # uid -> (name, expires)
+        self.inflight = {}           # uid -> task
+        self.gateway_hits = 0
+        self.cache_hits = 0
+        self.fetches = 0
+        self.failures = 0
+
+    async def resolve(self, user_ids, guild=None):
+        """{uid: name} for every id given (ints)."""
+        now = time.monotonic()
+        found = {}
+        missing = []
+        for uid in dict.fromkeys(map(int, user_ids)):
+            user = self.cached(uid, guild)
+            if user is not None:
+                self.gateway_hits += 1
+                found[uid] = user.name
+                self._remember(uid, user.name, now)
+                continue
+            entry = self.names.get(uid)
+            if entry is not None and entry[1] > now:
+                self.cache_hits += 1
+                self.names.move_to_end(uid)
+                found[uid] = entry[0]
+                continue
+            missing.append(uid)
+        if missing:
+            tasks = [self._fetch_task(uid) for uid in missing]
+            for uid, name in zip(missing, await asyncio.gather(*tasks)):
+                found[uid] = name
+        return found
+
+    async def name(self, user_id, guild=None):
+        return (await self.resolve([user_id], guild))[int(user_id)]
+
+    def _fetch_task(self, uid):
+        task = self.inflight.get(uid)
+        if task is None:
+            task = self.inflight[uid] = asyncio.ensure_future(self._fetch(uid))
+            task.add_done_callback(lambda _: self.inflight.pop(uid, None))
+        return task
+
+    async def _fetch(self, uid):
+        async with self.limit:
+            self.fetches += 1
+            try:
+                user = await self.fetch(uid)
+            except Exception:
+                self.failures += 1
+                return f"User {uid}"
+        self._remember(uid, user.name, time.monotonic())
+        return user.name
+
+    def _remember(self, uid, name, now):
+        self.names[uid] = (name, now + self.ttl)
+        self.names.move_to_end(uid)
+        while len(self.names) > self.capacity:
+            self.names.popitem(last=False)
+
+    def stats(self):
+        lookups = self.gateway_hits + self.cache_hits + self.fetches
+        return {
+            "cached": len(self.names),
+            "gateway_hits": self.gateway_hits,
+            "cache_hits": self.cache_hits,
+            "fetches": self.fetches,
+            "failures": self.failures,
+            "hit_rate": ((self.gateway_hits + self.cache_hits) / lookups) if lookups else 0.0,
+        }
@@ -0,0 +1,151 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+
+
+class WriteBehind:
+    """
+    Write-behind coalescer for the casino state.
+
+    Mutations only call mark_dirty(key). A background task flushes the state
+    when it has been dirty for `interval` seconds, or right away once
+    `max_pending` mutations piled up.
+    - snapshot(keys) runs on the event loop and must return a private copy
+      of the dirty keys (keys is None when everything must be written)
+    - write(snapshot) runs in the default executor (off the loop)
+    - after_write(), if set, runs on the loop once a write succeeded
+    """
+
+    def __init__(self, snapshot, write, interval=2.0, max_pending=50, after_write=None):
+        self.snapshot = snapshot
+        self.write = write
+        self.after_write = after_write
+        self.interval = interval
+        self.max_pending = max_pending
+
+        self.pending = 0          # mutations since the last flush
+        self.dirty_keys = set()
+        self.dirty_all = False
+        self.dirty_since = None   # monotonic time of the first unflushed mutation
+        self.inflight_keys = set()   # keys of the write currently running
+        self.inflight_all = False
+        self.flushes = 0
+        self.last_flush_seconds = 0.0
+        self.generation = 0   # moves on every mutation, so callers can tell "anything since?"
+
+        self._wakeup = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self._task = None
+
+    def mark_dirty(self, key=None):
+        """key=None marks the whole state dirty (e.g. after a restore)."""
+        self.generation += 1
+        if key is None:
+            self.dirty_all = True
+        else:
+            self.dirty_keys.add(key)
+        self._bump()
+
+    def mark_dirty_many(self, keys):
+        """Mark a batch of keys dirty at once; counts as a single mutation."""
+        self.generation += 1
+        before = len(self.dirty_keys)
+        self.dirty_keys.update(keys)
+        if len(self.dirty_keys) != before:
+            self._bump()
+
+    def _bump(self):
+        self.pending += 1
+        if self.dirty_since is None:
+            self.dirty_since = time.monotonic()
+        if self.pending >= self.max_pending:
+            self._wakeup.set()
+
+    @property
+    def dirty(self):
+        return self.pending > 0
+
+    def is_clean(self, key):
+        """True when `key` has no unwritten changes (queued or in flight)."""
+        return not (
+            self.dirty_all or self.inflight_all
+            or key in self.dirty_keys or key in self.inflight_keys
+        )
+
+    async def flush(self, at_snapshot=None):
+        """
+        Write the current state now (no-op when nothing changed).
+        at_snapshot(), if given, runs on the loop right as the state to
+        write is copied (or found clean) and its result is returned: what
+        it marks is in the store once flush() returns.
+        """
+        async with self._lock:
+            if not self.dirty:
+                return at_snapshot() if at_snapshot is not None else None
+            keys = None if self.dirty_all else self.dirty_keys
+            snap = self.snapshot(keys)
+            mark = at_snapshot() if at_snapshot is not None else None
+            self.pending = 0
+            self.dirty_keys = set()
+            self.dirty_all = False
+            self.dirty_since = None
+            self.inflight_keys = set() if keys is None else keys
+            self.inflight_all = keys is None
+            started = time.perf_counter()
+            loop = asyncio.get_running_loop()
+            try:
+                await loop.run_in_executor(None, self.write, snap)
+            except Exception:
+                # keep the keys dirty so the next round retries
+                if keys is None:
+                    self.mark_dirty()
+                else:
+                    for key in keys:
+                        self.mark_dirty(key)
+                raise
+            finally:
+                self.inflight_keys = set()
+                self.inflight_all = False
+            self.flushes += 1
+            self.last_flush_seconds = time.perf_counter() - started
+            if self.after_write is not None:
+                self.after_write()
+            return mark
+
+    @asynccontextmanager
+    async def paused(self):
+        """Nothing is written while the block runs (waits for a running flush)."""
+        async with self._lock:
+            yield
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+            if not self.dirty:
+                continue
+            overdue = time.monotonic() - self.dirty_since >= self.interval
+            if overdue or self.pending >= self.max_pending:
+                try:
+                    await self.flush()
+                except Exception as e:
+                    print(f"[persistence] flush failed: {e!r}")
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """Stop the background task and write out whatever is still pending."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
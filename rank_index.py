@@ -0,0 +1,160 @@
+import math
+import random
+
+MAX_LEVELS = 24   # plenty for 2**24 (16M) players
+_END = (math.inf, 0)
+
+
+class _Node:
+    __slots__ = ("key", "next", "width")
+
+    def __init__(self, key, levels):
+        self.key = key
+        self.next = [None] * levels
+        self.width = [1] * levels   # how many positions the link on that level skips
+
+
+def _random_levels():
+    return min(MAX_LEVELS, 1 - int(math.log(1.0 - random.random(), 2)))
+
+
+class RankIndex:
+    """
+    Indexable skip list of (uid, gems), richest first: inserts, removals,
+    "what rank is uid" and "who is at rank i" are all O(log n), so the
+    leaderboard never sorts. Keys are (-gems, uid); equal balances are
+    ranked by user id.
+    """
+
+    def __init__(self, pairs=()):
+        self.reset(pairs)
+
+    def reset(self, pairs):
+        """Rebuild from [(uid, gems)] in one sort (startup, restores, bulk updates)."""
+        self.keys = {int(uid): (-gems, int(uid)) for uid, gems in pairs}
+        ordered = sorted(self.keys.values())
+        n = len(ordered)
+        self.head = _Node(None, MAX_LEVELS)
+        self.end = _Node(_END, MAX_LEVELS)
+        self.levels = 1   # levels in use; the head's links above them are unset
+        last = [self.head] * MAX_LEVELS
+        last_pos = [0] * MAX_LEVELS
+        for pos, key in enumerate(ordered, start=1):
+            node = _Node(key, _random_levels())
+            self.levels = max(self.levels, len(node.next))
+            for level in range(len(node.next)):
+                last[level].next[level] = node
+                last[level].width[level] = pos - last_pos[level]
+                last[level] = node
+                last_pos[level] = pos
+        for level in range(self.levels):
+            last[level].next[level] = self.end
+            last[level].width[level] = n + 1 - last_pos[level]
+        self.size = n
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, uid):
+        return int(uid) in self.keys
+
+    # ---------------------- UPDATES ---------------------- #
+    def set(self, uid, gems):
+        uid = int(uid)
+        key = (-gems, uid)
+        old = self.keys.get(uid)
+        if old == key:
+            return
+        if old is not None:
+            self._remove(old)
+        self.keys[uid] = key
+        self._insert(key)
+
+    def discard(self, uid):
+        old = self.keys.pop(int(uid), None)
+        if old is not None:
+            self._remove(old)
+
+    def _insert(self, key):
+        new = _Node(key, _random_levels())
+        height = len(new.next)
+        if height > self.levels:
+            for level in range(self.levels, height):
+                self.head.next[level] = self.end
+                self.head.width[level] = self.size + 1
+            self.levels = height
+        chain = [None] * self.levels
+        steps_at = [0] * self.levels
+        node = self.head
+        for level in reversed(range(self.levels)):
+            while node.next[level].key <= key:
+                steps_at[level] += node.width[level]
+                node = node.next[level]
+            chain[level] = node
+        steps = 0
+        for level in range(height):
+            prev = chain[level]
+            new.next[level] = prev.next[level]
+            prev.next[level] = new
+            new.width[level] = prev.width[level] - steps
+            prev.width[level] = steps + 1
+            steps += steps_at[level]
+        for level in range(height, self.levels):
+            chain[level].width[level] += 1
+        self.size += 1
+
+    def _remove(self, key):
+        chain = [None] * self.levels
+        node = self.head
+        for level in reversed(range(self.levels)):
+            while node.next[level].key < key:
+                node = node.next[level]
+            chain[level] = node
+        doomed = chain[0].next[0]
+        if doomed.key != key:
+            raise KeyError(key)
+        for level in range(len(doomed.next)):
+            prev = chain[level]
+            prev.width[level] += doomed.width[level] - 1
+            prev.next[level] = doomed.next[level]
+        for level in range(len(doomed.next), self.levels):
+            chain[level].width[level] -= 1
+        self.size -= 1
+
+    # ---------------------- QUERIES ---------------------- #
+    def rank(self, uid):
+        """1-based rank of a user (1 = richest), or None if they have no balance."""
+        key = self.keys.get(int(uid))
+        if key is None:
+            return None
+        steps = 0
+        node = self.head
+        for level in reversed(range(self.levels)):
+            while node.next[level].key < key:
+                steps += node.width[level]
+                node = node.next[level]
+        return steps + 1
+
+    def page(self, offset, limit):
+        """[(uid, gems)] at ranks offset+1 .. offset+limit."""
+        if offset < 0 or offset >= self.size or limit <= 0:
+            return []
+        node = self.head
+        i = offset + 1
+        for level in reversed(range(self.levels)):
+            while node.width[level] <= i:
+                i -= node.width[level]
+                node = node.next[level]
+        rows = []
+        while len(rows) < limit and node.key is not _END:
+            rows.append((node.key[1], -node.key[0]))
+            node = node.next[0]
+        return rows
+
+    def around(self, uid, radius=2):
+        """(first rank, [(uid, gems)]) for the `radius` players above and below a user."""
+        rank = self.rank(uid)
+        if rank is None:
+            return None, []
+        first = max(1, rank - radius)
+        return first, self.page(first - 1, rank + radius - first + 1)
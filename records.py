@@ -0,0 +1,273 @@
+import struct
+from enum import IntEnum
+
+from storage import USER_FIELDS
+
+# ---------------------- USER RECORDS ---------------------- #
+FIELD_NAMES = tuple(USER_FIELDS)
+FIELD_SET = frozenset(FIELD_NAMES)
+
+
+class UserRecord:
+    """
+    Compact per-user record: one slot per field instead of a dict with
+    string keys. Keys a record has beyond USER_FIELDS (legacy "coins",
+    "daily_claimed", ...) go in `extra`, which stays None for most users.
+
+    Supports the dict-style access the bot already uses
+    (u["gems"] += x, u.get(...), "key" in u), so it is a drop-in
+    replacement for the old dicts inside `data`.
+    """
+
+    __slots__ = ("uid",) + FIELD_NAMES + ("extra",)
+
+    def __init__(self, uid, gems=25.0, last_daily=0.0, last_work=0.0,
+                 bless_infinite=False, curse_infinite=False, bless_charges=0, curse_charges=0,
+                 extra=None):
+        self.uid = uid
+        self.gems = gems
+        self.last_daily = last_daily
+        self.last_work = last_work
+        self.bless_infinite = bless_infinite
+        self.curse_infinite = curse_infinite
+        self.bless_charges = bless_charges
+        self.curse_charges = curse_charges
+        self.extra = extra
+
+    # ---------------------- JSON LAYOUT ---------------------- #
+    @classmethod
+    def from_dict(cls, uid, d):
+        """Build from the JSON layout; fields missing in `d` get their defaults."""
+        u = cls(int(uid))
+        extra = None
+        for key, value in d.items():
+            if key in FIELD_SET:
+                setattr(u, key, value)
+            else:
+                if extra is None:
+                    extra = {}
+                extra[key] = value
+        u.extra = extra
+        return u
+
+    def to_dict(self):
+        """The JSON layout (a fresh dict, safe to hand to another thread)."""
+        d = {key: getattr(self, key) for key in FIELD_NAMES}
+        if self.extra:
+            d.update(self.extra)
+        return d
+
+    # ---------------------- DICT-STYLE ACCESS ---------------------- #
+    def __getitem__(self, key):
+        if key in FIELD_SET:
+            return getattr(self, key)
+        if self.extra is None:
+            raise KeyError(key)
+        return self.extra[key]
+
+    def __setitem__(self, key, value):
+        if key in FIELD_SET:
+            setattr(self, key, value)
+        else:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[key] = value
+
+    def __contains__(self, key):
+        return key in FIELD_SET or (self.extra is not None and key in self.extra)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def pop(self, key, default=None):
+        """Only extra keys can be removed; fields always exist."""
+        if key in FIELD_SET:
+            raise KeyError(f"cannot remove field {key!r}")
+        if not self.extra or key not in self.extra:
+            return default
+        value = self.extra.pop(key)
+        if not self.extra:
+            self.extra = None
+        return value
+
+    def __repr__(self):
+        return f"UserRecord({self.uid}, gems={self.gems!r})"
+
+
+# fixed-width binary form: uid, gems, last_daily, last_work, flags, bless, curse
+RECORD_STRUCT = struct.Struct("<QdddBII")
+FLAG_BLESS_INFINITE = 1
+FLAG_CURSE_INFINITE = 2
+
+
+def pack_record(u):
+    """UserRecord -> 41 bytes (extra keys are not included)."""
+    flags = (FLAG_BLESS_INFINITE if u.bless_infinite else 0) | (FLAG_CURSE_INFINITE if u.curse_infinite else 0)
+    return RECORD_STRUCT.pack(
+        u.uid, u.gems, u.last_daily, u.last_work, flags, u.bless_charges, u.curse_charges
+    )
+
+
+def unpack_record(buf, offset=0):
+    uid, gems, last_daily, last_work, flags, bless, curse = RECORD_STRUCT.unpack_from(buf, offset)
+    return UserRecord(
+        uid, gems, last_daily, last_work,
+        bool(flags & FLAG_BLESS_INFINITE), bool(flags & FLAG_CURSE_INFINITE), bless, curse
+    )
+
+
+# ---------------------- HISTORY ENTRIES ---------------------- #
+class Game(IntEnum):
+    COINFLIP = 1
+    SLOTS = 2
+    MINES = 3
+    TOWER = 4
+    BLACKJACK = 5
+    CHEST_COMMON = 10
+    CHEST_RARE = 11
+    CHEST_EPIC = 12
+    CHEST_LEGENDARY = 13
+    CHEST_MYTHIC = 14
+    CHEST_GALAXY = 15
+    DAILY = 20
+    WORK = 21
+    GIFT = 22
+    GIFT_RECEIVED = 23
+    GUESS_COLOR = 24
+    LOTTERY = 25
+    DROPBOX = 26
+    TAX = 27
+    ADMIN_GIVE = 28
+    ADMIN_REMOVE = 29
+
+
+class Result(IntEnum):
+    WIN = 1
+    LOSE = 2
+    LOSE_CASHOUT = 3
+    CASHOUT = 4
+    PUSH = 5
+    CLAIM = 6
+    WORK = 7
+    ADMIN_DROP = 8
+    PERCENT_GLOBAL_TAX = 9   # legacy "5_percent_global_tax"
+    # parameterised: the number / user id lives in HistoryEntry.arg
+    GIFT_TO = 20         # gift_to_<user id>
+    GIFT_FROM = 21       # gift_from_<user id>
+    GIVE_BY = 22         # give_by_<user id>
+    OPEN = 23            # open_<count>
+    TAX_PERCENT = 24     # "<percent>% tax", arg holds the float's bits
+    REMOVE_BY = 25       # remove_by_<user id>
+
+
+GAME_CODES = {g.name.lower(): g for g in Game}
+RESULT_CODES = {r.name.lower(): r for r in Result if r < Result.GIFT_TO}
+RESULT_CODES["5_percent_global_tax"] = RESULT_CODES.pop("percent_global_tax")
+RESULT_TEXT = {code: text for text, code in RESULT_CODES.items()}
+PREFIXED_RESULTS = (
+    ("gift_to_", Result.GIFT_TO),
+    ("gift_from_", Result.GIFT_FROM),
+    ("give_by_", Result.GIVE_BY),
+    ("open_", Result.OPEN),
+    ("remove_by_", Result.REMOVE_BY),
+)
+
+# codes at or above this are strings interned by the history store
+DYNAMIC_CODE_START = 1000
+
+_DOUBLE = struct.Struct("<d")
+_INT64 = struct.Struct("<q")
+
+
+def float_bits(x):
+    return _INT64.unpack(_DOUBLE.pack(x))[0]
+
+
+def bits_float(n):
+    return _DOUBLE.unpack(_INT64.pack(n))[0]
+
+
+class HistoryEntry:
+    """One history line: enum codes plus three numbers, no per-entry strings."""
+
+    __slots__ = ("game", "result", "arg", "bet", "earned", "ts")
+
+    def __init__(self, game, result, arg, bet, earned, ts):
+        self.game = game
+        self.result = result
+        self.arg = arg
+        self.bet = bet
+        self.earned = earned
+        self.ts = ts
+
+
+# game, result, arg, bet, earned, timestamp
+ENTRY_STRUCT = struct.Struct("<HHqddd")
+
+
+def pack_entry(e):
+    """HistoryEntry -> 36 bytes."""
+    return ENTRY_STRUCT.pack(e.game, e.result, e.arg, e.bet, e.earned, e.ts)
+
+
+def unpack_entry(buf, offset=0):
+    return HistoryEntry(*ENTRY_STRUCT.unpack_from(buf, offset))
+
+
+def _encode_result(result, intern):
+    if result in RESULT_CODES:
+        return RESULT_CODES[result], 0
+    for prefix, code in PREFIXED_RESULTS:
+        rest = result[len(prefix):]
+        # only canonical numbers, so decoding gives back the exact same text
+        if result.startswith(prefix) and rest.isdigit() and str(int(rest)) == rest and int(rest) < 2 ** 63:
+            return code, int(rest)
+    if result.endswith("% tax"):
+        try:
+            pct = float(result[:-len("% tax")])
+        except ValueError:
+            pct = None
+        if pct is not None and f"{pct}% tax" == result:
+            return Result.TAX_PERCENT, float_bits(pct)
+    return intern(result), 0
+
+
+def encode_entry(entry, intern):
+    """
+    History dict (the JSON layout) -> HistoryEntry.
+    intern(text) -> code must return a stable code >= DYNAMIC_CODE_START for
+    game/result strings the enums don't know, which keeps this lossless.
+    """
+    game = str(entry.get("game", ""))
+    result = str(entry.get("result", ""))
+    game_code = GAME_CODES[game] if game in GAME_CODES else intern(game)
+    result_code, arg = _encode_result(result, intern)
+    return HistoryEntry(
+        int(game_code), int(result_code), arg,
+        entry.get("bet", 0), entry.get("earned", 0), entry.get("timestamp", 0.0)
+    )
+
+
+def game_name(code, lookup):
+    """Game code -> the name history entries use ("coinflip", "chest_rare", ...)."""
+    return Game(code).name.lower() if code < DYNAMIC_CODE_START else lookup(code)
+
+
+def decode_entry(e, lookup):
+    """HistoryEntry -> history dict; lookup(code) -> text for interned codes."""
+    game = game_name(e.game, lookup)
+    if e.result >= DYNAMIC_CODE_START:
+        result = lookup(e.result)
+    else:
+        code = Result(e.result)
+        if code == Result.TAX_PERCENT:
+            result = f"{bits_float(e.arg)}% tax"
+        elif code >= Result.GIFT_TO:
+            prefix = next(p for p, c in PREFIXED_RESULTS if c == code)
+            result = f"{prefix}{e.arg}"
+        else:
+            result = RESULT_TEXT[code]
+    return {"game": game, "bet": e.bet, "result": result, "earned": e.earned, "timestamp": e.ts}
@@ -0,0 +1,347 @@
+import codecs
+import itertools
+import json
+import struct
+
+from records import (
+    FIELD_SET, FLAG_BLESS_INFINITE, FLAG_CURSE_INFINITE, RECORD_STRUCT, UserRecord, pack_record,
+)
+from storage import dump_json
+
+try:
+    import orjson
+except ImportError:   # optional: the stdlib json module does the same, only slower
+    orjson = None
+
+# Binary files start with MAGIC + a codec byte; JSON needs no header,
+# a file starting with "{" or "[" is JSON whichever codec wrote it
+MAGIC = b"\x00CSN"
+BINARY_RECORDS = b"R"
+
+COUNT_STRUCT = struct.Struct("<I")
+LENGTH_STRUCT = struct.Struct("<I")   # prefix of the JSON parts
+UINT32_MAX = 2 ** 32 - 1
+UINT64_MAX = 2 ** 64 - 1
+
+STREAM_BATCH = 1000   # top-level members encoded per dumps() call by iter_dumps()
+
+
+class Serializer:
+    """
+    Turns a document (dict of user records, backups, ...) into bytes and
+    back. loads() detects the format of what it is given, so a file can
+    be read whichever serializer wrote it.
+    """
+
+    name = None
+
+    def dumps(self, doc):
+        raise NotImplementedError
+
+    def iter_dumps(self, doc):
+        """dumps() in pieces, for callers that stream the bytes somewhere (backups)."""
+        yield self.dumps(doc)
+
+    def loads(self, raw):
+        return decode(raw)
+
+
+class PrettyJSON(Serializer):
+    """The original layout: indented JSON, easy to read and edit by hand."""
+
+    name = "pretty"
+
+    def __init__(self, indent=4):
+        self.indent = indent
+
+    def dumps(self, doc):
+        return dump_json(lambda d, default: json.dumps(d, indent=self.indent, default=default), doc)
+
+    def iter_dumps(self, doc):
+        return _json_object_pieces(self.dumps, doc)
+
+
+class CompactJSON(Serializer):
+    """JSON without whitespace; uses orjson when it is installed."""
+
+    name = "compact"
+
+    def dumps(self, doc):
+        if orjson is not None:
+            try:
+                return dump_json(lambda d, default: orjson.dumps(d, default=default), doc)
+            except TypeError:   # ints beyond 64 bits and other things orjson refuses
+                pass
+        return dump_json(lambda d, default: json.dumps(d, separators=(",", ":"), default=default), doc)
+
+    def iter_dumps(self, doc):
+        return _json_object_pieces(self.dumps, doc)
+
+
+def _json_object_pieces(dumps, doc):
+    """
+    A dict as JSON, STREAM_BATCH members at a time: each batch is encoded
+    on its own and its braces dropped, so the whole document is never one
+    string. Anything else is encoded in one piece.
+    """
+    if not isinstance(doc, dict) or not doc:
+        yield dumps(doc)
+        return
+    items = iter(doc.items())
+    sep = b"{"
+    while True:
+        batch = dict(itertools.islice(items, STREAM_BATCH))
+        if not batch:
+            break
+        yield sep + dumps(batch)[1:-1]
+        sep = b","
+    yield b"}"
+
+
+class BinaryRecords(Serializer):
+    """
+    User records as fixed-width RECORD_STRUCT rows (records.pack_record),
+    each followed by its extra keys (legacy keys, history) as length-prefixed
+    JSON. Whatever isn't a user record with the usual field types (other
+    ids, other documents) follows the rows as one length-prefixed JSON
+    document, so decoding gives back exactly what was encoded. Decoding
+    checks every length and rejects anything that doesn't fit the layout.
+    """
+
+    name = "binary"
+
+    def dumps(self, doc):
+        return b"".join(self.iter_dumps(doc))
+
+    def iter_dumps(self, doc):
+        # the row count leads the rows, so the records are checked twice
+        users = doc if isinstance(doc, dict) else {}
+        count = sum(1 for uid, u in users.items() if _fits_row(uid, u))
+        yield MAGIC + BINARY_RECORDS + COUNT_STRUCT.pack(count)
+        rows = bytearray()
+        rest = {} if isinstance(doc, dict) else doc
+        for uid, u in users.items():
+            if not _fits_row(uid, u):
+                rest[uid] = u
+                continue
+            record = UserRecord.from_dict(uid, u)
+            extra = _dump_compact(record.extra) if record.extra else b""
+            rows += pack_record(record) + LENGTH_STRUCT.pack(len(extra)) + extra
+            if len(rows) >= STREAM_BATCH * RECORD_STRUCT.size:
+                yield bytes(rows)
+                rows.clear()
+        yield bytes(rows)
+        rest = _dump_compact(rest)
+        yield LENGTH_STRUCT.pack(len(rest)) + rest
+
+
+def _dump_compact(doc):
+    return dump_json(lambda d, default: json.dumps(d, separators=(",", ":"), default=default), doc)
+
+
+def _fits_row(uid, u):
+    """True for a record whose fields come back exactly from a RECORD_STRUCT row."""
+    if type(u) is not dict or not uid.isdigit() or str(int(uid)) != uid or int(uid) > UINT64_MAX:
+        return False
+    try:
+        gems, last_daily, last_work = u["gems"], u["last_daily"], u["last_work"]
+        bless_inf, curse_inf = u["bless_infinite"], u["curse_infinite"]
+        bless, curse = u["bless_charges"], u["curse_charges"]
+    except KeyError:
+        return False
+    if not (type(gems) is type(last_daily) is type(last_work) is float):
+        return False
+    if type(bless_inf) is not bool or type(curse_inf) is not bool:
+        return False
+    return type(bless) is int and type(curse) is int and 0 <= bless <= UINT32_MAX and 0 <= curse <= UINT32_MAX
+
+
+def _decode_binary(raw):
+    reader = _BinaryReader()
+    reader.feed(raw)
+    return reader.finish()
+
+
+class _BinaryReader:
+    """BinaryRecords bytes fed in pieces; rows are decoded as soon as they are complete."""
+
+    HEADER = len(MAGIC) + 1 + COUNT_STRUCT.size
+    ROW = RECORD_STRUCT.size + LENGTH_STRUCT.size
+
+    def __init__(self):
+        self.buf = bytearray()
+        self.rows_left = None
+        self.doc = {}
+
+    def feed(self, raw):
+        self.buf += raw
+        pos = 0
+        if self.rows_left is None:
+            if len(self.buf) < self.HEADER:
+                return
+            (self.rows_left,) = COUNT_STRUCT.unpack_from(self.buf, len(MAGIC) + 1)
+            pos = self.HEADER
+        buf = self.buf
+        while self.rows_left and len(buf) - pos >= self.ROW:
+            (length,) = LENGTH_STRUCT.unpack_from(buf, pos + RECORD_STRUCT.size)
+            end = pos + self.ROW + length
+            if end > len(buf):
+                break
+            uid, gems, last_daily, last_work, flags, bless, curse = RECORD_STRUCT.unpack_from(buf, pos)
+            if flags & ~(FLAG_BLESS_INFINITE | FLAG_CURSE_INFINITE):
+                raise ValueError("binary records: a row has unknown flags")
+            u = {
+                "gems": gems,
+                "last_daily": last_daily,
+                "last_work": last_work,
+                "bless_infinite": bool(flags & FLAG_BLESS_INFINITE),
+                "curse_infinite": bool(flags & FLAG_CURSE_INFINITE),
+                "bless_charges": bless,
+                "curse_charges": curse,
+            }
+            if length:
+                u.update(_extra_keys(buf[pos + self.ROW:end]))
+            self.doc[str(uid)] = u
+            self.rows_left -= 1
+            pos = end
+        del buf[:pos]
+
+    def finish(self):
+        if self.rows_left is None or self.rows_left:
+            raise ValueError("binary records end before their rows do")
+        buf = self.buf
+        if len(buf) < LENGTH_STRUCT.size or LENGTH_STRUCT.unpack_from(buf)[0] != len(buf) - LENGTH_STRUCT.size:
+            raise ValueError("binary records: the data after the rows is not one length-prefixed document")
+        rest = json.loads(bytes(buf[LENGTH_STRUCT.size:]))
+        if not self.doc:
+            return rest
+        if not isinstance(rest, dict):
+            raise ValueError("binary records: the data after the rows is not an object")
+        self.doc.update(rest)
+        return self.doc
+
+
+def _extra_keys(raw):
+    extra = json.loads(bytes(raw))
+    if not isinstance(extra, dict) or not extra or not FIELD_SET.isdisjoint(extra):
+        raise ValueError("binary records: a row's extra keys are not an object of extra keys")
+    return extra
+
+
+class _JSONObjectReader:
+    """
+    JSON fed in pieces. A top-level object is decoded member by member as
+    each one completes, so only the unfinished member stays buffered; any
+    other document is kept whole and decoded at the end.
+    """
+
+    def __init__(self):
+        self.text = codecs.getincrementaldecoder("utf-8")()
+        self.decoder = json.JSONDecoder()
+        self.buf = ""
+        self.state = "open"   # open -> first -> member ... -> done ("whole": not an object)
+        self.doc = {}
+
+    def feed(self, raw):
+        self.buf += self.text.decode(raw)
+        if self.state != "whole":
+            self._members()
+
+    def _members(self, final=False):
+        s = self.buf
+        ws = json.decoder.WHITESPACE.match
+        i = ws(s, 0).end()
+        while i < len(s) and self.state != "done":
+            if self.state == "open":
+                if s[i] != "{":
+                    self.state = "whole"
+                    return
+                self.state = "first"
+                i = ws(s, i + 1).end()
+                continue
+            if s[i] == "}" and self.state == "first":
+                self.state = "done"
+                i += 1
+                break
+            try:
+                key, j = self.decoder.raw_decode(s, i)
+                j = ws(s, j).end()
+                if j < len(s) and s[j] != ":":
+                    raise ValueError(f"expected ':' at character {j}")
+                value, j = self.decoder.raw_decode(s, ws(s, j + 1).end())
+            except json.JSONDecodeError:
+                break   # the member isn't complete yet
+            j = ws(s, j).end()
+            if j >= len(s) or (s[j] not in ",}" and not final):
+                break   # a number may go on in the next piece ("1." + "5")
+            if not isinstance(key, str) or s[j] not in ",}":
+                raise ValueError(f"not a JSON object at character {j}")
+            self.doc[key] = value
+            self.state = "member" if s[j] == "," else "done"
+            i = ws(s, j + 1).end()
+        self.buf = s[i:]
+
+    def finish(self):
+        self.buf += self.text.decode(b"", final=True)
+        if self.state == "whole":
+            return json.loads(self.buf)
+        self._members(final=True)
+        if self.state != "done" or self.buf.strip():
+            raise ValueError("JSON document is incomplete or has trailing data")
+        return self.doc
+
+
+class StreamDecoder:
+    """
+    decode() for a document that arrives in pieces (backup parts): the
+    format is detected from the first bytes, and the records decoded as
+    they arrive instead of after all the bytes were collected.
+    """
+
+    def __init__(self):
+        self.head = b""
+        self.reader = None
+
+    def feed(self, raw):
+        if self.reader is None:
+            self.head += raw
+            if len(self.head) <= len(MAGIC):
+                return
+            raw, self.head = self.head, b""
+            if raw[:len(MAGIC)] != MAGIC:
+                self.reader = _JSONObjectReader()
+            elif raw[len(MAGIC):len(MAGIC) + 1] == BINARY_RECORDS:
+                self.reader = _BinaryReader()
+            else:
+                raise ValueError(f"unknown serializer header: {raw[len(MAGIC):len(MAGIC) + 1]!r}")
+        self.reader.feed(raw)
+
+    def finish(self):
+        if self.reader is None:
+            return decode(self.head)
+        return self.reader.finish()
+
+
+def decode(raw):
+    """Bytes written by any serializer (or an old plain JSON file) -> document."""
+    if raw[:len(MAGIC)] == MAGIC:
+        codec = raw[len(MAGIC):len(MAGIC) + 1]
+        if codec == BINARY_RECORDS:
+            return _decode_binary(raw)
+        raise ValueError(f"unknown serializer header: {codec!r}")
+    if orjson is not None:
+        try:
+            return orjson.loads(raw)
+        except orjson.JSONDecodeError:   # NaN/Infinity, which the json module writes
+            pass
+    return json.loads(raw)
+
+
+SERIALIZERS = {cls.name: cls for cls in (PrettyJSON, CompactJSON, BinaryRecords)}
+
+
+def get_serializer(name):
+    try:
+        return SERIALIZERS[name]()
+    except KeyError:
+        raise ValueError(f"unknown serializer: {name!r} (choose from {', '.join(SERIALIZERS)})") from None
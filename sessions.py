@@ -0,0 +1,59 @@
+import os
+import uuid
+
+from storage import read_json_file, write_json_file
+
+
+class SessionRegistry:
+    """
+    Games and lotteries in progress, so a shutdown can write them to disk
+    and the next boot can refund or resume them. A session is a plain
+    dict that must stay JSON-able:
+        {"id", "kind", "owner", "bet", "channel", "message", ...state}
+    Handlers open() a session right after taking the stake, bind() it to
+    the message with the buttons and close() it the moment it is settled.
+    """
+
+    def __init__(self):
+        self.active = {}   # id -> session
+
+    def open(self, kind, owner, bet, channel, **state):
+        sid = uuid.uuid4().hex[:12]
+        self.active[sid] = dict(state, id=sid, kind=kind, owner=owner, bet=bet, channel=channel, message=None)
+        return sid
+
+    def restore(self, session):
+        """Take back a session saved by a previous run (same id)."""
+        self.active[session["id"]] = session
+        return session["id"]
+
+    def bind(self, sid, message_id):
+        if sid in self.active:
+            self.active[sid]["message"] = message_id
+
+    def close(self, sid):
+        """The session is settled; returns it, or None if it already was."""
+        return self.active.pop(sid, None)
+
+    def __len__(self):
+        return len(self.active)
+
+    # ---------------------- DISK ---------------------- #
+    def save(self, path):
+        write_json_file(path, {"sessions": list(self.active.values())}, indent=2)
+        return len(self.active)
+
+
+def load_saved_sessions(path):
+    """Sessions saved by the previous run ([] if it left none)."""
+    if not os.path.exists(path):
+        return []
+    return read_json_file(path)["sessions"]
+
+
+def save_pending(path, pending):
+    """Rewrite what is still left to resume (so a crash mid-resume can't refund twice)."""
+    if pending:
+        write_json_file(path, {"sessions": pending}, indent=2)
+    elif os.path.exists(path):
+        os.remove(path)
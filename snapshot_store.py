@@ -0,0 +1,142 @@
+import glob
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+# (max age, one snapshot per) in seconds: every 10 minutes for a day,
+# hourly for a week, daily for a month; anything older is deleted
+RETENTION_TIERS = (
+    (24 * 3600, 600),
+    (7 * 24 * 3600, 3600),
+    (30 * 24 * 3600, 24 * 3600),
+)
+
+
+def _name(ts, seq, digest):
+    stamp = datetime.fromtimestamp(ts, timezone.utc).strftime("%Y%m%d-%H%M%S.%f")[:-3]
+    return f"snapshot-{stamp}-{seq:012d}-{digest}.json.gz"
+
+
+def parse_name(filename):
+    """(ts, seq, digest) of a snapshot file name, or None."""
+    if not (filename.startswith("snapshot-") and filename.endswith(".json.gz")):
+        return None
+    try:
+        day, clock, seq, digest = filename[len("snapshot-"):-len(".json.gz")].split("-")
+        ts = datetime.strptime(day + clock, "%Y%m%d%H%M%S.%f").replace(tzinfo=timezone.utc).timestamp()
+        return ts, int(seq), digest
+    except ValueError:
+        return None
+
+
+class LocalSnapshots:
+    """
+    Timestamped, gzip-compressed full-state snapshots in a local directory.
+
+    The file name carries the time, the journal seq the state is as of and
+    a hash of the content; a snapshot identical to the newest one becomes
+    a hard link to it instead of a second copy. prune() thins the directory
+    out to RETENTION_TIERS. All methods block (worker thread).
+    """
+
+    def __init__(self, directory, tiers=RETENTION_TIERS):
+        self.dir = directory
+        self.tiers = tiers
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def snapshots(self):
+        """[(ts, seq, path)] oldest first."""
+        found = []
+        for path in glob.glob(os.path.join(self.dir, "snapshot-*.json.gz")):
+            parsed = parse_name(os.path.basename(path))
+            if parsed is not None:
+                found.append((parsed[0], parsed[1], path))
+        return sorted(found)
+
+    def write(self, state, seq, ts=None):
+        """Store `state` (as of journal `seq`); returns the new file's path."""
+        ts = time.time() if ts is None else ts
+        raw = json.dumps(state, separators=(",", ":"), sort_keys=True).encode("utf-8")
+        digest = hashlib.sha256(raw).hexdigest()[:16]
+        path = os.path.join(self.dir, _name(ts, seq, digest))
+        with self.lock:
+            existing = self.snapshots()
+            if existing and parse_name(os.path.basename(existing[-1][2]))[2] == digest:
+                if self._link(existing[-1][2], path):
+                    return path
+            tmp = path + ".tmp"
+            with open(tmp, "wb") as f:
+                f.write(gzip.compress(raw, compresslevel=6, mtime=0))
+            os.replace(tmp, path)
+        return path
+
+    def repeat(self, seq, ts=None):
+        """Nothing changed since the newest snapshot: record it again at `ts`. None if there is none."""
+        ts = time.time() if ts is None else ts
+        with self.lock:
+            existing = self.snapshots()
+            if not existing:
+                return None
+            newest = existing[-1][2]
+            path = os.path.join(self.dir, _name(ts, seq, parse_name(os.path.basename(newest))[2]))
+            if self._link(newest, path):
+                return path
+            with open(newest, "rb") as src, open(path + ".tmp", "wb") as dst:
+                dst.write(src.read())
+            os.replace(path + ".tmp", path)
+        return path
+
+    @staticmethod
+    def _link(src, path):
+        if src == path:
+            return True
+        try:
+            os.link(src, path)
+            return True
+        except FileExistsError:
+            return True
+        except OSError:
+            return False   # no hard links on this filesystem: the caller writes a copy
+
+    def load(self, path):
+        with open(path, "rb") as f:
+            return json.loads(gzip.decompress(f.read()).decode("utf-8"))
+
+    def latest_before(self, ts):
+        """(ts, seq, path) of the newest snapshot taken at or before `ts`, or None."""
+        best = None
+        for snap in self.snapshots():
+            if snap[0] <= ts:
+                best = snap
+        return best
+
+    def prune(self, now=None):
+        """
+        Keep the first snapshot of every tier bucket and the newest one,
+        delete the rest; returns the count deleted. Keeping the first (not
+        the last) means any moment in a bucket has a snapshot before it.
+        """
+        now = time.time() if now is None else now
+        seen = set()
+        doomed = []
+        snaps = self.snapshots()
+        for ts, seq, path in snaps[:-1]:
+            age = now - ts
+            tier = next((i for i, (span, _) in enumerate(self.tiers) if age <= span), None)
+            bucket = None if tier is None else (tier, int(ts // self.tiers[tier][1]))
+            if bucket is None or bucket in seen:
+                doomed.append(path)
+            else:
+                seen.add(bucket)
+        with self.lock:
+            for path in doomed:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+        return len(doomed)
@@ -0,0 +1,166 @@
+import asyncio
+import gzip
+import json
+import time
+
+
+DELTA_FORMAT = "casino-delta-1"
+
+
+class Snapshot:
+    """
+    The economy as of one instant: {uid: record dict} plus the generation it
+    was taken at and the journal seq it includes. A full snapshot has every user, a delta only the users
+    changed since the previous snapshot (`changed`). Owned by whoever took
+    it, so it can be serialized from any thread.
+    """
+
+    __slots__ = ("generation", "taken_at", "users", "full", "changed", "seq")
+
+    def __init__(self, generation, taken_at, users, full=True, changed=(), seq=0):
+        self.generation = generation
+        self.seq = seq
+        self.taken_at = taken_at
+        self.users = users
+        self.full = full
+        self.changed = changed
+
+
+def merge_balances(users, column):
+    """Overwrite the gems of `users` with a BalanceColumn.copy() (worker thread)."""
+    uids, values = column
+    for uid, gems in zip(uids, values):
+        u = users.get(str(uid))
+        if isinstance(u, dict):
+            u["gems"] = float(gems)
+    return users
+
+
+def delta_doc(snap, checkpoint, seq):
+    """The document uploaded for a delta snapshot; names the checkpoint it applies to."""
+    return {
+        "format": DELTA_FORMAT,
+        "checkpoint": checkpoint,
+        "seq": seq,
+        "generation": snap.generation,
+        "users": snap.users,
+    }
+
+
+def decode_backup(raw):
+    """Single-file backup bytes (gzip or plain JSON, old backups are plain) -> dict."""
+    if raw[:2] == b"\x1f\x8b":
+        raw = gzip.decompress(raw)
+    return json.loads(raw.decode("utf-8"))
+
+
+def is_delta(doc):
+    return isinstance(doc, dict) and doc.get("format") == DELTA_FORMAT
+
+
+def apply_deltas(state, deltas):
+    """Apply decoded deltas (any order) to a checkpoint's state, oldest first."""
+    for delta in sorted(deltas, key=lambda d: d["seq"]):
+        state.update(delta["users"])
+    return state
+
+
+class BackupChain:
+    """
+    Which kind of backup to upload next: a full checkpoint, then up to
+    `full_every` deltas that each name it, then the next checkpoint.
+    """
+
+    def __init__(self, full_every):
+        self.full_every = full_every
+        self.checkpoint = None   # filename of the current checkpoint
+        self.deltas = 0
+
+    def next_is_full(self):
+        return self.checkpoint is None or self.deltas >= self.full_every
+
+    def record_full(self, filename):
+        self.checkpoint = filename
+        self.deltas = 0
+
+    def record_delta(self):
+        self.deltas += 1
+        return self.deltas
+
+    def reset(self):
+        """The next backup must be a checkpoint (e.g. after a restore)."""
+        self.checkpoint = None
+
+
+class Snapshotter:
+    """
+    Takes consistent snapshots without stopping the games.
+
+    On the event loop, with the write-behind writer paused, it only copies
+    what is not in the store yet: the dirty records (dirty_records()) and
+    the balance column. Reading the store — which can't change while the
+    writer is paused — and merging happen in a worker thread. The loop keeps
+    mutating live records meanwhile; the snapshot never sees those changes.
+    touch(uid) records which users changed, so capture(full=False) can copy
+    only those (delta backups). position() gives the journal seq the
+    captured state includes.
+    """
+
+    def __init__(self, storage, writer, dirty_records, column, position=lambda: 0):
+        self.storage = storage
+        self.writer = writer
+        self.dirty_records = dirty_records
+        self.column = column
+        self.position = position
+        self.generation = 0
+        self.changed = set()   # uids touched since the last capture
+        self.last_capture_seconds = 0.0
+
+    def touch(self, uid):
+        self.changed.add(str(uid))
+
+    def touch_many(self, uids):
+        self.changed.update(str(uid) for uid in uids)
+
+    def rollback(self, snap):
+        """The snapshot was not stored anywhere: count its users as changed again."""
+        self.changed |= snap.changed
+
+    async def capture(self, full=True):
+        """Full snapshot, or (full=False) only the users changed since the last capture."""
+        loop = asyncio.get_running_loop()
+        async with self.writer.paused():
+            started = time.perf_counter()
+            changed, self.changed = self.changed, set()
+            overlay = self.dirty_records()
+            if full:
+                balances = self.column.copy()
+            else:
+                overlay = {uid: u for uid, u in overlay.items() if uid in changed}
+                gems = {uid: self.column.get(uid) for uid in changed}
+            self.generation += 1
+            generation = self.generation
+            taken_at = time.time()
+            seq = self.position()
+            self.last_capture_seconds = time.perf_counter() - started
+            if full:
+                users = await loop.run_in_executor(None, self.storage.load_all)
+            else:
+                rest = [uid for uid in changed if uid not in overlay]
+                users = await loop.run_in_executor(
+                    None, lambda: {uid: self.storage.load_user(uid) for uid in rest}
+                )
+
+        def build():
+            users.update(overlay)
+            if full:
+                merge_balances(users, balances)
+            else:
+                for uid, u in list(users.items()):
+                    if u is None:
+                        del users[uid]
+                    elif gems.get(uid) is not None:
+                        u["gems"] = gems[uid]
+            return Snapshot(generation, taken_at, users, full, changed, seq)
+
+        return await loop.run_in_executor(None, build)
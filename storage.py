@@ -0,0 +1,635 @@
+import heapq
+import json
+import os
+import re
+import sqlite3
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
+
+# Columns every user record has. Anything else a record carries
+# (history, legacy keys like "coins") is kept as JSON in `extra`.
+USER_FIELDS = {
+    "gems": 25.0,
+    "last_daily": 0.0,
+    "last_work": 0.0,
+    "bless_infinite": False,
+    "curse_infinite": False,
+    "bless_charges": 0,
+    "curse_charges": 0,
+}
+
+BOOL_FIELDS = ("bless_infinite", "curse_infinite")
+
+
+# ---------------------- LAZY HISTORY ---------------------- #
+# A legacy "history" array of flat entries; strings may contain brackets
+HISTORY_RE = re.compile(rb'"history"\s*:\s*(\[(?:[^\[\]"]++|"(?:[^"\\]++|\\.)*+")*+\])')
+LAZY_MARKER = "\x00lazy-history:"
+LAZY_MARKER_RE = re.compile(rb'"\\u0000lazy-history:(\d+)"')
+
+
+class LazyHistory:
+    """
+    A record's legacy "history" list, kept as the raw JSON it was read as
+    until someone needs it. Most commands never look at it, so startup
+    doesn't pay for parsing it.
+    """
+
+    __slots__ = ("raw", "value")
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.value = None
+
+    def load(self):
+        if self.value is None:
+            self.value = json.loads(self.raw)
+        return self.value
+
+
+def _history_end(raw, start):
+    """
+    Index just past the history array opening at raw[start], found with
+    bytes.find (C speed): the first "]" with an even number of quotes
+    before it. None if the array holds escapes or nested arrays, which
+    HISTORY_RE handles instead.
+    """
+    end = raw.find(b"]", start)
+    while end != -1:
+        if raw.count(b'"', start, end) % 2 == 0:
+            break
+        end = raw.find(b"]", end + 1)
+    if end == -1 or raw.find(b"\\", start, end) != -1 or raw.find(b"[", start + 1, end) != -1:
+        return None
+    return end + 1
+
+
+def strip_history(raw):
+    """JSON bytes -> (the same JSON with each history array replaced by its index, [arrays])."""
+    payloads = []
+    pieces = []
+    pos = 0
+    key = raw.find(b'"history"')
+    while key != -1:
+        start = raw.find(b"[", key)
+        between = raw[key + len(b'"history"'):start]
+        if start == -1 or between.strip() != b":":
+            key = raw.find(b'"history"', key + 1)   # not a history key followed by an array
+            continue
+        end = _history_end(raw, start)
+        if end is None:
+            m = HISTORY_RE.match(raw, key)
+            end = m.end() if m else None
+        if end is None:
+            key = raw.find(b'"history"', key + 1)   # leave it to the JSON parser
+            continue
+        pieces.append(raw[pos:key])
+        pieces.append(b'"history":%d' % len(payloads))
+        payloads.append(raw[start:end])
+        pos = end
+        key = raw.find(b'"history"', end)
+    pieces.append(raw[pos:])
+    return b"".join(pieces), payloads
+
+
+def attach_history(users, payloads):
+    """Put the arrays cut out by strip_history() back as LazyHistory objects."""
+    for u in users.values():
+        if isinstance(u, dict) and type(u.get("history")) is int:
+            u["history"] = LazyHistory(payloads[u["history"]])
+    return users
+
+
+def dump_json(dumps, doc):
+    """
+    dumps(doc, default) -> bytes, with histories nobody parsed yet written
+    back verbatim instead of being parsed just to be re-encoded.
+    """
+    payloads = []
+
+    def default(o):
+        if isinstance(o, LazyHistory):
+            if o.value is not None:
+                return o.value
+            payloads.append(o.raw)
+            return f"{LAZY_MARKER}{len(payloads) - 1}"
+        raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+    out = dumps(doc, default)
+    if isinstance(out, str):
+        out = out.encode("utf-8")
+    if payloads:
+        out = LAZY_MARKER_RE.sub(lambda m: payloads[int(m.group(1))], out)
+    return out
+
+
+# ---------------------- FILES ---------------------- #
+def read_json_file(path, serializer=None, lazy_history=False):
+    """
+    Read a data file; with a serializer its format is detected (see
+    serializers.py). lazy_history leaves legacy history arrays unparsed
+    (LazyHistory) until a record is copied out of the store.
+    """
+    if serializer is None and not lazy_history:
+        with open(path, "r") as f:
+            return json.load(f)
+    with open(path, "rb") as f:
+        raw = f.read()
+    payloads = []
+    if lazy_history and raw.lstrip()[:1] == b"{":
+        raw, payloads = strip_history(raw)
+    d = serializer.loads(raw) if serializer is not None else json.loads(raw)
+    return attach_history(d, payloads) if payloads else d
+
+
+def write_json_file(path, d, indent=4, serializer=None):
+    # write to a temp file first so a crash mid-write can't truncate the target
+    tmp = path + ".tmp"
+    if serializer is None:
+        raw = dump_json(lambda doc, default: json.dumps(doc, indent=indent, default=default), d)
+    else:
+        raw = serializer.dumps(d)
+    with open(tmp, "wb") as f:
+        f.write(raw)
+    os.replace(tmp, path)
+
+
+def copy_record(u):
+    """
+    Copy of a user record that is safe to hand to another thread.
+    History entries are never mutated after being appended, so copying the
+    list (not the entries) is enough. A LazyHistory is parsed here, on
+    first access.
+    """
+    if not isinstance(u, dict):
+        return u
+    u = dict(u)
+    hist = u.get("history")
+    if isinstance(hist, LazyHistory):
+        u["history"] = list(hist.load())
+    elif isinstance(hist, list):
+        u["history"] = list(hist)
+    return u
+
+
+def is_rigged(u):
+    return bool(
+        u.get("bless_infinite") or u.get("bless_charges", 0) > 0
+        or u.get("curse_infinite") or u.get("curse_charges", 0) > 0
+    )
+
+
+def top_by_gems_in(items, limit, offset=0):
+    """top_by_gems() over an iterable of (uid, record) held in memory."""
+    users = (
+        (uid, u.get("gems", 0)) for uid, u in items
+        if uid.isdigit() and isinstance(u, dict)
+    )
+    return heapq.nlargest(offset + limit, users, key=lambda x: x[1])[offset:]
+
+
+def balances_in(items):
+    """balances() over an iterable of (uid, record) held in memory."""
+    return [
+        (uid, u.get("gems", 0)) for uid, u in items
+        if uid.isdigit() and isinstance(u, dict)
+    ]
+
+
+def update_gems_in(users, balances):
+    """update_gems() for {uid: record} held in memory; True if anything changed."""
+    changed = False
+    for uid, gems in balances.items():
+        u = users.get(uid)
+        if isinstance(u, dict):
+            u["gems"] = gems
+            changed = True
+    return changed
+
+
+def rigged_in(items):
+    """rigged_users() over an iterable of (uid, record) held in memory."""
+    return {
+        uid: u for uid, u in items
+        if uid.isdigit() and isinstance(u, dict) and is_rigged(u)
+    }
+
+
+def history_holders_in(items):
+    """users_with_history() over an iterable of (uid, record) held in memory."""
+    return [
+        uid for uid, u in items
+        if uid.isdigit() and isinstance(u, dict) and u.get("history")
+    ]
+
+
+class Storage:
+    """
+    Where user records live between restarts.
+
+    Keys are the string user ids used by `data`. Keys that are not digits
+    are bot-wide values (not users) and are passed through untouched.
+    Methods are blocking; callers run them in an executor.
+    """
+
+    def load_all(self):
+        raise NotImplementedError
+
+    def load_user(self, uid):
+        """A private copy of one record, or None. Called on the event loop."""
+        raise NotImplementedError
+
+    def save_users(self, users):
+        """Upsert {uid: record} for the given users only."""
+        raise NotImplementedError
+
+    def replace_all(self, d):
+        """Drop everything and store `d` (used by restores / migration)."""
+        raise NotImplementedError
+
+    def update_gems(self, balances):
+        """Set only the balance of the given {uid: gems}; unknown users are skipped."""
+        raise NotImplementedError
+
+    def balances(self):
+        """[(uid, gems)] for every user."""
+        raise NotImplementedError
+
+    def top_by_gems(self, limit, offset=0):
+        """[(uid, gems)] sorted by gems, richest first."""
+        raise NotImplementedError
+
+    def rigged_users(self):
+        """{uid: record} of users with an active bless or curse."""
+        raise NotImplementedError
+
+    def count_users(self):
+        raise NotImplementedError
+
+    def users_with_history(self):
+        """Ids of records that still carry a legacy "history" list (nothing is parsed)."""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+# ---------------------- JSON FILE ---------------------- #
+class JsonStorage(Storage):
+    """
+    The original single-file layout. Every save rewrites the whole file,
+    so it keeps its own copy of all records. Fine for small servers.
+    """
+
+    def __init__(self, path, serializer=None, lazy_history=False):
+        self.path = path
+        self.serializer = serializer
+        self.lock = threading.Lock()
+        if not os.path.exists(path):
+            write_json_file(path, {}, serializer=serializer)
+        self.users = read_json_file(path, serializer, lazy_history)
+
+    def load_all(self):
+        with self.lock:
+            return {uid: copy_record(u) for uid, u in self.users.items()}
+
+    def load_user(self, uid):
+        with self.lock:
+            u = self.users.get(uid)
+        return None if u is None else copy_record(u)
+
+    def save_users(self, users):
+        with self.lock:
+            self.users.update(users)
+            write_json_file(self.path, self.users, serializer=self.serializer)
+
+    def replace_all(self, d):
+        with self.lock:
+            self.users = {uid: copy_record(u) for uid, u in d.items()}
+            write_json_file(self.path, self.users, serializer=self.serializer)
+
+    def update_gems(self, balances):
+        with self.lock:
+            if update_gems_in(self.users, balances):
+                write_json_file(self.path, self.users, serializer=self.serializer)
+
+    def balances(self):
+        with self.lock:
+            return balances_in(self.users.items())
+
+    def top_by_gems(self, limit, offset=0):
+        with self.lock:
+            return top_by_gems_in(self.users.items(), limit, offset)
+
+    def rigged_users(self):
+        with self.lock:
+            return rigged_in(self.users.items())
+
+    def count_users(self):
+        with self.lock:
+            return sum(1 for uid in self.users if uid.isdigit())
+
+    def users_with_history(self):
+        with self.lock:
+            return history_holders_in(self.users.items())
+
+
+# ---------------------- SHARDED JSON ---------------------- #
+def shard_of(uid, shards):
+    # crc32 rather than hash(): str hashes change between runs
+    return zlib.crc32(str(uid).encode()) % shards
+
+
+class ShardedJsonStorage(Storage):
+    """
+    The JSON layout split over `shards` files by user-id hash.
+    A save rewrites only the shards that hold one of the saved users,
+    each of them once, however many of its users changed.
+    """
+
+    def __init__(self, directory, shards=16, workers=8, serializer=None, lazy_history=False):
+        self.dir = directory
+        self.shards = shards
+        self.serializer = serializer
+        self.lazy_history = lazy_history
+        self.workers = workers
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.manifest_path = os.path.join(directory, "manifest.json")
+
+        stored = shards
+        if os.path.exists(self.manifest_path):
+            stored = read_json_file(self.manifest_path).get("shards", shards)
+        self.data = self._load_shards(stored)
+
+        if stored != shards:
+            # shard count changed: redistribute everything once
+            users = dict(chain.from_iterable(d.items() for d in self.data))
+            self.replace_all(users)
+        elif not os.path.exists(self.manifest_path):
+            write_json_file(self.manifest_path, {"shards": shards})
+
+    def _path(self, i):
+        return os.path.join(self.dir, f"shard-{i:03d}.json")
+
+    def _read_shard(self, path):
+        return read_json_file(path, self.serializer, self.lazy_history) if os.path.exists(path) else {}
+
+    def _load_shards(self, count):
+        # shards are independent files, so read (and parse) them in parallel
+        paths = [self._path(i) for i in range(count)]
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            return list(pool.map(self._read_shard, paths))
+
+    def _write_shards(self, indexes):
+        indexes = sorted(indexes)
+        if len(indexes) == 1:
+            write_json_file(self._path(indexes[0]), self.data[indexes[0]], serializer=self.serializer)
+            return
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            list(pool.map(
+                lambda i: write_json_file(self._path(i), self.data[i], serializer=self.serializer), indexes
+            ))
+
+    def _items(self):
+        return chain.from_iterable(d.items() for d in self.data)
+
+    def load_all(self):
+        with self.lock:
+            return {uid: copy_record(u) for uid, u in self._items()}
+
+    def load_user(self, uid):
+        with self.lock:
+            u = self.data[shard_of(uid, self.shards)].get(uid)
+        return None if u is None else copy_record(u)
+
+    def save_users(self, users):
+        with self.lock:
+            dirty_shards = set()
+            for uid, u in users.items():
+                i = shard_of(uid, self.shards)
+                self.data[i][uid] = u
+                dirty_shards.add(i)
+            if dirty_shards:
+                self._write_shards(dirty_shards)
+
+    def replace_all(self, d):
+        with self.lock:
+            self.data = [{} for _ in range(self.shards)]
+            for uid, u in d.items():
+                self.data[shard_of(uid, self.shards)][uid] = copy_record(u)
+            self._write_shards(range(self.shards))
+            write_json_file(self.manifest_path, {"shards": self.shards})
+
+    def update_gems(self, balances):
+        with self.lock:
+            by_shard = {}
+            for uid, gems in balances.items():
+                by_shard.setdefault(shard_of(uid, self.shards), {})[uid] = gems
+            dirty_shards = [i for i, part in by_shard.items() if update_gems_in(self.data[i], part)]
+            if dirty_shards:
+                self._write_shards(dirty_shards)
+
+    def balances(self):
+        with self.lock:
+            return balances_in(self._items())
+
+    def top_by_gems(self, limit, offset=0):
+        with self.lock:
+            return top_by_gems_in(self._items(), limit, offset)
+
+    def rigged_users(self):
+        with self.lock:
+            return rigged_in(self._items())
+
+    def count_users(self):
+        with self.lock:
+            return sum(1 for uid, _ in self._items() if uid.isdigit())
+
+    def users_with_history(self):
+        with self.lock:
+            return history_holders_in(self._items())
+
+
+# ---------------------- SQLITE ---------------------- #
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    uid            INTEGER PRIMARY KEY,
+    gems           REAL    NOT NULL DEFAULT 25.0,
+    last_daily     REAL    NOT NULL DEFAULT 0,
+    last_work      REAL    NOT NULL DEFAULT 0,
+    bless_infinite INTEGER NOT NULL DEFAULT 0,
+    curse_infinite INTEGER NOT NULL DEFAULT 0,
+    bless_charges  INTEGER NOT NULL DEFAULT 0,
+    curse_charges  INTEGER NOT NULL DEFAULT 0,
+    extra          TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_users_gems ON users(gems);
+CREATE INDEX IF NOT EXISTS idx_users_last_daily ON users(last_daily);
+CREATE INDEX IF NOT EXISTS idx_users_last_work ON users(last_work);
+CREATE INDEX IF NOT EXISTS idx_users_bless ON users(bless_infinite, bless_charges);
+CREATE INDEX IF NOT EXISTS idx_users_curse ON users(curse_infinite, curse_charges);
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+USER_COLUMNS = ["uid"] + list(USER_FIELDS) + ["extra"]
+UPSERT_USER = (
+    f"INSERT OR REPLACE INTO users ({', '.join(USER_COLUMNS)}) "
+    f"VALUES ({', '.join('?' for _ in USER_COLUMNS)})"
+)
+SELECT_USER = f"SELECT {', '.join(USER_COLUMNS)} FROM users"
+
+
+def user_to_row(uid, u):
+    row = [int(uid)]
+    for key, default in USER_FIELDS.items():
+        value = u.get(key, default)
+        row.append(int(bool(value)) if key in BOOL_FIELDS else value)
+    extra = {k: v for k, v in u.items() if k not in USER_FIELDS}
+    row.append(json.dumps(extra, separators=(",", ":")) if extra else None)
+    return row
+
+
+def row_to_user(row):
+    u = {}
+    for key, value in zip(USER_FIELDS, row[1:-1]):
+        u[key] = bool(value) if key in BOOL_FIELDS else value
+    if row[-1]:
+        u.update(json.loads(row[-1]))
+    return str(row[0]), u
+
+
+class SqliteStorage(Storage):
+    """
+    One row per user in a WAL-mode SQLite database.
+    A save only touches the rows of the users that changed.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.lock = threading.Lock()
+        with self.lock:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.executescript(SQLITE_SCHEMA)
+
+    def _write(self, users, clear=False):
+        rows = []
+        meta = []
+        for uid, u in users.items():
+            if str(uid).isdigit() and isinstance(u, dict):
+                rows.append(user_to_row(uid, u))
+            else:
+                meta.append((str(uid), json.dumps(u)))
+        with self.lock:
+            self.conn.execute("BEGIN")
+            try:
+                if clear:
+                    self.conn.execute("DELETE FROM users")
+                    self.conn.execute("DELETE FROM meta")
+                self.conn.executemany(UPSERT_USER, rows)
+                self.conn.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", meta)
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def load_all(self):
+        d = {}
+        with self.lock:
+            for row in self.conn.execute(SELECT_USER):
+                uid, u = row_to_user(row)
+                d[uid] = u
+            for key, value in self.conn.execute("SELECT key, value FROM meta"):
+                d[key] = json.loads(value)
+        return d
+
+    def load_user(self, uid):
+        with self.lock:
+            if not str(uid).isdigit():
+                row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (uid,)).fetchone()
+                return None if row is None else json.loads(row[0])
+            row = self.conn.execute(f"{SELECT_USER} WHERE uid = ?", (int(uid),)).fetchone()
+        return None if row is None else row_to_user(row)[1]
+
+    def save_users(self, users):
+        self._write(users)
+
+    def replace_all(self, d):
+        self._write(d, clear=True)
+
+    def update_gems(self, balances):
+        rows = [(gems, int(uid)) for uid, gems in balances.items()]
+        with self.lock:
+            self.conn.execute("BEGIN")
+            try:
+                self.conn.executemany("UPDATE users SET gems = ? WHERE uid = ?", rows)
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def balances(self):
+        with self.lock:
+            rows = self.conn.execute("SELECT uid, gems FROM users").fetchall()
+        return [(str(uid), gems) for uid, gems in rows]
+
+    def top_by_gems(self, limit, offset=0):
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT uid, gems FROM users ORDER BY gems DESC LIMIT ? OFFSET ?",
+                (limit, offset)
+            ).fetchall()
+        return [(str(uid), gems) for uid, gems in rows]
+
+    def rigged_users(self):
+        with self.lock:
+            rows = self.conn.execute(
+                f"{SELECT_USER} WHERE bless_infinite = 1 OR bless_charges > 0 "
+                "OR curse_infinite = 1 OR curse_charges > 0"
+            ).fetchall()
+        return dict(row_to_user(row) for row in rows)
+
+    def count_users(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+
+    def users_with_history(self):
+        # legacy keys live in the `extra` JSON column
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT uid, extra FROM users WHERE extra LIKE '%\"history\"%'"
+            ).fetchall()
+        return [str(uid) for uid, extra in rows if json.loads(extra).get("history")]
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+def open_storage(backend, json_path, sqlite_path=None, shard_dir=None, shards=16, serializer=None,
+                 lazy_history=False):
+    """
+    backend: "json" (single file), "sqlite" or "sharded" (JSON shard files).
+    The first time an empty SQLite / sharded store is opened it imports
+    the JSON file. `serializer` (serializers.py) sets the file format of
+    the json/sharded backends; files in any format are read. lazy_history
+    makes those backends parse legacy history lists only when needed.
+    """
+    if backend == "json":
+        return JsonStorage(json_path, serializer, lazy_history)
+    if backend == "sqlite":
+        store = SqliteStorage(sqlite_path)
+    elif backend == "sharded":
+        store = ShardedJsonStorage(shard_dir, shards, serializer=serializer, lazy_history=lazy_history)
+    else:
+        raise ValueError(f"unknown storage backend: {backend!r}")
+    if store.count_users() == 0 and os.path.exists(json_path):
+        store.replace_all(read_json_file(json_path, serializer))
+    return store
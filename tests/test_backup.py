@@ -0,0 +1,138 @@
+import asyncio
+import itertools
+import os
+import sys
+import types
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+pytest.importorskip("discord")
+
+from backup_parts import BackupError, read_manifest  # noqa: E402
+
+
+class FakeAttachment:
+    def __init__(self, filename, data):
+        self.filename = filename
+        self.data = data
+
+    async def read(self):
+        return self.data
+
+
+class FakeChannel:
+    """Keeps every message sent to it, attachments included, and hands them back by id."""
+
+    def __init__(self):
+        self.messages = []
+        self.ids = itertools.count(1000)
+
+    async def send(self, content=None, embed=None, file=None, files=None):
+        sent = ([file] if file is not None else []) + list(files or [])
+        attachments = [FakeAttachment(f.filename, f.fp.read()) for f in sent]
+        msg = types.SimpleNamespace(id=next(self.ids), embed=embed, attachments=attachments)
+        self.messages.append(msg)
+        return msg
+
+    async def fetch_message(self, message_id):
+        for msg in self.messages:
+            if msg.id == message_id:
+                return msg
+        raise LookupError(message_id)
+
+    def manifest(self):
+        return read_manifest(self.messages[-1].attachments[0].data)
+
+    def part(self, name):
+        for msg in self.messages:
+            for att in msg.attachments:
+                if att.filename == name:
+                    return msg, att
+        raise LookupError(name)
+
+
+@pytest.fixture(scope="module")
+def main(tmp_path_factory):
+    # main keeps its files in the working directory
+    cwd = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp("casino"))
+    try:
+        import main
+        yield main
+    finally:
+        os.chdir(cwd)
+
+
+@pytest.fixture
+def channel(main, monkeypatch):
+    channel = FakeChannel()
+    monkeypatch.setattr(main.bot, "get_channel", lambda channel_id: channel)
+    monkeypatch.setattr(main, "BACKUP_PART_BYTES", 1024)
+    return channel
+
+
+def backed_up(main, channel):
+    """Credit a thousand users, take a full backup into `channel`; returns their balances."""
+    async def work():
+        for uid in range(1, 1001):
+            await main.wallet.credit(uid, uid * 1000.5, "test")
+        return await main.backup_to_channel("test", full=True)
+
+    assert asyncio.run(work()) is not None
+    return {str(uid): main.wallet.balance(uid) for uid in range(1, 1001)}
+
+
+def test_multi_part_round_trip(main, channel):
+    balances = backed_up(main, channel)
+    manifest = channel.manifest()
+    assert len(manifest["parts"]) > 1
+    assert all(len(channel.part(entry["name"])[1].data) <= 1024 for entry in manifest["parts"])
+
+    doc = asyncio.run(main.read_packed_backup(channel, manifest))
+    assert {uid: doc[uid]["gems"] for uid in balances} == balances
+
+
+def test_missing_part_is_reported(main, channel):
+    backed_up(main, channel)
+    manifest = channel.manifest()
+    name = manifest["parts"][-1]["name"]
+    msg, att = channel.part(name)
+    msg.attachments.remove(att)
+
+    with pytest.raises(BackupError, match="missing"):
+        asyncio.run(main.read_packed_backup(channel, manifest))
+
+
+def test_damaged_part_fails_its_checksum(main, channel):
+    backed_up(main, channel)
+    manifest = channel.manifest()
+    _, att = channel.part(manifest["parts"][1]["name"])
+    att.data = att.data[:-1] + bytes([att.data[-1] ^ 1])
+
+    with pytest.raises(BackupError, match="checksum"):
+        asyncio.run(main.read_packed_backup(channel, manifest))
+
+
+def test_backup_carries_bet_history(main, channel):
+    entries = [
+        {"game": "slots", "bet": 10.0, "result": "win", "earned": 30.0, "timestamp": 1.0},
+        {"game": "weird_game", "bet": 5.0, "result": "lose", "earned": -5.0, "timestamp": 2.0},
+    ]
+
+    async def work():
+        await main.wallet.credit(4242, 100, "test")
+        for entry in entries:
+            main.add_history(4242, entry)
+        await main.backup_to_channel("test", full=True)
+        doc = await main.read_packed_backup(channel, channel.manifest())
+        assert main.HISTORY_TOTALS_KEY in doc["4242"]
+        await main.history_writer.flush()
+        main.history_store.replace_users({"4242": []}, {"4242": {}})
+        return await main.replace_data(doc)
+
+    restored = asyncio.run(work())
+    assert restored >= 1
+    assert main.history_store.recent("4242") == entries
+    assert set(main.history_store.totals("4242")) == {"slots", "weird_game"}
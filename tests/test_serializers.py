@@ -0,0 +1,49 @@
+import os
+import struct
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from serializers import BinaryRecords, StreamDecoder, decode  # noqa: E402
+
+RECORD = {
+    "gems": 10.5, "last_daily": 0.0, "last_work": 1.0,
+    "bless_infinite": True, "curse_infinite": False, "bless_charges": 2, "curse_charges": 0,
+}
+DOC = {
+    "1": RECORD,
+    "2": dict(RECORD, coins=5, history=[{"game": "slots"}]),
+    "3": {"gems": 7},
+    "bob": {"gems": 1.0},
+}
+
+
+def test_binary_round_trip():
+    assert decode(BinaryRecords().dumps(DOC)) == DOC
+    assert decode(BinaryRecords().dumps([1, "two"])) == [1, "two"]
+
+
+@pytest.mark.parametrize("damage", [
+    lambda raw: raw[:-1],                                   # truncated
+    lambda raw: raw + b"\x00",                              # trailing bytes
+    lambda raw: raw[:5] + struct.pack("<I", 9) + raw[9:],  # more rows than there are
+    lambda raw: raw[:41] + b"\x04" + raw[42:],              # unknown flags in the first row
+    lambda raw: raw[:-2] + b"!}",                           # what follows the rows isn't JSON
+])
+def test_binary_rejects_malformed_input(damage):
+    with pytest.raises(ValueError):
+        decode(damage(BinaryRecords().dumps(DOC)))
+
+
+@pytest.mark.parametrize("pieces", [
+    [b'{"a":1.', b'5,"b":2}'],   # a number split at the decimal point
+    [b'{"a":1', b'.5,"b":2}'],
+    [b'{"a":1.5', b',"b":2}'],
+])
+def test_stream_waits_for_numbers_split_across_pieces(pieces):
+    decoder = StreamDecoder()
+    for piece in pieces:
+        decoder.feed(piece)
+    assert decoder.finish() == {"a": 1.5, "b": 2}
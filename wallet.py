@@ -0,0 +1,134 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+
+class LockManager:
+    """
+    One asyncio.Lock per key, created on first use and dropped again as
+    soon as nobody holds or waits for it, so idle users cost nothing.
+    """
+
+    def __init__(self):
+        self.locks = {}   # key -> [lock, users]
+        self.barrier = None           # set while hold_all() waits or runs
+        self.all_lock = asyncio.Lock()
+        self.drained = asyncio.Event()
+        self.drained.set()
+
+    @asynccontextmanager
+    async def hold(self, *keys):
+        """Lock several keys at once (sorted, so two holders can't deadlock)."""
+        while self.barrier is not None:
+            await self.barrier.wait()
+        keys = sorted(set(keys))
+        entries = []
+        for key in keys:
+            entry = self.locks.get(key)
+            if entry is None:
+                entry = self.locks[key] = [asyncio.Lock(), 0]
+            entry[1] += 1
+            entries.append((key, entry))
+        acquired = []
+        try:
+            for _, entry in entries:
+                await entry[0].acquire()
+                acquired.append(entry[0])
+            yield
+        finally:
+            for lock in reversed(acquired):
+                lock.release()
+            for key, entry in entries:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self.locks[key]
+            if not self.locks:
+                self.drained.set()
+
+    @asynccontextmanager
+    async def hold_all(self):
+        """
+        Exclusive access to every key: waits for current holders to finish
+        and keeps new ones out until the block ends (economy-wide commands).
+        """
+        async with self.all_lock:
+            self.barrier = asyncio.Event()
+            try:
+                while self.locks:
+                    self.drained.clear()
+                    await self.drained.wait()
+                yield
+            finally:
+                barrier, self.barrier = self.barrier, None
+                barrier.set()
+
+    async def close(self):
+        """hold_all() for good: waits for current holders, then keeps everyone out (shutdown)."""
+        await self.all_lock.acquire()
+        self.barrier = asyncio.Event()
+        while self.locks:
+            self.drained.clear()
+            await self.drained.wait()
+
+    def __len__(self):
+        return len(self.locks)
+
+
+class Wallet:
+    """
+    The only way handlers move gems. Every operation takes the user's lock,
+    so a balance check and the change it guards can't interleave with
+    another button click or command of the same user.
+    - peek(uid) returns a read-only record, ensure(uid) materializes one
+    - adjust(uid, delta, kind) applies and journals a change (no locking)
+    Use `async with wallet.hold(uid):` to run several steps under one lock;
+    the *_locked variants are for code already holding it.
+    """
+
+    def __init__(self, peek, ensure, adjust):
+        self.peek = peek
+        self.ensure = ensure
+        self.adjust = adjust
+        self.locks = LockManager()
+
+    def hold(self, *user_ids):
+        return self.locks.hold(*(int(uid) for uid in user_ids))
+
+    def hold_all(self):
+        return self.locks.hold_all()
+
+    async def close(self):
+        """Wait for the changes in flight; any later one waits forever (shutdown)."""
+        await self.locks.close()
+
+    def balance(self, user_id):
+        return self.peek(user_id)["gems"]
+
+    # ---------------------- UNDER LOCK ---------------------- #
+    def debit_locked(self, user_id, amount, kind):
+        if amount < 0 or self.peek(user_id)["gems"] < amount:
+            return None
+        self.ensure(user_id)
+        return self.adjust(user_id, -amount, kind)
+
+    def credit_locked(self, user_id, amount, kind):
+        self.ensure(user_id)
+        return self.adjust(user_id, amount, kind)
+
+    # ---------------------- ATOMIC OPERATIONS ---------------------- #
+    async def debit_if_sufficient(self, user_id, amount, kind):
+        """Take `amount` if the user has it; returns the new balance or None."""
+        async with self.hold(user_id):
+            return self.debit_locked(user_id, amount, kind)
+
+    async def credit(self, user_id, amount, kind):
+        """Add `amount` (may be negative for admin corrections); returns the new balance."""
+        async with self.hold(user_id):
+            return self.credit_locked(user_id, amount, kind)
+
+    async def transfer(self, from_id, to_id, amount, kind_out, kind_in):
+        """Move `amount` between two users; False if the sender is short."""
+        async with self.hold(from_id, to_id):
+            if self.debit_locked(from_id, amount, kind_out) is None:
+                return False
+            self.credit_locked(to_id, amount, kind_in)
+            return True